@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AdsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ads'
+
+    def ready(self):
+        # поддержка поискового индекса и прочих производных данных в актуальном состоянии
+        from . import signals  # noqa: F401
+
+        from django.conf import settings
+        from PIL import Image
+        # Граница Pillow для всех Image.open; загрузки проверяются строже (ads/uploads.py)
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
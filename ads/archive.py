@@ -0,0 +1,287 @@
+"""
+Холодный архив истекших объявлений.
+
+Вместо удаления без следа очистка (ads/cleanup.py с archive=True) переносит
+объявление, его города и пути фото в отдельный SQLite-файл AD_ARCHIVE_PATH.
+Каждая запись — сжатый zlib JSON плюс колонки для индексов: номер телефона
+и дата подачи. Архив только дополняется: восстановление (restore_archived_ads)
+лишь отмечает запись restored_at, повторная архивация того же объявления
+добавит новую строку. Основная таблица ads_ad остаётся маленькой, а на вопрос
+«подавал ли этот номер объявления в прошлом году» отвечает индекс по телефону.
+
+Пути фото лежат в записи. Пока она не восстановлена, архив держит ссылку
+на файлы blobs/ (MediaBlob.refcount), и ни очистка, ни collect_orphan_media
+их не удалят; ссылку снимает восстановление или purge_archived_media через
+AD_ARCHIVE_MEDIA_DAYS дней. Файлы вне blobs/ при архивации удаляются как раньше.
+"""
+import json
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from categories.models import Category
+from users.models import User
+from .models import Ad, AdPhoto, City
+from .storage import delete_unused, is_blob, release
+from .utils import normalize_phone, prefix_range
+
+ARCHIVE_LOOKUP_LIMIT = 100
+
+# Один формат строк дат: сравнение строк совпадает с хронологическим
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_ads (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ad_id INTEGER NOT NULL,
+    phone TEXT,
+    created_at TEXT NOT NULL,
+    archived_at TEXT NOT NULL,
+    restored_at TEXT,
+    media_released_at TEXT,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archived_ads_phone_idx ON archived_ads (phone, created_at);
+CREATE INDEX IF NOT EXISTS archived_ads_created_idx ON archived_ads (created_at);
+CREATE INDEX IF NOT EXISTS archived_ads_ad_idx ON archived_ads (ad_id);
+"""
+
+
+def format_date(value):
+    # При USE_TZ даты из базы в UTC; границы поиска в местном поясе приводятся к нему же
+    if value and timezone.is_aware(value):
+        value = value.astimezone(dt_timezone.utc)
+    return value.strftime(DATE_FORMAT) if value else None
+
+
+def connect(path=None):
+    path = path or settings.AD_ARCHIVE_PATH
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(archived_ads)')}
+    if 'media_released_at' not in columns:
+        # Архив прежней версии: ссылки на файлы его записей сняты ещё при архивации
+        with connection:
+            connection.execute('ALTER TABLE archived_ads ADD COLUMN media_released_at TEXT')
+            connection.execute('UPDATE archived_ads SET media_released_at = archived_at')
+    return connection
+
+
+def pack(record):
+    return zlib.compress(json.dumps(record, ensure_ascii=False).encode())
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload))
+
+
+def collect_records(ad_ids):
+    """Снимок объявлений для архива: поля, города и пути фото, по одному запросу на каждое."""
+    records = {
+        row['id']: {
+            'id': row['id'],
+            'description': row['description'],
+            'contact_phone': row['contact_phone'],
+            'phone_normalized': row['phone_normalized'],
+            'category_id': row['category_id'],
+            'category': row['category__name_kg'],
+            'author_id': row['author_id'],
+            'is_confident': row['is_confident'],
+            'is_paid': row['is_paid'],
+            'created_at': format_date(row['created_at']),
+            'updated_at': format_date(row['updated_at']),
+            'expires_at': format_date(row['expires_at']),
+            'cities': [],
+            'photos': [],
+        }
+        for row in Ad.objects.filter(id__in=ad_ids).values(
+            'id', 'description', 'contact_phone', 'phone_normalized', 'category_id', 'category__name_kg',
+            'author_id', 'is_confident', 'is_paid', 'created_at', 'updated_at', 'expires_at',
+        )
+    }
+    links = Ad.cities.through.objects.filter(ad_id__in=ad_ids)\
+                                     .order_by('id')\
+                                     .values_list('ad_id', 'city_id', 'city__name')
+    for ad_id, city_id, name in links:
+        records[ad_id]['cities'].append({'id': city_id, 'name': name})
+    photos = AdPhoto.objects.filter(ad_id__in=ad_ids).order_by('id').values_list('ad_id', 'image')
+    for ad_id, path in photos:
+        if path:
+            records[ad_id]['photos'].append(path)
+    return list(records.values())
+
+
+def append(records, now, path=None):
+    """
+    Дописывает записи в архив. Объявление, уже лежащее в архиве и не
+    восстановленное, второй раз не пишется: пачку, чья транзакция удаления
+    откатилась, можно безопасно архивировать заново.
+    """
+    rows = [
+        (
+            record['id'],
+            record['phone_normalized'] or normalize_phone(record['contact_phone']) or record['contact_phone'],
+            record['created_at'],
+            format_date(now),
+            pack(record),
+            record['id'],
+        )
+        for record in records
+    ]
+    with closing(connect(path)) as connection, connection:
+        connection.executemany(
+            """
+            INSERT INTO archived_ads (ad_id, phone, created_at, archived_at, payload)
+            SELECT ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM archived_ads WHERE ad_id = ? AND restored_at IS NULL
+            )
+            """,
+            rows,
+        )
+    return len(rows)
+
+
+ENTRY_COLUMNS = 'seq, archived_at, restored_at, media_released_at, payload'
+
+
+def row_to_entry(row):
+    seq, archived_at, restored_at, media_released_at, payload = row
+    entry = unpack(payload)
+    entry['archive_id'] = seq
+    entry['archived_at'] = archived_at
+    entry['restored_at'] = restored_at
+    entry['media_released_at'] = media_released_at
+    return entry
+
+
+def lookup_by_phone(prefix, date_from=None, date_to=None, limit=ARCHIVE_LOOKUP_LIMIT, path=None):
+    """
+    Архивные объявления с номером на префикс prefix (форма 996XXXXXXXXX),
+    поданные в [date_from, date_to), новые первыми.
+    """
+    lower, upper = prefix_range(prefix)
+    sql = f'SELECT {ENTRY_COLUMNS} FROM archived_ads WHERE phone >= ? AND phone < ?'
+    params = [lower, upper]
+    if date_from:
+        sql += ' AND created_at >= ?'
+        params.append(format_date(date_from))
+    if date_to:
+        sql += ' AND created_at < ?'
+        params.append(format_date(date_to))
+    sql += ' ORDER BY created_at DESC LIMIT ?'
+    params.append(limit)
+    with closing(connect(path)) as connection:
+        return [row_to_entry(row) for row in connection.execute(sql, params)]
+
+
+def pending_restore(ad_ids=None, phone_prefix=None, path=None):
+    """Невосстановленные записи по id объявлений и/или префиксу номера."""
+    sql = f'SELECT {ENTRY_COLUMNS} FROM archived_ads WHERE restored_at IS NULL'
+    params = []
+    if ad_ids:
+        sql += f' AND ad_id IN ({", ".join("?" * len(ad_ids))})'
+        params.extend(ad_ids)
+    if phone_prefix:
+        lower, upper = prefix_range(phone_prefix)
+        sql += ' AND phone >= ? AND phone < ?'
+        params.extend([lower, upper])
+    sql += ' ORDER BY seq'
+    with closing(connect(path)) as connection:
+        return [row_to_entry(row) for row in connection.execute(sql, params)]
+
+
+def mark_restored(archive_ids, now, path=None):
+    if not archive_ids:
+        return
+    with closing(connect(path)) as connection, connection:
+        connection.executemany(
+            'UPDATE archived_ads SET restored_at = ? WHERE seq = ?',
+            [(format_date(now), archive_id) for archive_id in archive_ids],
+        )
+
+
+def mark_media_released(archive_ids, now, path=None):
+    if not archive_ids:
+        return
+    with closing(connect(path)) as connection, connection:
+        connection.executemany(
+            'UPDATE archived_ads SET media_released_at = ? WHERE seq = ? AND media_released_at IS NULL',
+            [(format_date(now), archive_id) for archive_id in archive_ids],
+        )
+
+
+def release_media(entries):
+    """
+    Снимает ссылки записей на файлы blobs/. Вызывается после
+    mark_media_released: сбой между шагами оставит лишнюю ссылку, но не
+    снимет чужую.
+    """
+    storage = AdPhoto._meta.get_field('image').storage
+    held = [path for entry in entries if not entry['media_released_at'] for path in entry['photos'] if is_blob(path)]
+    with transaction.atomic():
+        delete_unused(storage, release(held))
+
+
+def purge_media(before, path=None):
+    """
+    Отпускает файлы невосстановленных записей, заархивированных раньше
+    before. Сами записи остаются для поиска по номеру. Возвращает их число.
+    """
+    with closing(connect(path)) as connection:
+        entries = [
+            row_to_entry(row) for row in connection.execute(
+                f'SELECT {ENTRY_COLUMNS} FROM archived_ads '
+                'WHERE restored_at IS NULL AND media_released_at IS NULL AND archived_at < ? ORDER BY seq',
+                [format_date(before)],
+            )
+        ]
+    mark_media_released([entry['archive_id'] for entry in entries], timezone.now(), path)
+    release_media(entries)
+    return len(entries)
+
+
+def restore_entry(entry, path=None):
+    """
+    Возвращает архивную запись в живую таблицу с тем же id. Дата подачи —
+    момент восстановления: объявление встаёт в начало ленты, и срок жизни
+    отсчитывается заново (исходная дата остаётся в архиве). Фото
+    подключаются только те, чьи файлы ещё лежат на диске; ссылка архива
+    на них переходит к восстановленным фото.
+    Возвращает объявление или None, если восстанавливать нечего или некуда.
+    """
+    if Ad.objects.filter(id=entry['id']).exists():
+        return None
+    category = Category.objects.filter(id=entry['category_id']).first()
+    if category is None:
+        return None
+
+    storage = AdPhoto._meta.get_field('image').storage
+    mark_media_released([entry['archive_id']], timezone.now(), path)
+    with transaction.atomic():
+        ad = Ad(
+            id=entry['id'],
+            description=entry['description'],
+            contact_phone=entry['contact_phone'],
+            phone_normalized=entry['phone_normalized'],
+            category=category,
+            author_id=entry['author_id'] if User.objects.filter(id=entry['author_id']).exists() else None,
+            is_confident=entry['is_confident'],
+            is_paid=entry['is_paid'],
+        )
+        ad.save()
+        ad.cities.set(City.objects.filter(id__in=[city['id'] for city in entry['cities']]))
+        for photo_path in entry['photos']:
+            if storage.exists(photo_path):
+                AdPhoto.objects.create(ad=ad, image=photo_path)
+        # Фото выше взяли свои ссылки, архивная больше не нужна
+        release_media([entry])
+    return ad
@@ -0,0 +1,205 @@
+"""
+Пакетная очистка истекших объявлений.
+
+Истекшие id выбираются пачками по индексу expires_at. Каждая пачка удаляется
+в одной транзакции вместе со счётчиками, журналом удалений и поисковым
+индексом. После коммита сбрасывается кэш лент, а пути фото передаются
+пулу потоков на удаление с диска.
+
+После каждой пачки прогресс пишется в JSON-чекпоинт: прерванный запуск
+(таймаут, падение, --max-seconds) продолжит с тем же порогом времени и
+сначала дочистит файлы, которые не успел удалить. Параллельный запуск
+не стартует: чекпоинт защищён flock.
+
+С archive=True (или ARCHIVE_EXPIRED_ADS) пачка перед удалением
+дописывается в холодный архив ads/archive.py.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import archive as ad_archive, counters, sync
+from .images import variant_paths
+from .models import Ad, AdPhoto
+from .search import get_search_backend
+from .signals import bulk_operation, feeds_changed
+from .storage import is_blob, release
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки
+    fcntl = None
+
+CLEANUP_BATCH_SIZE = 500
+CLEANUP_WORKERS = 8
+
+
+class CleanupLocked(Exception):
+    pass
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock_file = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.lock_file = open(self.path + '.lock', 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                raise CleanupLocked(self.path)
+
+    def release(self):
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, state):
+        # Через временный файл: оборванная запись не испортит чекпоинт
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def delete_files(storage, paths, workers):
+    """Удаляет файлы пулом потоков, возвращает число удалённых."""
+    def delete(path):
+        try:
+            storage.delete(path)
+            return True
+        except OSError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(delete, paths))
+
+
+def delete_ads_batch(ad_ids, archive=False):
+    """
+    Удаляет объявления одной транзакцией и поддерживает всё, что обычно делают
+    сигналы на каждое объявление. Возвращает пути фото для удаления с диска.
+    archive — сначала переписать пачку в холодный архив.
+    """
+    with transaction.atomic(), bulk_operation():
+        if archive:
+            # Архив пишется до удаления: при откате транзакции объявления
+            # останутся в базе, а повторная архивация их не задвоит
+            ad_archive.append(ad_archive.collect_records(ad_ids), timezone.now())
+        links = list(
+            Ad.cities.through.objects.filter(ad_id__in=ad_ids)
+                                     .values_list('ad_id', 'city_id', 'ad__category_id', 'ad__is_paid')
+        )
+        photos = list(AdPhoto.objects.filter(ad_id__in=ad_ids).values_list('image', 'image_variants'))
+        Ad.objects.filter(id__in=ad_ids).delete()
+        counters.apply([(city_id, category_id, is_paid) for _, city_id, category_id, is_paid in links], sign=-1)
+        sync.record_deletions((ad_id, city_id) for ad_id, city_id, _, _ in links)
+        get_search_backend().remove_ads(ad_ids)
+        # Общие файлы blobs/ удаляются, только если ссылок больше не осталось;
+        # ссылку архивированного объявления дальше держит запись архива
+        paths = release(path for path, _ in photos if not (archive and is_blob(path)))
+        for path, variants in photos:
+            if path and not is_blob(path):
+                paths.extend(variant_paths(variants))
+
+    feeds_changed((city_id, category_id) for _, city_id, category_id, _ in links)
+    return paths
+
+
+def cleanup_expired_ads(batch_size=CLEANUP_BATCH_SIZE, max_seconds=None, workers=CLEANUP_WORKERS,
+                        checkpoint_path=None, archive=None):
+    """
+    Удаляет истекшие объявления пачками. Возвращает статистику запуска:
+    deleted_ads, deleted_media, batches, elapsed, ads_per_second, finished
+    (False — остановились по бюджету времени, следующий запуск продолжит).
+    archive=None — как в настройке ARCHIVE_EXPIRED_ADS.
+    """
+    if archive is None:
+        archive = settings.ARCHIVE_EXPIRED_ADS
+    checkpoint = Checkpoint(checkpoint_path or settings.EXPIRY_CLEANUP_CHECKPOINT)
+    storage = AdPhoto._meta.get_field('image').storage
+    started = time.monotonic()
+    checkpoint.acquire()
+    try:
+        state = checkpoint.load() or {
+            'cutoff': timezone.now().isoformat(),
+            'deleted_ads': 0,
+            'deleted_media': 0,
+            'pending_files': [],
+        }
+        checkpoint.save(state)
+        cutoff = datetime.fromisoformat(state['cutoff'])
+        run = {'deleted_ads': 0, 'deleted_media': 0, 'batches': 0}
+
+        # Файлы пачки, закоммиченной до прерывания прошлого запуска
+        if state['pending_files']:
+            run['deleted_media'] += delete_files(storage, state['pending_files'], workers)
+            state['pending_files'] = []
+            checkpoint.save(state)
+
+        finished = False
+        while True:
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                break
+            ad_ids = list(
+                Ad.objects.filter(expires_at__lt=cutoff)
+                          .order_by('expires_at')
+                          .values_list('id', flat=True)[:batch_size]
+            )
+            if not ad_ids:
+                finished = True
+                break
+
+            paths = delete_ads_batch(ad_ids, archive)
+            state['deleted_ads'] += len(ad_ids)
+            state['pending_files'] = paths
+            checkpoint.save(state)
+
+            deleted_media = delete_files(storage, paths, workers)
+            state['deleted_media'] += deleted_media
+            state['pending_files'] = []
+            checkpoint.save(state)
+
+            run['deleted_ads'] += len(ad_ids)
+            run['deleted_media'] += deleted_media
+            run['batches'] += 1
+
+        if finished:
+            checkpoint.clear()
+    finally:
+        checkpoint.release()
+
+    elapsed = time.monotonic() - started
+    return {
+        **run,
+        'elapsed': round(elapsed, 2),
+        'ads_per_second': round(run['deleted_ads'] / elapsed, 1) if elapsed else 0,
+        'files_per_second': round(run['deleted_media'] / elapsed, 1) if elapsed else 0,
+        'finished': finished,
+        'archived': archive,
+        'total_deleted_ads': state['deleted_ads'],
+        'total_deleted_media': state['deleted_media'],
+    }
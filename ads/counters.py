@@ -0,0 +1,93 @@
+"""
+Счётчики объявлений по (город, категория, оплачено) — таблица AdCounter.
+
+Ключ счётчика — тройка (city_id, category_id, is_paid); объявление
+в нескольких городах даёт по единице в каждом. Изменения применяются
+атомарным UPDATE count = count + delta, строка создаётся при первом
+увеличении. Лента и бейджи категорий читают готовые числа вместо COUNT(*).
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .models import Ad, AdCounter
+
+
+def counter_keys(**through_filter):
+    """Ключи счётчиков для строк Ad.cities.through, подходящих под фильтр."""
+    return Counter(
+        Ad.cities.through.objects.filter(**through_filter)
+                                 .values_list('city_id', 'ad__category_id', 'ad__is_paid')
+    )
+
+
+def _add(key, delta):
+    city_id, category_id, is_paid = key
+    rows = AdCounter.objects.filter(city_id=city_id, category_id=category_id, is_paid=is_paid)
+    if rows.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            AdCounter.objects.create(city_id=city_id, category_id=category_id, is_paid=is_paid, count=delta)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        rows.update(count=F('count') + delta)
+
+
+def apply(keys, sign=1):
+    """Прибавляет (sign=1) или вычитает (sign=-1) ключи, keys — Counter или итерируемое."""
+    for key, delta in Counter(keys).items():
+        if delta:
+            _add(key, sign * delta)
+
+
+def feed_count(city_id, category_id=0, is_paid=None):
+    """Число объявлений ленты города; category_id=0 — все категории, is_paid=None — любые."""
+    rows = AdCounter.objects.filter(city_id=city_id)
+    if category_id:
+        rows = rows.filter(category_id=category_id)
+    if is_paid is not None:
+        rows = rows.filter(is_paid=is_paid)
+    return rows.aggregate(total=Sum('count'))['total'] or 0
+
+
+def actual_counts():
+    """Точные значения счётчиков, посчитанные по таблице связей."""
+    rows = Ad.cities.through.objects.values('city_id', 'ad__category_id', 'ad__is_paid')\
+                                    .annotate(total=Count('ad_id'))\
+                                    .order_by()
+    return {
+        (row['city_id'], row['ad__category_id'], row['ad__is_paid']): row['total']
+        for row in rows
+    }
+
+
+def reconcile(dry_run=False):
+    """
+    Сверяет AdCounter с реальными данными и исправляет расхождения.
+    Возвращает список (ключ, было, стало).
+    """
+    actual = actual_counts()
+    stored = {
+        (row.city_id, row.category_id, row.is_paid): row
+        for row in AdCounter.objects.all()
+    }
+
+    drift = []
+    for key in actual.keys() | stored.keys():
+        expected = actual.get(key, 0)
+        row = stored.get(key)
+        current = row.count if row else 0
+        if current != expected:
+            drift.append((key, current, expected))
+    if dry_run or not drift:
+        return drift
+
+    with transaction.atomic():
+        for (city_id, category_id, is_paid), _, expected in drift:
+            AdCounter.objects.update_or_create(
+                city_id=city_id, category_id=category_id, is_paid=is_paid,
+                defaults={'count': expected},
+            )
+    return drift
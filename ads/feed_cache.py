@@ -0,0 +1,103 @@
+"""
+Кэш первых страниц публичной ленты по (город, категория).
+
+Страницы хранятся уже сериализованными в JSON. В ключ страницы входит
+версия ленты города — City.ads_version из базы (её поднимает
+ads/signals.feeds_changed при любом изменении объявлений города): версия
+общая для всех процессов и не вытесняется вместе со страницами. Старые
+страницы просто перестают читаться и истекают по таймауту.
+При HIDE_EXPIRED_ADS лента меняется и без записи в базу — когда истекает
+объявление, поэтому к версии добавляется срок ближайшего из них.
+Бэкенд — отдельный алиас CACHES['feeds'] (file, redis или locmem).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import Ad, City
+from .pagination import InvalidPageParams, page_params
+
+FEED_CACHE_ALIAS = 'feeds'
+HITS_KEY = 'feed:stats:hits'
+MISSES_KEY = 'feed:stats:misses'
+
+
+def _cache():
+    return caches[FEED_CACHE_ALIAS]
+
+
+def _incr(key, delta=1):
+    cache = _cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # ключ успел истечь/вытесниться между add и incr
+        cache.set(key, delta, timeout=None)
+        return delta
+
+
+def feed_version(city_id):
+    """Версия лент города для ключа кэша и ETag; None — города нет."""
+    version = City.objects.filter(id=city_id).values_list('ads_version', flat=True).first()
+    if version is None:
+        return None
+    if not settings.HIDE_EXPIRED_ADS:
+        return str(version)
+    # Истечение ближайшего объявления скрывает его из ленты — версия сменится в тот же момент
+    next_expiry = Ad.objects.in_city(city_id).filter(is_paid=True, expires_at__gte=timezone.now())\
+                            .order_by('expires_at').values_list('expires_at', flat=True).first()
+    return f"{version}.{next_expiry.strftime('%Y%m%d%H%M%S%f')}" if next_expiry else str(version)
+
+
+def page_key(request, city_id, category_id, version):
+    """
+    Ключ страницы, если запрос попадает в кэшируемые первые страницы,
+    иначе None. version — feed_version(city_id), прочитанная один раз на запрос.
+    """
+    if version is None:
+        return None
+    if 'cursor' in request.GET:
+        if request.GET.get('cursor'):
+            return None
+        mode = 'cursor'
+    else:
+        page = request.GET.get('page', '1')
+        if not page.isdigit() or not 1 <= int(page) <= settings.FEED_CACHE_PAGES:
+            return None
+        mode = f'page{int(page)}'
+
+    # Ключ по ограниченному limit: limit=500 и limit=MAX_FEED_LIMIT — одна и та же страница
+    try:
+        limit, _ = page_params(request.GET)
+    except InvalidPageParams:
+        return None
+
+    # В ответе абсолютные URL фото — они зависят от хоста и схемы
+    origin = hashlib.md5(request.build_absolute_uri('/').encode()).hexdigest()[:8]
+    return f'feed:{city_id}:{category_id}:{version}:{mode}:{limit}:{origin}'
+
+
+def get_page(key):
+    content = _cache().get(key)
+    _incr(HITS_KEY if content is not None else MISSES_KEY)
+    return content
+
+
+def set_page(key, content):
+    _cache().set(key, content, timeout=settings.FEED_CACHE_TIMEOUT)
+
+
+def stats():
+    cache = _cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'backend': settings.CACHES[FEED_CACHE_ALIAS]['BACKEND'],
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
@@ -0,0 +1,231 @@
+"""
+Фоновая обработка загруженных фото объявлений.
+
+В режиме AD_IMAGE_PROCESSING = 'async' вьюхи сохраняют исходную загрузку
+как есть (AdPhoto.status = pending), ставят ImageJob и сразу отвечают.
+Воркер process_image_jobs забирает задачи из таблицы, сжимает фото в пуле
+потоков и подменяет файл: ленты не показывают фото, пока оно не готово
+(ads/projections.py), и отдают сжатую версию после. Ошибка откладывает повтор с удвоением задержки;
+после IMAGE_JOB_MAX_ATTEMPTS попыток фото остаётся с исходным файлом
+в статусе failed.
+"""
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+from django.utils import timezone
+
+from .images import ensure_variants_many, process_upload, process_uploads
+from .models import AdPhoto, ImageJob, MediaBlob
+from .signals import feed_pairs_for_ads, feeds_changed, touch_ads
+from .storage import acquire, blob_digest, hash_content, is_blob
+
+logger = logging.getLogger(__name__)
+
+# Фото меньше этого размера сохраняются без сжатия
+COMPRESS_MIN_SIZE = 50 * 1024
+
+IMAGE_JOB_MAX_ATTEMPTS = 5
+IMAGE_JOB_RETRY_DELAY = 30
+# Задача в running дольше этого времени — воркер упал, возвращаем в очередь
+IMAGE_JOB_STALE_AFTER = 10 * 60
+IMAGE_JOB_BATCH_SIZE = 20
+IMAGE_JOB_WORKERS = 4
+
+
+def processed_blob(digest):
+    """Путь уже сжатого файла, полученного из исходника с хэшем digest."""
+    return MediaBlob.objects.filter(source_sha256=digest).values_list('path', flat=True).first()
+
+
+def remember_source(path, digest):
+    MediaBlob.objects.filter(path=path).update(source_sha256=digest)
+
+
+def save_ad_photo(ad, upload):
+    """Сохраняет загруженное фото объявления: сжимает сразу или ставит в очередь."""
+    return save_ad_photos(ad, [upload])[0]
+
+
+def save_ad_photos(ad, uploads):
+    """
+    Сохраняет все фото одной загрузки. В режиме sync файлы сжимаются
+    параллельно в общем пуле процессов (ads/images.process_pool), записи
+    вставляются одним bulk_create. bulk_create не шлёт сигналов, поэтому
+    ссылки на blobs/, производные и сброс лент делаются здесь явно.
+    Мелкие фото сохраняются как есть; уже сжимавшиеся байты не сжимаются снова.
+    """
+    uploads = list(uploads)
+    if not uploads:
+        return []
+    digests = [None if upload.size <= COMPRESS_MIN_SIZE else hash_content(upload) for upload in uploads]
+    processed = dict(
+        MediaBlob.objects.filter(source_sha256__in={digest for digest in digests if digest})
+                         .values_list('source_sha256', 'path')
+    )
+    queued = settings.AD_IMAGE_PROCESSING == 'async'
+
+    # Одинаковые файлы в одной загрузке сжимаются один раз
+    to_compress = {}
+    if not queued:
+        for upload, digest in zip(uploads, digests):
+            if digest and digest not in processed:
+                to_compress.setdefault(digest, upload)
+    compressed = dict(zip(to_compress, process_uploads(list(to_compress.values()), 'ads')))
+
+    photos = []
+    for upload, digest in zip(uploads, digests):
+        if digest in processed:
+            photos.append(AdPhoto(ad=ad, image=processed[digest]))
+        elif digest in compressed:
+            photos.append(AdPhoto(ad=ad, image=compressed[digest]))
+        elif digest and queued:
+            photos.append(AdPhoto(ad=ad, image=upload, status=AdPhoto.STATUS_PENDING))
+        else:
+            photos.append(AdPhoto(ad=ad, image=upload))
+
+    with transaction.atomic():
+        # Файлы пишутся в storage здесь же, в pre_save поля
+        AdPhoto.objects.bulk_create(photos)
+        for name, count in Counter(photo.image.name for photo in photos).items():
+            acquire(name, count)
+        ImageJob.objects.bulk_create([
+            ImageJob(photo=photo) for photo in photos if photo.status == AdPhoto.STATUS_PENDING
+        ])
+    sources = {}
+    for photo, digest in zip(photos, digests):
+        # Иначе post_save при следующем save() примет имя загрузки за заменённый файл
+        photo._media_names = {'image': photo.image.name}
+        if digest in compressed:
+            sources[digest] = photo.image.name
+    for digest, name in sources.items():
+        remember_source(name, digest)
+
+    ready = [photo for photo in photos if photo.status == AdPhoto.STATUS_READY]
+    if ready:
+        ensure_variants_many(ready, 'image')
+    feeds_changed(feed_pairs_for_ads([ad.id]))
+    return photos
+
+
+def process_photo(photo):
+    """
+    Сжимает исходник фото и подменяет им файл записи. Исходник удаляется
+    сигналом сохранения вместе с последней ссылкой на него.
+    """
+    raw_name = photo.image.name
+    digest = blob_digest(raw_name) if is_blob(raw_name) else None
+    processed = processed_blob(digest) if digest else None
+    if processed:
+        photo.image.name = processed
+    else:
+        with photo.image.storage.open(raw_name, 'rb') as raw:
+            compressed = process_upload(raw, 'ads')
+        photo.image.save(compressed.name, compressed, save=False)
+    photo.status = AdPhoto.STATUS_READY
+    try:
+        with transaction.atomic():
+            # save() шлёт post_save: кэш лент сбрасывается и клиенты видят новый файл
+            photo.save(update_fields=['image', 'status'])
+            # Исходник удаляется с последней ссылкой — синхронизация должна
+            # отдать объявление с новым путём
+            touch_ads([photo.ad_id])
+    except DatabaseError:
+        # Фото удалили, пока шло сжатие; файл без ссылок уберёт collect_orphan_media
+        return
+    if digest and not processed:
+        remember_source(photo.image.name, digest)
+
+
+def reset_stale_jobs(now=None):
+    now = now or timezone.now()
+    return ImageJob.objects.filter(
+        status=ImageJob.STATUS_RUNNING,
+        locked_at__lt=now - timedelta(seconds=IMAGE_JOB_STALE_AFTER),
+    ).update(status=ImageJob.STATUS_PENDING, locked_at=None)
+
+
+def claim_jobs(limit=IMAGE_JOB_BATCH_SIZE):
+    """
+    Забирает до limit готовых к запуску задач. Условный UPDATE по статусу
+    не даёт двум воркерам взять одну задачу; на PostgreSQL занятые строки
+    пропускаются через SKIP LOCKED.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        queue = ImageJob.objects.filter(status=ImageJob.STATUS_PENDING, run_after__lte=now)\
+                                .order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            queue = queue.select_for_update(skip_locked=True)
+        job_ids = list(queue.values_list('id', flat=True)[:limit])
+        if not job_ids:
+            return []
+        ImageJob.objects.filter(id__in=job_ids, status=ImageJob.STATUS_PENDING)\
+                        .update(status=ImageJob.STATUS_RUNNING, locked_at=now)
+        return list(ImageJob.objects.filter(id__in=job_ids, status=ImageJob.STATUS_RUNNING, locked_at=now))
+
+
+def fail_job(job, error):
+    attempts = job.attempts + 1
+    update = {'attempts': attempts, 'locked_at': None, 'last_error': str(error)[:1000]}
+    if attempts >= IMAGE_JOB_MAX_ATTEMPTS:
+        update['status'] = ImageJob.STATUS_FAILED
+        AdPhoto.objects.filter(id=job.photo_id).update(status=AdPhoto.STATUS_FAILED)
+    else:
+        update['status'] = ImageJob.STATUS_PENDING
+        update['run_after'] = timezone.now() + timedelta(seconds=IMAGE_JOB_RETRY_DELAY * 2 ** (attempts - 1))
+    ImageJob.objects.filter(id=job.id).update(**update)
+
+
+def run_job(job):
+    """Выполняет задачу; True — фото готово."""
+    try:
+        photo = AdPhoto.objects.filter(id=job.photo_id).first()
+        if photo is not None:
+            process_photo(photo)
+    except Exception as error:
+        logger.exception('Image job %s failed', job.id)
+        fail_job(job, error)
+        return False
+    ImageJob.objects.filter(id=job.id).delete()
+    return True
+
+
+def run_job_in_thread(job):
+    try:
+        return run_job(job)
+    finally:
+        # У каждого потока пула своё соединение с базой
+        connections.close_all()
+
+
+def run_worker(workers=IMAGE_JOB_WORKERS, batch_size=IMAGE_JOB_BATCH_SIZE, once=False,
+               poll_interval=2.0, max_seconds=None):
+    """
+    Обрабатывает очередь. once — выйти, когда очередь пуста; max_seconds —
+    не брать новые пачки после этого времени. Возвращает (готово, ошибок).
+    """
+    started = time.monotonic()
+    done = failed = 0
+    reset_stale_jobs()
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while max_seconds is None or time.monotonic() - started < max_seconds:
+            jobs = claim_jobs(batch_size)
+            if not jobs:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+            results = pool.map(run_job_in_thread, jobs) if pool else map(run_job, jobs)
+            for ok in results:
+                done += ok
+                failed += not ok
+    finally:
+        if pool:
+            pool.shutdown()
+    return done, failed
@@ -0,0 +1,421 @@
+"""
+Обработка загружаемых фото объявлений, бизнес-карточек и логотипов.
+
+Фото с телефона (12 Мп и больше) не кодируется целиком по нескольку раз:
+JPEG декодируется сразу в уменьшенном масштабе (draft), остальные форматы
+уменьшаются reduce(), затем длинная сторона ограничивается AD_IMAGE_MAX_EDGE.
+Качество подбирается бинарным поиском на уже уменьшенном изображении,
+ориентация из EXIF применяется один раз при декодировании.
+
+process_upload применяет к загрузке политику приложения
+(settings.IMAGE_UPLOAD_POLICIES); EXIF, GPS и цветовой профиль в итоговый
+файл не переносятся.
+
+Для лент строятся производные 160/480/1080 px в WebP и JPEG; их пути
+лежат в JSON-поле <поле>_variants рядом с исходным файлом.
+"""
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import ExifTags, Image, ImageOps
+
+from .placeholders import describe
+from .uploads import pixel_limit
+
+logger = logging.getLogger(__name__)
+
+# Target image size in bytes (300KB)
+TARGET_IMAGE_SIZE = 300 * 1024
+
+# Поиск качества останавливается, когда окно сузилось до стольких единиц
+QUALITY_TOLERANCE = 3
+
+# Что бросает process_upload на файле, который не удаётся разобрать как изображение
+UPLOAD_ERRORS = (OSError, Image.DecompressionBombError)
+
+
+def open_downscaled(image, max_edge, keep_alpha=False):
+    """
+    Открывает изображение, уменьшенное так, чтобы длинная сторона была
+    не больше max_edge, и повёрнутое по EXIF. keep_alpha — сохранить
+    прозрачность (RGBA) вместо приведения к RGB.
+    """
+    img = Image.open(image)
+    width, height = img.size
+    if width * height > pixel_limit(img):
+        # Файл не через ImageUploadHandler (фоновая задача, команда) — та же граница
+        raise Image.DecompressionBombError(f'{width}x{height} пикселей')
+    ratio = max_edge / max(width, height)
+    if ratio < 1:
+        if img.format == 'JPEG':
+            # Декодер JPEG сам уменьшает в 2/4/8 раз, не распаковывая полный кадр
+            img.draft('RGB', (math.ceil(width * ratio), math.ceil(height * ratio)))
+        else:
+            factor = int(1 / ratio)
+            if factor >= 2:
+                img = img.reduce(factor)
+
+    img = ImageOps.exif_transpose(img)
+    if keep_alpha and ('A' in img.mode or 'transparency' in img.info):
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    # Точный размер после грубого уменьшения draft/reduce
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+
+def encode(img, quality, optimize=False):
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=optimize)
+    return output
+
+
+def pick_quality(img, target_size, quality, min_quality):
+    """
+    Наибольшее качество из [min_quality, quality], при котором JPEG
+    не больше target_size; min_quality, если не подходит ни одно.
+    """
+    if encode(img, quality).tell() <= target_size:
+        return quality
+
+    low, high, best = min_quality, quality - 1, None
+    while low <= high:
+        middle = (low + high) // 2
+        if encode(img, middle).tell() <= target_size:
+            best, low = middle, middle + 1
+        else:
+            high = middle - 1
+        # Подходящее качество уже есть, уточнять на пару единиц дороже, чем выигрыш
+        if best is not None and high - low < QUALITY_TOLERANCE:
+            break
+    return min_quality if best is None else best
+
+
+def compress(image, target_size=TARGET_IMAGE_SIZE, quality=85, min_quality=40, max_edge=None):
+    """JPEG не больше target_size (если достижимо при min_quality) в BytesIO."""
+    img = open_downscaled(image, max_edge or settings.AD_IMAGE_MAX_EDGE)
+    best_quality = pick_quality(img, target_size, quality, min_quality)
+    # optimize только для итогового файла: он не больше неоптимизированного
+    return encode(img, best_quality, optimize=True)
+
+
+def compress_image(image, target_size=TARGET_IMAGE_SIZE, quality=85, min_quality=40, max_edge=None):
+    """
+    Compress an image to be under the target_size while maintaining aspect ratio.
+    Returns a ContentFile with the compressed image data.
+    """
+    output = compress(image, target_size, quality, min_quality, max_edge)
+    return ContentFile(output.getvalue(), name=output_name(image, '.jpg'))
+
+
+def output_name(image, ext):
+    return os.path.splitext(os.path.basename(getattr(image, 'name', None) or 'image'))[0] + ext
+
+
+def render(image, options):
+    """Файл по политике options (значение из IMAGE_UPLOAD_POLICIES) в BytesIO."""
+    if options.get('format') == 'PNG':
+        img = open_downscaled(image, options['max_edge'], keep_alpha=True)
+        output = io.BytesIO()
+        # icc_profile=None: PNG иначе берёт профиль из исходника
+        img.save(output, format='PNG', optimize=True, icc_profile=None)
+        return output
+    return compress(image, target_size=options['target_size'], max_edge=options['max_edge'])
+
+
+def render_source(source, options):
+    """
+    render() для пула процессов: source — путь к временному файлу загрузки
+    или её байты, результат — байты готового файла.
+    """
+    with open(source, 'rb') if isinstance(source, str) else io.BytesIO(source) as image:
+        return render(image, options).getvalue()
+
+
+def upload_source(upload):
+    """Что передать в пул: большие загрузки Django уже лежат во временном файле."""
+    if hasattr(upload, 'temporary_file_path'):
+        return upload.temporary_file_path()
+    upload.seek(0)
+    return upload.read()
+
+
+def policy_ext(options):
+    return '.png' if options.get('format') == 'PNG' else '.jpg'
+
+
+def process_upload(upload, policy):
+    """
+    Готовит загруженный файл к сохранению в ImageField по политике policy
+    из settings.IMAGE_UPLOAD_POLICIES. Бросает OSError (UnidentifiedImageError),
+    если файл не читается как изображение.
+    """
+    options = settings.IMAGE_UPLOAD_POLICIES[policy]
+    return ContentFile(render(upload, options).getvalue(), name=output_name(upload, policy_ext(options)))
+
+
+def process_uploads(uploads, policy):
+    """
+    process_upload для всех файлов одного запроса параллельно, в общем
+    пуле процессов; порядок сохраняется, первая ошибка пробрасывается.
+    """
+    options = settings.IMAGE_UPLOAD_POLICIES[policy]
+    results = pool_results(render_source, [(upload_source(upload), options) for upload in uploads])
+    processed = []
+    for upload, result in zip(uploads, results):
+        if isinstance(result, Exception):
+            raise result
+        processed.append(ContentFile(result, name=output_name(upload, policy_ext(options))))
+    return processed
+
+
+# --- Общий пул процессов ---
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_context():
+    """
+    Способ запуска процессов пула. Процесс веб-сервера многопоточный и держит
+    соединения с базой и сокеты: fork скопировал бы их вместе с чужими
+    захваченными блокировками. forkserver порождает процессы от отдельного
+    чистого сервера с заранее импортированным ads.images; где его нет — spawn.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        context.set_forkserver_preload(['ads.images'])
+    return context
+
+
+def process_pool():
+    """
+    Пул сжатия, общий для всех запросов процесса: AD_IMAGE_POOL_WORKERS
+    процессов (по умолчанию по числу ядер).
+
+    Жизненный цикл: пул создаётся при первой загрузке в процессе (не при
+    импорте — под gunicorn --preload он не должен появиться в мастере до
+    fork воркеров), процессы пула запускаются по мере надобности и живут до
+    выхода процесса веб-сервера, который их дожидается. Сломанный пул
+    (BrokenProcessPool) отбрасывается в reset_process_pool, следующая
+    загрузка создаёт новый. Настройки процессы пула читают из
+    DJANGO_SETTINGS_MODULE сами: override_settings до них не доходит.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.AD_IMAGE_POOL_WORKERS, mp_context=pool_context())
+        return _pool
+
+
+def reset_process_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def call_safely(func, args):
+    try:
+        return func(*args)
+    except Exception as error:
+        return error
+
+
+def pool_results(func, calls):
+    """
+    [func(*args) for args in calls] в общем пуле, в исходном порядке;
+    исключение отдельного вызова возвращается на месте его результата.
+    Один вызов или одно ядро — без пула: передача данных между процессами
+    стоит дороже. Если процесс пула убит (например, OOM), пул пересоздаётся,
+    а недоделанные вызовы выполняются здесь же.
+    """
+    if len(calls) < 2 or settings.AD_IMAGE_POOL_WORKERS < 2:
+        return [call_safely(func, args) for args in calls]
+    pool = process_pool()
+    futures = []
+    try:
+        for args in calls:
+            futures.append(pool.submit(func, *args))
+    except BrokenProcessPool:
+        pass
+    results = []
+    for index, args in enumerate(calls):
+        future = futures[index] if index < len(futures) else None
+        error = future.exception() if future else None
+        if future is None or isinstance(error, BrokenProcessPool):
+            reset_process_pool(pool)
+            results.append(call_safely(func, args))
+        else:
+            results.append(error or future.result())
+    return results
+
+
+# --- Производные размеры для лент и карточек ---
+
+VARIANT_WIDTHS = (160, 480, 1080)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Фото пользователей: у каждого поля есть JSON <поле>_variants с производными,
+# файлы хранятся с дедупликацией по содержимому (ads/storage.py)
+MEDIA_FIELDS = [
+    ('ads.AdPhoto', 'image'),
+    ('business.BusinessPhoto', 'image'),
+    ('business.BusinessCatalogItem', 'photo'),
+    ('business.BusinessCard', 'profile_photo'),
+    ('business.BusinessCard', 'header_photo'),
+]
+
+
+def variant_name(name, width, ext):
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'variants', f"{filename.replace('.', '_')}_{width}.{ext}")
+
+
+def build_variants(media_root, name, widths=VARIANT_WIDTHS):
+    """
+    Пишет уменьшенные копии файла name (путь относительно media_root)
+    во всех форматах VARIANT_FORMATS и возвращает их описание:
+    {'src': name, 'sizes': {'160': {'webp': путь, 'jpeg': путь}, ...}}
+    плюс заглушка для клиента (ads/placeholders.py): width, height, blurhash, color.
+    Ширины больше исходной пропускаются, самая маленькая строится всегда.
+    Не зависит от ORM — вызывается и из пула процессов build_image_variants.
+    """
+    widths = sorted(widths)
+    with Image.open(os.path.join(media_root, name)) as source:
+        width, height = source.size
+        if width * height > pixel_limit(source):
+            raise Image.DecompressionBombError(f'{name}: {width}x{height} пикселей')
+        # Размеры исходника так, как его покажет клиент — после поворота
+        if source.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            original = (height, width)
+        else:
+            original = (width, height)
+        # После поворота по EXIF шириной может стать любая сторона
+        ratio = widths[-1] / min(width, height)
+        if ratio < 1 and source.format == 'JPEG':
+            source.draft('RGB', (math.ceil(width * ratio), math.ceil(height * ratio)))
+        img = ImageOps.exif_transpose(source)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+    sizes = {}
+    # От большего к меньшему: каждый размер уменьшается из предыдущего
+    for target in reversed(widths):
+        if target >= img.width and target != widths[0]:
+            continue
+        if target < img.width:
+            img = img.resize((target, max(1, round(img.height * target / img.width))), Image.LANCZOS)
+        paths = {}
+        for ext, (image_format, options) in VARIANT_FORMATS.items():
+            path = variant_name(name, target, ext)
+            os.makedirs(os.path.dirname(os.path.join(media_root, path)), exist_ok=True)
+            img.save(os.path.join(media_root, path), format=image_format, **options)
+            paths[ext] = path
+        sizes[str(target)] = paths
+    # img — самая маленькая копия: заглушку считаем по ней
+    return {
+        'src': name,
+        'sizes': dict(sorted(sizes.items(), key=lambda item: int(item[0]))),
+        **describe(img, *original),
+    }
+
+
+def variant_paths(variants):
+    for paths in (variants or {}).get('sizes', {}).values():
+        yield from paths.values()
+
+
+def delete_variant_files(media_root, paths):
+    for path in paths:
+        try:
+            os.remove(os.path.join(media_root, path))
+        except FileNotFoundError:
+            pass
+
+
+def ensure_variants(instance, field_name):
+    """
+    Пересобирает производные поля, если исходный файл сменился (или удалён).
+    JSON пишется через update(), без повторных сигналов save. Ошибка чтения
+    исходника не ломает сохранение: производных просто не будет, их
+    доделает build_image_variants.
+
+    Производные файла из blobs/ общие для всех ссылок: строятся один раз,
+    хранятся в MediaBlob.variants и удаляются вместе с последней ссылкой.
+    """
+    from .models import MediaBlob
+    from .storage import is_blob
+
+    variants_field = f'{field_name}_variants'
+    current = getattr(instance, variants_field) or {}
+    file = getattr(instance, field_name)
+    name = file.name if file else None
+    if current.get('src') == name:
+        return False
+
+    new = {}
+    if is_blob(name):
+        new = MediaBlob.objects.filter(path=name).values_list('variants', flat=True).first() or {}
+    if name and new.get('src') != name:
+        try:
+            new = build_variants(settings.MEDIA_ROOT, name)
+        except UPLOAD_ERRORS:
+            logger.warning('Не удалось построить производные %s', name, exc_info=True)
+            return False
+        if is_blob(name):
+            MediaBlob.objects.filter(path=name).update(variants=new)
+    type(instance)._default_manager.filter(pk=instance.pk).update(**{variants_field: new})
+    setattr(instance, variants_field, new)
+    if not is_blob(current.get('src')):
+        delete_variant_files(settings.MEDIA_ROOT, set(variant_paths(current)) - set(variant_paths(new)))
+    return True
+
+
+def ensure_variants_many(instances, field_name):
+    """
+    ensure_variants для пачки только что вставленных записей (bulk_create
+    не шлёт post_save): производные разных файлов строятся параллельно
+    в общем пуле, JSON пишется одним bulk_update.
+    """
+    from .models import MediaBlob
+    from .storage import is_blob
+
+    variants_field = f'{field_name}_variants'
+    names = list({getattr(instance, field_name).name for instance in instances} - {None, ''})
+    known = {
+        path: variants
+        for path, variants in MediaBlob.objects.filter(path__in=names).values_list('path', 'variants')
+        if (variants or {}).get('src') == path
+    }
+    todo = [name for name in names if name not in known]
+    for name, result in zip(todo, pool_results(build_variants, [(settings.MEDIA_ROOT, name) for name in todo])):
+        if isinstance(result, Exception):
+            logger.warning('Не удалось построить производные %s', name, exc_info=result)
+            continue
+        known[name] = result
+        if is_blob(name):
+            MediaBlob.objects.filter(path=name).update(variants=result)
+
+    changed = []
+    for instance in instances:
+        variants = known.get(getattr(instance, field_name).name)
+        if variants:
+            setattr(instance, variants_field, variants)
+            changed.append(instance)
+    if changed:
+        type(changed[0])._default_manager.bulk_update(changed, [variants_field])
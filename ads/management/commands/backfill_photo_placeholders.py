@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import ExifTags, Image, ImageOps
+from ads.images import MEDIA_FIELDS, UPLOAD_ERRORS
+from ads.models import MediaBlob
+from ads.placeholders import THUMB_SIZE, describe_many, numpy
+from ads.signals import feed_pairs_for_ads, feeds_changed, touch_owners
+from ads.storage import is_blob
+
+
+def load(media_root, name, variants):
+    """
+    (уменьшенная копия, ширина, высота исходника) для одного файла.
+    Декодируется самая маленькая производная, если она есть: она уже
+    повёрнута по EXIF и в десятки раз меньше оригинала.
+    """
+    with Image.open(os.path.join(media_root, name)) as source:
+        width, height = source.size
+        if source.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            width, height = height, width
+        sizes = variants.get("sizes") or {}
+        smallest = sizes[min(sizes, key=int)].get("jpeg") if sizes else None
+        if smallest and os.path.exists(os.path.join(media_root, smallest)):
+            with Image.open(os.path.join(media_root, smallest)) as small:
+                return small.convert("RGB"), width, height
+        source.draft("RGB", (THUMB_SIZE * 4, THUMB_SIZE * 4))
+        img = ImageOps.exif_transpose(source).convert("RGB")
+    img.thumbnail((THUMB_SIZE * 4, THUMB_SIZE * 4))
+    return img, width, height
+
+
+class Command(BaseCommand):
+    help = "Считает BlurHash, преобладающий цвет и размеры для уже загруженных фото"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument("--workers", type=int, default=8, help="Потоков для чтения файлов")
+
+    def handle(self, *args, **options):
+        if numpy is None:
+            self.stdout.write("numpy не установлен — заглушки считаются по одной")
+        for label, field_name in MEDIA_FIELDS:
+            done, failed = self.backfill_field(apps.get_model(label), field_name, options)
+            self.stdout.write(f"{label}.{field_name}: посчитано {done}, ошибок {failed}")
+
+    def backfill_field(self, model, field_name, options):
+        variants_field = f"{field_name}_variants"
+        # Фото без актуальных производных сначала обрабатывает build_image_variants
+        rows = model._default_manager.exclude(**{f"{field_name}__isnull": True})\
+                                     .exclude(**{field_name: ""})\
+                                     .exclude(**{f"{variants_field}__has_key": "blurhash"})\
+                                     .order_by("pk")\
+                                     .values_list("pk", field_name, variants_field)
+        todo = [(pk, name, variants) for pk, name, variants in rows.iterator() if (variants or {}).get("src") == name]
+        has_updated_at = any(field.name == "updated_at" for field in model._meta.concrete_fields)
+        done = failed = 0
+
+        def load_safely(item):
+            name, variants = item
+            try:
+                return name, load(settings.MEDIA_ROOT, name, variants)
+            except UPLOAD_ERRORS as error:
+                self.stderr.write(f"{name}: {error}")
+                return name, None
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for start in range(0, len(todo), options["batch_size"]):
+                batch = todo[start:start + options["batch_size"]]
+                # Общий файл из blobs/ считается один раз на пачку
+                unique = {name: variants for _, name, variants in batch}
+                loaded = {name: item for name, item in pool.map(load_safely, unique.items()) if item}
+                placeholders = dict(zip(loaded, describe_many(list(loaded.values()))))
+
+                for name, placeholder in placeholders.items():
+                    if is_blob(name):
+                        MediaBlob.objects.filter(path=name, variants__src=name)\
+                                         .update(variants={**unique[name], **placeholder})
+                changed_pks = []
+                for pk, name, variants in batch:
+                    if name not in placeholders:
+                        failed += 1
+                        continue
+                    update = {variants_field: {**variants, **placeholders[name]}}
+                    if has_updated_at:
+                        # updated_at входит в ETag списков бизнес-карточек
+                        update["updated_at"] = timezone.now()
+                    # Файл могли заменить, пока считалась пачка
+                    if model._default_manager.filter(pk=pk, **{field_name: name}).update(**update):
+                        changed_pks.append(pk)
+                        done += 1
+                # Новые производные должны дойти до синхронизации и ETag списков
+                touch_owners(model, changed_pks)
+                if model is apps.get_model("ads.AdPhoto") and changed_pks:
+                    ad_ids = model._default_manager.filter(pk__in=changed_pks).values_list("ad_id", flat=True)
+                    feeds_changed(feed_pairs_for_ads(list(ad_ids)))
+        return done, failed
@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ads.images import MEDIA_FIELDS, UPLOAD_ERRORS, build_variants, delete_variant_files, pool_context, variant_paths
+from ads.models import MediaBlob
+from ads.signals import feed_pairs_for_ads, feeds_changed, touch_owners
+from ads.storage import is_blob
+
+
+class Command(BaseCommand):
+    help = "Строит производные WebP/JPEG 160/480/1080 для уже загруженных фото (пулом процессов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Процессов")
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--force", action="store_true", help="Пересобрать и актуальные производные")
+
+    def handle(self, *args, **options):
+        # Процессы запускаются так же, как у пула загрузок: без копии соединений с базой
+        with ProcessPoolExecutor(max_workers=options["workers"], mp_context=pool_context()) as pool:
+            for label, field_name in MEDIA_FIELDS:
+                built, failed = self.build_field(pool, apps.get_model(label), field_name, options)
+                self.stdout.write(f"{label}.{field_name}: построено {built}, ошибок {failed}")
+
+    def build_field(self, pool, model, field_name, options):
+        variants_field = f"{field_name}_variants"
+        rows = model._default_manager.exclude(**{f"{field_name}__isnull": True})\
+                                     .exclude(**{field_name: ""})\
+                                     .order_by("pk")\
+                                     .values_list("pk", field_name, variants_field)
+        todo = [
+            (pk, name, variants) for pk, name, variants in rows.iterator()
+            if options["force"] or (variants or {}).get("src") != name
+        ]
+        built = failed = 0
+        for start in range(0, len(todo), options["batch_size"]):
+            batch = todo[start:start + options["batch_size"]]
+            # Одинаковые файлы blobs/ встречаются в пачке многократно — строим один раз
+            futures = {name: pool.submit(build_variants, settings.MEDIA_ROOT, name) for _, name, _ in batch}
+            for name, future in futures.items():
+                if is_blob(name) and future.exception() is None:
+                    MediaBlob.objects.filter(path=name).update(variants=future.result())
+            changed_pks = []
+            for pk, name, old_variants in batch:
+                try:
+                    new_variants = futures[name].result()
+                except UPLOAD_ERRORS as error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                    continue
+                update = {variants_field: new_variants}
+                if any(field.name == "updated_at" for field in model._meta.concrete_fields):
+                    # updated_at входит в ETag списков бизнес-карточек
+                    update["updated_at"] = timezone.now()
+                # Файл могли заменить, пока строились производные
+                if model._default_manager.filter(pk=pk, **{field_name: name}).update(**update):
+                    if not is_blob((old_variants or {}).get("src")):
+                        delete_variant_files(
+                            settings.MEDIA_ROOT, set(variant_paths(old_variants)) - set(variant_paths(new_variants))
+                        )
+                    changed_pks.append(pk)
+                    built += 1
+            # Новые производные должны дойти до синхронизации и ETag списков
+            touch_owners(model, changed_pks)
+            if model is apps.get_model("ads.AdPhoto") and changed_pks:
+                ad_ids = model._default_manager.filter(pk__in=changed_pks).values_list("ad_id", flat=True)
+                feeds_changed(feed_pairs_for_ads(list(ad_ids)))
+        return built, failed
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ads.cleanup import CLEANUP_BATCH_SIZE, CLEANUP_WORKERS, CleanupLocked, cleanup_expired_ads
+
+
+class Command(BaseCommand):
+    help = "Удаляет истекшие объявления и их фото пачками, с продолжением после прерывания"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=CLEANUP_BATCH_SIZE)
+        parser.add_argument("--max-seconds", type=float, default=None,
+                            help="Бюджет времени; остаток дочистит следующий запуск")
+        parser.add_argument("--workers", type=int, default=CLEANUP_WORKERS,
+                            help="Потоков для удаления файлов")
+        parser.add_argument("--checkpoint", default=None, help="Путь к файлу чекпоинта")
+        parser.add_argument("--archive", action="store_true", default=None,
+                            help="Переносить объявления в холодный архив (по умолчанию ARCHIVE_EXPIRED_ADS)")
+
+    def handle(self, *args, **options):
+        try:
+            result = cleanup_expired_ads(
+                batch_size=options["batch_size"],
+                max_seconds=options["max_seconds"],
+                workers=options["workers"],
+                checkpoint_path=options["checkpoint"],
+                archive=options["archive"],
+            )
+        except CleanupLocked:
+            self.stdout.write(self.style.WARNING("Очистка уже идёт в другом процессе"))
+            return
+
+        if result['archived']:
+            self.stdout.write(f"Объявления перенесены в архив {settings.AD_ARCHIVE_PATH}")
+        self.stdout.write(
+            f"Удалено объявлений: {result['deleted_ads']}, медиафайлов: {result['deleted_media']}, "
+            f"пачек: {result['batches']} за {result['elapsed']} с "
+            f"({result['ads_per_second']} объявл./с, {result['files_per_second']} файлов/с)"
+        )
+        if result['finished']:
+            self.stdout.write(self.style.SUCCESS("Истекших объявлений не осталось"))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"Остановлено по бюджету времени, всего с начала прохода: {result['total_deleted_ads']}"
+            ))
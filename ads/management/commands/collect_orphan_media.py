@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from ads.media_gc import GC_BATCH_SIZE, GC_MIN_AGE, GC_WORKERS, delete_orphans, find_orphans
+
+
+class Command(BaseCommand):
+    help = "Находит в MEDIA_ROOT файлы, на которые не ссылается ни одна модель, и удаляет их"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Только показать, сколько можно освободить")
+        parser.add_argument("--workers", type=int, default=GC_WORKERS, help="Потоков для обхода и удаления")
+        parser.add_argument("--batch-size", type=int, default=GC_BATCH_SIZE)
+        parser.add_argument("--min-age", type=int, default=GC_MIN_AGE,
+                            help="Не трогать файлы моложе стольких секунд")
+        parser.add_argument("--list", action="store_true", help="Вывести пути найденных файлов")
+
+    def handle(self, *args, **options):
+        orphans = find_orphans(min_age=options["min_age"], workers=options["workers"])
+        reclaimable = sum(size for _, size in orphans)
+
+        if options["list"]:
+            for path, size in orphans:
+                self.stdout.write(f"{path} ({filesizeformat(size)})")
+        self.stdout.write(f"Файлов без ссылок: {len(orphans)}, можно освободить: {filesizeformat(reclaimable)}")
+
+        if options["dry_run"] or not orphans:
+            return
+        deleted, freed = delete_orphans(orphans, batch_size=options["batch_size"], workers=options["workers"])
+        self.stdout.write(self.style.SUCCESS(f"Удалено файлов: {deleted}, освобождено: {filesizeformat(freed)}"))
@@ -1,9 +1,15 @@
+import json
+
 from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from ads.cleanup import CleanupLocked
 from ads.utils import (
     count_expired_ads,
     cleanup_expired_ads,
-    get_expired_ads_by_category,
-    get_ads_expiring_soon,
+    get_expired_stats_by_category,
+    get_expiring_histogram,
+    iter_expired_ads,
 )
 
 
@@ -25,62 +31,75 @@ class Command(BaseCommand):
             '--expiring',
             type=int,
             default=0,
-            help='Показать объявления, которые истекут через N дней (0 - не показывать)',
+            help='Показать, сколько объявлений истечёт через 1..N дней (0 - не показывать)',
         )
         parser.add_argument(
             '--cleanup',
             action='store_true',
             help='Удалить все истекшие объявления и связанные медиафайлы',
         )
+        parser.add_argument(
+            '--format',
+            choices=['text', 'json'],
+            default='text',
+            help='json — один JSON-документ для мониторинга',
+        )
 
     def handle(self, *args, **options):
+        # Все разделы отчёта считаются на один момент времени
+        now = timezone.now()
+        if options['format'] == 'json':
+            self.write_json(now, options)
+        else:
+            self.write_text(now, options)
+
+    def write_text(self, now, options):
         self.stdout.write(self.style.SUCCESS('=== Анализ истекших объявлений ==='))
-        
+
         # Основная статистика
-        result = count_expired_ads()
+        result = count_expired_ads(now)
         total_expired = result['total_expired_count']
-        total_media = result.get('total_expired_media_count', 0)
-        
+        total_media = result['total_expired_media_count']
+
         self.stdout.write(
             self.style.WARNING(f'Всего истекших объявлений: {total_expired}')
         )
         self.stdout.write(
             self.style.WARNING(f'Всего медиафайлов к удалению: {total_media}')
         )
-        
-        # Детальная информация
+
+        # Детальная информация — построчно, без загрузки всех объявлений в память
         if options['detailed'] and total_expired > 0:
             self.stdout.write('\n--- Детальная информация ---')
-            for ad in result['expired_ads']:
+            for ad in iter_expired_ads(now):
                 self.stdout.write(
                     f"ID: {ad['id']}, "
                     f"Категория: {ad['category']}, "
                     f"Телефон: {ad['contact_phone']}, "
                     f"Создано: {ad['created_at'].strftime('%Y-%m-%d %H:%M')}, "
-                    f"Медиа: {ad.get('media_count', 0)}"
+                    f"Медиа: {ad['media_count']}"
                 )
-        
+
         # Статистика по категориям
         if options['category']:
-            expired_by_category = get_expired_ads_by_category()
-            if expired_by_category:
+            by_category = get_expired_stats_by_category(now)
+            if by_category:
                 self.stdout.write('\n--- Статистика по категориям ---')
-                for category, count in expired_by_category.items():
-                    self.stdout.write(f"{category}: {count} истекших объявлений")
+                for row in by_category:
+                    self.stdout.write(
+                        f"{row['category']}: {row['expired_count']} истекших объявлений, "
+                        f"медиа: {row['media_count']}"
+                    )
             else:
                 self.stdout.write(self.style.SUCCESS('Нет истекших объявлений в категориях'))
-        
+
         # Объявления, которые скоро истекут
         if options['expiring'] > 0:
-            soon_expiring = get_ads_expiring_soon(options['expiring'])
-            if soon_expiring:
+            histogram = get_expiring_histogram(options['expiring'], now)
+            if any(histogram.values()):
                 self.stdout.write(f'\n--- Объявления, истекающие в ближайшие {options["expiring"]} дней ---')
-                for ad in soon_expiring:
-                    self.stdout.write(
-                        f"ID: {ad['id']}, "
-                        f"Категория: {ad['category']}, "
-                        f"Истекает через: {ad['expires_in_days']} дней"
-                    )
+                for day, count in histogram.items():
+                    self.stdout.write(f"Истекает через {day} дн.: {count}")
             else:
                 self.stdout.write(
                     self.style.SUCCESS(f'Нет объявлений, истекающих в ближайшие {options["expiring"]} дней')
@@ -88,7 +107,11 @@ class Command(BaseCommand):
 
         # Очистка истекших объявлений и связанных медиафайлов
         if options['cleanup']:
-            cleanup_result = cleanup_expired_ads()
+            try:
+                cleanup_result = cleanup_expired_ads()
+            except CleanupLocked:
+                self.stdout.write(self.style.WARNING('\nОчистка уже идёт в другом процессе'))
+                return
             deleted_ads = cleanup_result.get('deleted_ads', 0)
             deleted_media = cleanup_result.get('deleted_media', 0)
             self.stdout.write(
@@ -99,3 +122,36 @@ class Command(BaseCommand):
 
         if total_expired == 0 and not options['cleanup']:
             self.stdout.write(self.style.SUCCESS('Нет истекших объявлений!'))
+
+    def write_json(self, now, options):
+        """
+        Пишет документ по частям: список --detailed выводится потоком,
+        очистка (если есть) идёт после него и попадает в тот же документ.
+        """
+        def dumps(value):
+            return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+        out = self.stdout
+        out.write('{', ending='')
+        out.write(f'"generated_at": {dumps(now)}', ending='')
+        for key, value in count_expired_ads(now).items():
+            out.write(f', {dumps(key)}: {dumps(value)}', ending='')
+        if options['category']:
+            out.write(f', "by_category": {dumps(get_expired_stats_by_category(now))}', ending='')
+        if options['expiring'] > 0:
+            histogram = get_expiring_histogram(options['expiring'], now)
+            out.write(f', "expiring_histogram": {dumps(histogram)}', ending='')
+
+        if options['detailed']:
+            out.write(', "expired_ads": [', ending='')
+            for index, ad in enumerate(iter_expired_ads(now)):
+                out.write((', ' if index else '') + dumps(ad), ending='')
+            out.write(']', ending='')
+
+        if options['cleanup']:
+            try:
+                cleanup_result = cleanup_expired_ads()
+            except CleanupLocked:
+                cleanup_result = {'error': 'locked'}
+            out.write(f', "cleanup": {dumps(cleanup_result)}', ending='')
+        out.write('}')
@@ -0,0 +1,121 @@
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from ads.images import MEDIA_FIELDS, UPLOAD_ERRORS, build_variants, delete_variant_files, variant_paths
+from ads.models import AdPhoto, MediaBlob
+from ads.signals import feed_pairs_for_ads, feeds_changed, touch_owners
+from ads.storage import BLOB_ROOT, acquire, blob_path, hash_file
+
+
+class Command(BaseCommand):
+    help = "Переносит фото, загруженные до дедупликации, в blobs/ и склеивает одинаковые файлы"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать дубликаты")
+        parser.add_argument("--workers", type=int, default=8, help="Потоков для хэширования")
+
+    def handle(self, *args, **options):
+        media_root = settings.MEDIA_ROOT
+
+        # Путь вне blobs/ -> [(модель, поле)], на которые он записан
+        references = defaultdict(set)
+        for label, field_name in MEDIA_FIELDS:
+            model = apps.get_model(label)
+            names = model._default_manager.exclude(**{f"{field_name}__isnull": True})\
+                                          .exclude(**{field_name: ""})\
+                                          .exclude(**{f"{field_name}__startswith": BLOB_ROOT + "/"})\
+                                          .values_list(field_name, flat=True)\
+                                          .distinct()
+            for name in names.iterator():
+                references[name].add((model, field_name))
+
+        def digest_of(name):
+            try:
+                return name, hash_file(os.path.join(media_root, name))
+            except FileNotFoundError:
+                return name, None
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            digests = dict(pool.map(digest_of, references))
+
+        groups = defaultdict(list)
+        for name, digest in digests.items():
+            if digest:
+                groups[blob_path(digest, os.path.splitext(name)[1])].append(name)
+        reclaimable = sum(
+            os.path.getsize(os.path.join(media_root, name))
+            for target, names in groups.items()
+            for name in (names if os.path.exists(os.path.join(media_root, target)) else names[1:])
+        )
+        missing = [name for name, digest in digests.items() if digest is None]
+
+        self.stdout.write(
+            f"Файлов вне blobs/: {len(digests)}, уникальных: {len(groups)}, "
+            f"без файла на диске: {len(missing)}, можно освободить: {filesizeformat(reclaimable)}"
+        )
+        if options["dry_run"]:
+            return
+
+        ad_photo_ids = []
+        for target, names in groups.items():
+            ad_photo_ids.extend(self.fold(media_root, target, names, references))
+        if ad_photo_ids:
+            ad_ids = AdPhoto.objects.filter(id__in=ad_photo_ids).values_list("ad_id", flat=True)
+            feeds_changed(feed_pairs_for_ads(list(ad_ids)))
+        self.stdout.write(self.style.SUCCESS(f"Перенесено в blobs/: {len(digests) - len(missing)} файлов"))
+
+    def fold(self, media_root, target, names, references):
+        """
+        Переводит все записи с путями names на общий файл target.
+        Файл копируется до изменения базы, старые файлы удаляются после коммита:
+        прерванный запуск оставит лишь сирот для collect_orphan_media.
+        """
+        full_target = os.path.join(media_root, target)
+        if not os.path.exists(full_target):
+            os.makedirs(os.path.dirname(full_target), exist_ok=True)
+            tmp_path = full_target + ".tmp"
+            shutil.copyfile(os.path.join(media_root, names[0]), tmp_path)
+            os.replace(tmp_path, full_target)
+
+        try:
+            variants = build_variants(media_root, target)
+        except UPLOAD_ERRORS:
+            variants = {}
+
+        old_variant_paths, ad_photo_ids = set(), []
+        with transaction.atomic():
+            refs = 0
+            for name in names:
+                for model, field_name in references[name]:
+                    rows = model._default_manager.filter(**{field_name: name})
+                    for old_variants in rows.values_list(f"{field_name}_variants", flat=True):
+                        old_variant_paths.update(variant_paths(old_variants))
+                    pks = list(rows.values_list("pk", flat=True))
+                    if model is AdPhoto:
+                        ad_photo_ids.extend(pks)
+                    update = {field_name: target, f"{field_name}_variants": variants}
+                    if any(field.name == "updated_at" for field in model._meta.concrete_fields):
+                        update["updated_at"] = timezone.now()
+                    refs += rows.update(**update)
+                    # Старые файлы удаляются после коммита: синхронизация и ETag
+                    # списков должны отдать новые пути
+                    touch_owners(model, pks)
+            if refs:
+                acquire(target, refs)
+            MediaBlob.objects.filter(path=target).update(variants=variants)
+
+        for name in names:
+            try:
+                os.remove(os.path.join(media_root, name))
+            except FileNotFoundError:
+                pass
+        delete_variant_files(media_root, old_variant_paths)
+        return ad_photo_ids
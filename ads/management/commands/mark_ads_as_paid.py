@@ -1,5 +1,9 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from ads import counters
 from ads.models import Ad
+from ads.signals import feed_pairs_for_ads, feeds_changed
 
 class Command(BaseCommand):
     help = 'Marks all existing ads as paid (sets is_paid=True)'
@@ -14,7 +18,17 @@ class Command(BaseCommand):
             return
 
         # Update all unpaid ads
-        updated = ads_to_update.update(is_paid=True)
+        # update() не шлёт сигналы — счётчики и ленты затронутых городов правим сами
+        with transaction.atomic():
+            pairs = feed_pairs_for_ads(ads_to_update.values('id'))
+            old_keys = counters.counter_keys(ad__is_paid=False)
+            updated = ads_to_update.update(is_paid=True, updated_at=timezone.now())
+            counters.apply(old_keys, sign=-1)
+            counters.apply({
+                (city_id, category_id, True): count
+                for (city_id, category_id, _), count in old_keys.items()
+            })
+        feeds_changed(pairs)
         
         self.stdout.write(
             self.style.SUCCESS(f'Successfully marked {updated} ads as paid')
@@ -1,30 +1,9 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.utils import timezone
 from ads.models import Ad
-import re
-from typing import Optional
-
-
-def normalize_phone(raw: str) -> Optional[str]:
-    if not raw:
-        return None
-    digits = re.sub(r"\D+", "", raw)
-    if digits.startswith("996"):
-        if len(digits) == 12:
-            return digits
-        if len(digits) > 12 and digits[:12].isdigit():
-            return digits[:12]
-    if digits.startswith("0"):
-        rest = digits[1:]
-        if len(rest) == 9:
-            return "996" + rest
-    if len(digits) == 9:
-        return "996" + digits
-    if len(digits) == 10 and digits.startswith("0"):
-        return "996" + digits[1:]
-    if len(digits) == 12 and digits.startswith("996"):
-        return digits
-    return None
+from ads.signals import feed_pairs_for_ads, feeds_changed
+from ads.utils import normalize_phone
 
 
 class Command(BaseCommand):
@@ -38,7 +17,7 @@ class Command(BaseCommand):
         dry_run = options["dry_run"]
         batch_size = options["batch_size"]
 
-        qs = Ad.objects.all().only("id", "contact_phone")
+        qs = Ad.objects.all().only("id", "contact_phone", "phone_normalized")
         total = qs.count()
         changed = 0
         invalid = 0
@@ -49,19 +28,25 @@ class Command(BaseCommand):
             if not normalized:
                 invalid += 1
                 continue
-            if ad.contact_phone != normalized:
+            if ad.contact_phone != normalized or ad.phone_normalized != normalized:
                 ad.contact_phone = normalized
+                ad.phone_normalized = normalized
+                # bulk_update не трогает auto_now — иначе ads/sync не увидит изменение
+                ad.updated_at = timezone.now()
                 buffer.append(ad)
             if len(buffer) >= batch_size:
                 if not dry_run:
                     with transaction.atomic():
-                        Ad.objects.bulk_update(buffer, ["contact_phone"], batch_size=batch_size)
+                        Ad.objects.bulk_update(buffer, ["contact_phone", "phone_normalized", "updated_at"], batch_size=batch_size)
+                    # bulk_update не шлёт сигналы — телефон виден в ленте
+                    feeds_changed(feed_pairs_for_ads([ad.id for ad in buffer]))
                 changed += len(buffer)
                 buffer = []
         if buffer:
             if not dry_run:
                 with transaction.atomic():
-                    Ad.objects.bulk_update(buffer, ["contact_phone"], batch_size=batch_size)
+                    Ad.objects.bulk_update(buffer, ["contact_phone", "phone_normalized", "updated_at"], batch_size=batch_size)
+                feeds_changed(feed_pairs_for_ads([ad.id for ad in buffer]))
             changed += len(buffer)
 
         self.stdout.write(f"Total: {total}")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from ads.image_jobs import IMAGE_JOB_BATCH_SIZE, IMAGE_JOB_WORKERS, run_worker
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновой обработки фото объявлений (AD_IMAGE_PROCESSING = 'async')"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=IMAGE_JOB_WORKERS, help="Потоков обработки")
+        parser.add_argument("--batch-size", type=int, default=IMAGE_JOB_BATCH_SIZE)
+        parser.add_argument("--once", action="store_true", help="Выйти, когда очередь опустеет")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Пауза между проверками пустой очереди, с")
+        parser.add_argument("--max-seconds", type=float, default=None,
+                            help="Не брать новые задачи после этого времени")
+
+    def handle(self, *args, **options):
+        done, failed = run_worker(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            once=options["once"],
+            poll_interval=options["poll_interval"],
+            max_seconds=options["max_seconds"],
+        )
+        self.stdout.write(f"Обработано фото: {done}, с ошибкой: {failed}")
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ads.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = "Удаляет записи журнала удалений старше SYNC_TOMBSTONE_RETENTION_DAYS"
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(
+            f"Удалено записей: {deleted} (храним {settings.SYNC_TOMBSTONE_RETENTION_DAYS} дн.)"
+        ))
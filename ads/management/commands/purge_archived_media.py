@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ads import archive
+
+
+class Command(BaseCommand):
+    help = "Отпускает файлы фото архивных объявлений старше AD_ARCHIVE_MEDIA_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="По умолчанию AD_ARCHIVE_MEDIA_DAYS")
+
+    def handle(self, *args, **options):
+        days = settings.AD_ARCHIVE_MEDIA_DAYS if options["days"] is None else options["days"]
+        purged = archive.purge_media(timezone.now() - timedelta(days=days))
+        self.stdout.write(self.style.SUCCESS(f"Отпущены фото архивных записей: {purged} (храним {days} дн.)"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from ads.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Сверяет счётчики AdCounter с объявлениями и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Только показать расхождения")
+
+    def handle(self, *args, **options):
+        drift = reconcile(dry_run=options["dry_run"])
+        for (city_id, category_id, is_paid), current, expected in drift:
+            self.stdout.write(
+                f"city={city_id} category={category_id} is_paid={is_paid}: {current} -> {expected}"
+            )
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Счётчики совпадают"))
+        elif options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"Расхождений: {len(drift)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено счётчиков: {len(drift)}"))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ads import archive
+from ads.utils import normalize_phone_prefix
+
+
+class Command(BaseCommand):
+    help = "Возвращает объявления из холодного архива в живую таблицу"
+
+    def add_arguments(self, parser):
+        parser.add_argument("ad_ids", nargs="*", type=int, help="id объявлений")
+        parser.add_argument("--phone", default=None, help="Все архивные объявления номера (или префикса)")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        phone_prefix = normalize_phone_prefix(options["phone"]) if options["phone"] else None
+        if not options["ad_ids"] and not phone_prefix:
+            raise CommandError("Укажите id объявлений или --phone")
+
+        entries = archive.pending_restore(options["ad_ids"], phone_prefix)
+        restored, skipped = [], []
+        for entry in entries:
+            if options["dry_run"]:
+                self.stdout.write(f"ID: {entry['id']}, Телефон: {entry['contact_phone']}, Создано: {entry['created_at']}")
+                continue
+            ad = archive.restore_entry(entry)
+            if ad is None:
+                skipped.append(entry['id'])
+            else:
+                restored.append(entry['archive_id'])
+        if not options["dry_run"]:
+            archive.mark_restored(restored, timezone.now())
+
+        self.stdout.write(f"Найдено в архиве: {len(entries)}")
+        self.stdout.write(self.style.SUCCESS(f"Восстановлено: {len(restored)}"))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f"Пропущено (уже в базе или нет категории): {', '.join(map(str, skipped))}"
+            ))
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from ads.cleanup import Checkpoint, CleanupLocked
+from ads.images import delete_variant_files, variant_paths
+from ads.media_gc import file_fields
+from ads.models import AdPhoto
+from ads.signals import feed_pairs_for_ads, feeds_changed, touch_owners
+from ads.storage import ShardedUploadTo, is_flat, shard_path
+
+
+def target_of(name, prefix):
+    # Подкаталог считается от старого пути, а не случайный: повторный
+    # запуск после падения переносит файл туда же
+    return shard_path(prefix, name, hashlib.md5(name.encode()).hexdigest())
+
+
+def moved_variant(path, target):
+    return os.path.join(os.path.dirname(target), "variants", os.path.basename(path))
+
+
+def moved_variants(variants, name, target):
+    """JSON производных с путями рядом с новым местом файла."""
+    if not variants:
+        return variants
+    sizes = {
+        width: {fmt: moved_variant(path, target) for fmt, path in paths.items()}
+        for width, paths in variants.get("sizes", {}).items()
+    }
+    src = target if variants.get("src") == name else variants.get("src")
+    return {**variants, "src": src, "sizes": sizes}
+
+
+def link(media_root, old, new):
+    """
+    Жёсткая ссылка new на файл old (копия, если ФС не умеет ссылки).
+    False, если файла нет ни там, ни там.
+    """
+    source, target = os.path.join(media_root, old), os.path.join(media_root, new)
+    if not os.path.exists(target):
+        if not os.path.exists(source):
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            tmp_path = target + ".tmp"
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, target)
+    # У ссылки mtime исходника: свежая отметка не даст collect_orphan_media
+    # удалить файл, пока база ещё не указывает на него
+    os.utime(target)
+    return True
+
+
+class Command(BaseCommand):
+    help = "Переносит файлы из плоских каталогов upload_to в подкаталоги prefix/ab/cd/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать файлы в плоских каталогах")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8, help="Потоков для переноса файлов")
+
+    def handle(self, *args, **options):
+        fields = [
+            (model, field) for model, field in file_fields()
+            if isinstance(field.upload_to, ShardedUploadTo)
+        ]
+        if options["dry_run"]:
+            for model, field in fields:
+                prefix = field.upload_to.prefix
+                names = model._default_manager.filter(**{f"{field.attname}__startswith": prefix + "/"})\
+                                              .values_list(field.attname, flat=True)
+                flat = sum(1 for name in names.iterator() if is_flat(name, prefix))
+                self.stdout.write(f"{model._meta.label}.{field.name}: в {prefix}/ {flat} файлов")
+            return
+
+        checkpoint = Checkpoint(settings.MEDIA_SHARD_CHECKPOINT)
+        try:
+            checkpoint.acquire()
+        except CleanupLocked:
+            raise CommandError("shard_media уже запущен")
+        try:
+            # Прерванный запуск: пачки до last_pk уже в базе, а старые файлы
+            # последней пачки могли остаться не удалёнными
+            state = checkpoint.load() or {"last_pk": {}, "unlink": []}
+            self.unlink(state, checkpoint)
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                for model, field in fields:
+                    moved, missing = self.shard_field(model, field, state, checkpoint, pool, options["batch_size"])
+                    self.stdout.write(
+                        f"{model._meta.label}.{field.name}: перенесено {moved}, без файла на диске {missing}"
+                    )
+            checkpoint.clear()
+        finally:
+            checkpoint.release()
+
+    def unlink(self, state, checkpoint):
+        delete_variant_files(settings.MEDIA_ROOT, state["unlink"])
+        state["unlink"] = []
+        checkpoint.save(state)
+
+    def shard_field(self, model, field, state, checkpoint, pool, batch_size):
+        """
+        Переносит файлы поля пачками по batch_size записей. В каждой пачке
+        файлы сначала получают второе имя (ссылку) в новом месте, затем пути
+        меняются в базе одной транзакцией, и только после коммита и записи
+        чекпоинта удаляются старые имена. Падение на любом шаге не теряет
+        файлов: повтор дойдёт до той же пачки и перенесёт её в те же пути.
+        """
+        media_root = settings.MEDIA_ROOT
+        key = f"{model._meta.label}.{field.name}"
+        prefix = field.upload_to.prefix
+        field_name = field.attname
+        variants_field = f"{field_name}_variants"
+        concrete = {f.name for f in model._meta.concrete_fields}
+        has_variants = variants_field in concrete
+        columns = ["pk", field_name] + ([variants_field] if has_variants else [])
+        moved = missing = 0
+
+        while True:
+            batch = list(
+                model._default_manager.filter(pk__gt=state["last_pk"].get(key, 0),
+                                              **{f"{field_name}__startswith": prefix + "/"})
+                                      .order_by("pk")
+                                      .values_list(*columns)[:batch_size]
+            )
+            if not batch:
+                return moved, missing
+            rows = [(row[0], row[1], row[2] if has_variants else None) for row in batch if is_flat(row[1], prefix)]
+
+            # Один старый путь может стоять у нескольких записей
+            targets = {name: target_of(name, prefix) for _, name, _ in rows}
+            variant_targets = {
+                path: moved_variant(path, targets[name])
+                for _, name, variants in rows for path in variant_paths(variants)
+            }
+            files = {**targets, **variant_targets}
+            linked = dict(zip(files, pool.map(lambda old: link(media_root, old, files[old]), files)))
+
+            changed_pks = []
+            with transaction.atomic():
+                for pk, name, variants in rows:
+                    if not linked[name]:
+                        missing += 1
+                        continue
+                    update = {field_name: targets[name]}
+                    if has_variants:
+                        update[variants_field] = moved_variants(variants, name, targets[name])
+                    if "updated_at" in concrete:
+                        # updated_at входит в ETag списков бизнес-карточек
+                        update["updated_at"] = timezone.now()
+                    # Файл могли заменить, пока переносилась пачка
+                    if model._default_manager.filter(pk=pk, **{field_name: name}).update(**update):
+                        changed_pks.append(pk)
+                        moved += 1
+                # Старые пути удаляются после коммита: клиенты синхронизации
+                # и ETag списков должны получить новые в той же транзакции
+                touch_owners(model, changed_pks)
+                ad_ids = []
+                if model is AdPhoto and changed_pks:
+                    ad_ids = list(AdPhoto.objects.filter(pk__in=changed_pks).values_list("ad_id", flat=True))
+
+            state["last_pk"][key] = batch[-1][0]
+            state["unlink"] = [old for old in files if linked[old]]
+            checkpoint.save(state)
+            if ad_ids:
+                feeds_changed(feed_pairs_for_ads(ad_ids))
+            self.unlink(state, checkpoint)
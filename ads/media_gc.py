@@ -0,0 +1,161 @@
+"""
+Поиск и удаление медиафайлов, на которые не ссылается ни одна запись.
+
+Сироты появляются, когда строки удаляются queryset-ом или каскадом
+(EditAdView, DeleteAdView) и когда фото бизнеса перезаписываются новыми:
+в обоих случаях файл на диске остаётся. Сборщик собирает в память пути
+из всех ImageField/FileField проекта, параллельно обходит os.scandir
+каталоги upload_to этих полей и удаляет файлы, которых нет среди путей.
+
+Файлы моложе min_age не трогаются: загрузка пишет файл раньше, чем
+коммитится строка, которая на него ссылается.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+
+from .images import variant_paths
+from .models import MediaBlob
+from .storage import BLOB_ROOT
+
+GC_WORKERS = 8
+GC_BATCH_SIZE = 500
+GC_MIN_AGE = 60 * 60
+
+
+def file_fields():
+    """(модель, поле) для всех файловых полей проекта."""
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField):
+                yield model, field
+
+
+def scan_roots():
+    """Верхние каталоги MEDIA_ROOT, куда пишут поля (blobs, ad_photos, business, ...)."""
+    roots = {BLOB_ROOT}
+    for _, field in file_fields():
+        # ShardedUploadTo хранит каталог в prefix
+        upload_to = getattr(field.upload_to, 'prefix', field.upload_to)
+        if isinstance(upload_to, str) and upload_to.strip('/'):
+            roots.add(upload_to.strip('/').split('/')[0])
+    return sorted(roots)
+
+
+def referenced_paths():
+    """
+    Множество путей (относительно MEDIA_ROOT), которые хранятся в базе,
+    вместе с производными размерами из полей <поле>_variants.
+    """
+    paths = set()
+    for model, field in file_fields():
+        variants_field = f'{field.attname}_variants'
+        has_variants = any(f.name == variants_field for f in model._meta.get_fields())
+        columns = [field.attname, variants_field] if has_variants else [field.attname]
+        rows = model._default_manager.exclude(**{f'{field.attname}__isnull': True})\
+                                     .exclude(**{field.attname: ''})\
+                                     .values_list(*columns)
+        for row in rows.iterator(chunk_size=5000):
+            paths.add(os.path.normpath(row[0]))
+            if has_variants:
+                paths.update(os.path.normpath(path) for path in variant_paths(row[1]))
+    # Файлы blobs/, на которые ссылаются только записи холодного архива (ads/archive.py)
+    blobs = MediaBlob.objects.filter(refcount__gt=0).values_list('path', 'variants')
+    for path, variants in blobs.iterator(chunk_size=5000):
+        paths.add(os.path.normpath(path))
+        paths.update(os.path.normpath(variant) for variant in variant_paths(variants))
+    return paths
+
+
+def stat_files(paths, media_root):
+    found = []
+    for path in paths:
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        found.append((os.path.relpath(path, media_root), stat.st_size, stat.st_mtime))
+    return found
+
+
+def walk(directory, media_root):
+    """Все файлы под directory: (относительный путь, размер, mtime)."""
+    paths = []
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                paths.append(entry.path)
+    return stat_files(paths, media_root)
+
+
+def scan_media(media_root, roots, workers=GC_WORKERS, chunk_size=2000):
+    """
+    Обходит каталоги roots параллельно: каждый подкаталог уходит в свой поток,
+    а stat файлов плоского каталога (ad_photos/) делится на куски по chunk_size.
+    """
+    tasks = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for root in roots:
+            root_path = os.path.join(media_root, root)
+            if not os.path.isdir(root_path):
+                continue
+            paths = []
+            for entry in os.scandir(root_path):
+                if entry.is_dir(follow_symlinks=False):
+                    tasks.append(pool.submit(walk, entry.path, media_root))
+                elif entry.is_file(follow_symlinks=False):
+                    paths.append(entry.path)
+                    if len(paths) >= chunk_size:
+                        tasks.append(pool.submit(stat_files, paths, media_root))
+                        paths = []
+            if paths:
+                tasks.append(pool.submit(stat_files, paths, media_root))
+        return [item for task in tasks for item in task.result()]
+
+
+def find_orphans(media_root=None, min_age=GC_MIN_AGE, workers=GC_WORKERS):
+    """Список (путь, размер) файлов без ссылок из базы, старше min_age секунд."""
+    media_root = media_root or settings.MEDIA_ROOT
+    # Пути из базы читаются до обхода диска: файл, загруженный во время
+    # обхода, моложе min_age и в любом случае будет пропущен
+    referenced = referenced_paths()
+    cutoff = time.time() - min_age
+    return [
+        (path, size)
+        for path, size, mtime in scan_media(media_root, scan_roots(), workers)
+        if mtime < cutoff and os.path.normpath(path) not in referenced
+    ]
+
+
+def delete_orphans(orphans, media_root=None, batch_size=GC_BATCH_SIZE, workers=GC_WORKERS):
+    """Удаляет файлы пачками. Возвращает (удалено файлов, освобождено байт)."""
+    media_root = media_root or settings.MEDIA_ROOT
+
+    def delete(item):
+        path, size = item
+        try:
+            os.remove(os.path.join(media_root, path))
+            return size
+        except FileNotFoundError:
+            return None
+
+    deleted, freed = 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(orphans), batch_size):
+            for size in pool.map(delete, orphans[start:start + batch_size]):
+                if size is not None:
+                    deleted += 1
+                    freed += size
+    return deleted, freed
@@ -0,0 +1,179 @@
+"""
+Раздача файлов MEDIA_ROOT.
+
+Django только проверяет путь и отвечает на условные запросы, а байты по
+MEDIA_SERVING отдаёт:
+
+- 'accel' — nginx по X-Accel-Redirect на внутренний location:
+
+      location /protected-media/ {
+          internal;
+          alias /srv/aimak/media/;
+      }
+
+- 'sendfile' — Apache (mod_xsendfile) или lighttpd по X-Sendfile;
+- 'python' — сам воркер через FileResponse с поддержкой Range
+  (разработка и установки без прокси).
+
+ETag считается по mtime и размеру в формате nginx: при X-Accel-Redirect
+nginx ставит свой ETag, и валидаторы не меняются при переключении
+режима. Файлы blobs/ названы по хэшу содержимого и отдаются с immutable;
+остальные пути могут быть заняты новым файлом после удаления старого
+и кэшируются на MEDIA_CACHE_MAX_AGE.
+"""
+import mimetypes
+import os
+import re
+import stat as stat_module
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .media_gc import scan_roots
+from .storage import is_blob
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class MediaFileResponse(FileResponse):
+    block_size = 64 * 1024
+
+
+class RangeFile:
+    """Файл, из которого читается только length байт начиная с start."""
+
+    def __init__(self, path, start, length):
+        self.name = path
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@lru_cache(maxsize=None)
+def served_roots():
+    return frozenset(scan_roots())
+
+
+def resolve(path):
+    """Абсолютный путь файла или Http404, если его нельзя отдавать."""
+    parts = path.split('/')
+    if parts[0] not in served_roots() or any(part.startswith('.') for part in parts) or path.endswith('.tmp'):
+        # Вне каталогов полей, скрытые файлы и недописанные загрузки
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    return full_path
+
+
+def file_etag(stat):
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) включительно для одного диапазона bytes=...; None —
+    отдать файл целиком (нет заголовка, несколько диапазонов, ошибка
+    синтаксиса). ValueError — диапазон за концом файла.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', '') or not size:
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if not suffix:
+            raise ValueError(header)
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def range_allowed(request, etag, mtime):
+    """If-Range: диапазон отдаётся, только если файл не менялся."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def stream_file(request, full_path, stat, etag):
+    size = stat.st_size
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE', ''), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None or not range_allowed(request, etag, stat.st_mtime):
+        response = MediaFileResponse(open(full_path, 'rb'))
+    else:
+        start, end = byte_range
+        response = MediaFileResponse(RangeFile(full_path, start, end - start + 1), status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def handoff(full_path, path):
+    content_type, _ = mimetypes.guess_type(full_path)
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    if settings.MEDIA_SERVING == 'accel':
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    full_path = resolve(path)
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise Http404
+
+    etag = file_etag(stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        if settings.MEDIA_SERVING in ('accel', 'sendfile'):
+            response = handoff(full_path, path)
+        else:
+            response = stream_file(request, full_path, stat, etag)
+
+    if response.status_code != 416:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if is_blob(path):
+            response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+    return response
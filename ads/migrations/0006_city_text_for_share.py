@@ -4,6 +4,9 @@ from django.db import migrations, models
 
 def set_confident_flags(apps, schema_editor):
     Ad = apps.get_model("ads", "Ad")
+    # Поле is_confident появляется только в 0010: на свежей базе обновлять нечего
+    if not any(f.name == "is_confident" for f in Ad._meta.get_fields()):
+        return
     Ad.objects.update(is_confident=False)
 
 class Migration(migrations.Migration):
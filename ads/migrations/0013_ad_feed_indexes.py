@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0012_adcomplaint'),
+        ('categories', '0005_contacts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Сквозная таблица Ad.cities создаётся автоматически, Meta.indexes ей не задать
+        migrations.RunSQL(
+            'CREATE INDEX "ads_ad_cities_city_ad_idx" ON "ads_ad_cities" ("city_id", "ad_id");',
+            reverse_sql='DROP INDEX "ads_ad_cities_city_ad_idx";',
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['-created_at', '-id'], name='ad_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='ad_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['is_paid', '-created_at', '-id'], name='ad_paid_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='ad_author_created_idx'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+import re
+
+from django.db import migrations
+
+
+# Копии ads.utils.normalize_phone и ads.search.phone_search_terms на момент
+# миграции: история не должна меняться вместе с кодом приложения
+
+def normalize_phone(raw):
+    if not raw:
+        return None
+    digits = re.sub(r"\D+", "", raw)
+    if digits.startswith("996"):
+        if len(digits) == 12:
+            return digits
+        if len(digits) > 12 and digits[:12].isdigit():
+            return digits[:12]
+    if digits.startswith("0"):
+        rest = digits[1:]
+        if len(rest) == 9:
+            return "996" + rest
+    if len(digits) == 9:
+        return "996" + digits
+    if len(digits) == 10 and digits.startswith("0"):
+        return "996" + digits[1:]
+    if len(digits) == 12 and digits.startswith("996"):
+        return digits
+    return None
+
+
+def phone_search_terms(phone):
+    normalized = normalize_phone(phone)
+    if normalized:
+        return f"{normalized} {normalized[3:]}"
+    return re.sub(r"\D+", "", phone or "")
+
+
+def create_search_index(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    connection = schema_editor.connection
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS ads_ad_fts "
+                    "USING fts5(description, phone, tokenize = 'unicode61 remove_diacritics 2')"
+                )
+            except Exception:
+                # SQLite собран без FTS5 — поиск работает через запасной бэкенд
+                return
+            insert_sql = "INSERT INTO ads_ad_fts (rowid, description, phone) VALUES (%s, %s, %s)"
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS ads_ad_search ("
+                " ad_id bigint PRIMARY KEY REFERENCES ads_ad (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,"
+                " document tsvector NOT NULL)"
+            )
+            cursor.execute("CREATE INDEX IF NOT EXISTS ads_ad_search_document_idx ON ads_ad_search USING GIN (document)")
+            insert_sql = (
+                "INSERT INTO ads_ad_search (ad_id, document) VALUES "
+                "(%s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B'))"
+            )
+        else:
+            return
+
+        for ad in Ad.objects.only("id", "description", "contact_phone").iterator(chunk_size=1000):
+            cursor.execute(insert_sql, [ad.id, ad.description or "", phone_search_terms(ad.contact_phone)])
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("DROP TABLE IF EXISTS ads_ad_fts")
+        elif connection.vendor == "postgresql":
+            cursor.execute("DROP TABLE IF EXISTS ads_ad_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0013_ad_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
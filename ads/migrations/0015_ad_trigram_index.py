@@ -0,0 +1,112 @@
+import re
+
+from django.db import migrations
+
+
+# Копия ads.translit.fold на момент миграции: история не должна меняться
+# вместе с кодом приложения
+
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    "ң": "ng", "ө": "o", "ү": "u",
+}
+
+LATIN_VARIANTS = [
+    ("zh", "j"),
+    ("kh", "h"),
+    ("x", "h"),
+    ("w", "v"),
+    ("q", "k"),
+    ("ö", "o"),
+    ("ü", "u"),
+    ("ñ", "ng"),
+]
+
+NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+REPEAT_RE = re.compile(r"(.)\1+")
+
+
+def fold(text):
+    if not text:
+        return ""
+    text = text.casefold()
+    text = "".join(CYRILLIC_TO_LATIN.get(ch, ch) for ch in text)
+    for variant, canonical in LATIN_VARIANTS:
+        text = text.replace(variant, canonical)
+    text = NON_WORD_RE.sub(" ", text)
+    text = REPEAT_RE.sub(r"\1", text)
+    return " ".join(text.split())
+
+
+def create_trigram_index(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    connection = schema_editor.connection
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS ads_ad_folded USING fts5(folded)")
+                # Словарь сложенных слов и триграммный индекс по нему (слова с пробелами по краям)
+                cursor.execute(
+                    "CREATE TABLE IF NOT EXISTS ads_search_term (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE)"
+                )
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS ads_search_term_trigram USING fts5(term, tokenize = 'trigram')"
+                )
+            except Exception:
+                # Токенизатор trigram есть только в SQLite >= 3.34 — поиск работает через запасной бэкенд
+                cursor.execute("DROP TABLE IF EXISTS ads_ad_folded")
+                cursor.execute("DROP TABLE IF EXISTS ads_search_term")
+                return
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS ads_search_term_ai AFTER INSERT ON ads_search_term BEGIN "
+                "INSERT INTO ads_search_term_trigram (rowid, term) VALUES (new.id, ' ' || new.term || ' '); "
+                "END"
+            )
+            for ad in Ad.objects.only("id", "description").iterator(chunk_size=1000):
+                folded = fold(ad.description)
+                cursor.execute("INSERT INTO ads_ad_folded (rowid, folded) VALUES (%s, %s)", [ad.id, folded])
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO ads_search_term (term) VALUES (%s)",
+                    [[term] for term in set(folded.split())],
+                )
+        elif connection.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute("ALTER TABLE ads_ad_search ADD COLUMN IF NOT EXISTS folded text NOT NULL DEFAULT ''")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ads_ad_search_folded_trgm_idx "
+                "ON ads_ad_search USING GIN (folded gin_trgm_ops)"
+            )
+            for ad in Ad.objects.only("id", "description").iterator(chunk_size=1000):
+                cursor.execute(
+                    "UPDATE ads_ad_search SET folded = %s WHERE ad_id = %s",
+                    [fold(ad.description), ad.id],
+                )
+
+
+def drop_trigram_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("DROP TRIGGER IF EXISTS ads_search_term_ai")
+            cursor.execute("DROP TABLE IF EXISTS ads_search_term_trigram")
+            cursor.execute("DROP TABLE IF EXISTS ads_search_term")
+            cursor.execute("DROP TABLE IF EXISTS ads_ad_folded")
+        elif connection.vendor == "postgresql":
+            cursor.execute("DROP INDEX IF EXISTS ads_ad_search_folded_trgm_idx")
+            cursor.execute("ALTER TABLE ads_ad_search DROP COLUMN IF EXISTS folded")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0014_ad_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:25
+
+import re
+
+from django.db import migrations, models
+
+
+def normalize_phone(raw):
+    # Копия ads.utils.normalize_phone на момент миграции: история не должна
+    # меняться вместе с кодом приложения
+    if not raw:
+        return None
+    digits = re.sub(r"\D+", "", raw)
+    if digits.startswith("996"):
+        if len(digits) == 12:
+            return digits
+        if len(digits) > 12 and digits[:12].isdigit():
+            return digits[:12]
+    if digits.startswith("0"):
+        rest = digits[1:]
+        if len(rest) == 9:
+            return "996" + rest
+    if len(digits) == 9:
+        return "996" + digits
+    if len(digits) == 10 and digits.startswith("0"):
+        return "996" + digits[1:]
+    if len(digits) == 12 and digits.startswith("996"):
+        return digits
+    return None
+
+
+def fill_phone_normalized(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    buffer = []
+    for ad in Ad.objects.only("id", "contact_phone").iterator(chunk_size=1000):
+        ad.phone_normalized = normalize_phone(ad.contact_phone)
+        buffer.append(ad)
+        if len(buffer) >= 1000:
+            Ad.objects.bulk_update(buffer, ["phone_normalized"])
+            buffer = []
+    if buffer:
+        Ad.objects.bulk_update(buffer, ["phone_normalized"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0015_ad_trigram_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='phone_normalized',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.RunPython(fill_phone_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0016_ad_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='ads_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
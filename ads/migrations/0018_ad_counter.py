@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    AdCounter = apps.get_model('ads', 'AdCounter')
+    rows = Ad.cities.through.objects.values('city_id', 'ad__category_id', 'ad__is_paid')\
+                                    .annotate(total=Count('ad_id'))\
+                                    .order_by()
+    AdCounter.objects.bulk_create([
+        AdCounter(
+            city_id=row['city_id'],
+            category_id=row['ad__category_id'],
+            is_paid=row['ad__is_paid'],
+            count=row['total'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0017_city_feed_validators'),
+        ('categories', '0006_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_paid', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ad_counters', to='categories.category')),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ad_counters', to='ads.city')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('city', 'is_paid', 'category'), name='ad_counter_unique')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def updated_from_created(apps, schema_editor):
+    # Иначе у всех старых объявлений updated_at = время миграции
+    Ad = apps.get_model('ads', 'Ad')
+    Ad.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0018_ad_counter'),
+        ('categories', '0006_category_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ad_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(updated_from_created, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['updated_at', 'id'], name='ad_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='adtombstone',
+            name='city',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ad_tombstones', to='ads.city'),
+        ),
+        migrations.AddIndex(
+            model_name='adtombstone',
+            index=models.Index(fields=['city', 'id'], name='ad_tombstone_city_idx'),
+        ),
+    ]
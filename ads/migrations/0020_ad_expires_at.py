@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:36
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_expires_at(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    Category = apps.get_model('categories', 'Category')
+    for category_id, lifetime_days in Category.objects.values_list('id', 'lifetime_days'):
+        Ad.objects.filter(category_id=category_id)\
+                  .update(expires_at=F('created_at') + timedelta(days=lifetime_days))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0019_ad_sync'),
+        ('categories', '0007_category_lifetime_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_expires_at, migrations.RunPython.noop),
+    ]
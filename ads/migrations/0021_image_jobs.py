@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0020_ad_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adphoto',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('ready', 'Готово'), ('failed', 'Ошибка обработки')], default='ready', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('failed', 'Ошибка')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='ads.adphoto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='image_job_queue_idx')],
+            },
+        ),
+    ]
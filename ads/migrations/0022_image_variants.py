@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0021_image_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adphoto',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
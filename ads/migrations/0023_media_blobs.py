@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:52
+
+import ads.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0022_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('refcount', models.IntegerField(default=0)),
+                ('variants', models.JSONField(blank=True, default=dict)),
+                ('source_sha256', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='adphoto',
+            name='image',
+            field=models.ImageField(storage=ads.storage.media_storage, upload_to='ad_photos/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:10
+
+import ads.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0023_media_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='adphoto',
+            name='image',
+            field=models.ImageField(storage=ads.storage.media_storage, upload_to=ads.storage.ShardedUploadTo('ad_photos')),
+        ),
+    ]
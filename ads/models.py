@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 from django.db import models
+from django.db.models import Exists, OuterRef, Value
+from django.db.models.functions import Coalesce
 from categories.models import Category
+from .storage import ShardedUploadTo, media_storage
 from users.models import User
 
 
@@ -17,40 +21,185 @@ class City(models.Model):
     appstore_link = models.URLField(blank=True, null=True)  
     update_text = models.TextField(max_length=1000, blank=True, null=True, default="")
     required_version = models.CharField(max_length=20, blank=True, null=True)
-    
+
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+    # Растёт при любом изменении объявлений города — ETag лент и ключ кэша их страниц
+    ads_version = models.PositiveBigIntegerField(default=0)
+
     def __str__(self):
         return self.name
 
+class AdQuerySet(models.QuerySet):
+    def in_city(self, city_id):
+        # Фильтр через EXISTS вместо JOIN по cities: планировщик идёт по индексу
+        # created_at в порядке сортировки и проверяет город точечным поиском,
+        # без временной сортировки всех объявлений города
+        city_links = Ad.cities.through.objects.filter(ad_id=OuterRef('pk'), city_id=city_id)
+        return self.filter(Exists(city_links))
+
+    def unexpired(self):
+        # Скрывает истекшие до ночной очистки; записи без expires_at не скрываются.
+        # COALESCE не даёт планировщику уйти с индекса сортировки ленты на expires_at:
+        # истекших до очистки единицы, их дешевле отсеять по ходу чтения страницы
+        if not settings.HIDE_EXPIRED_ADS:
+            return self
+        now = timezone.now()
+        return self.alias(expiry=Coalesce('expires_at', Value(now))).filter(expiry__gte=now)
+
+
 class Ad(models.Model):
     description = models.TextField()
     contact_phone = models.CharField(max_length=20)
+    # Телефон в виде 996XXXXXXXXX для индексного поиска по префиксу
+    phone_normalized = models.CharField(max_length=12, blank=True, null=True, db_index=True)
     category = models.ForeignKey('categories.Category', on_delete=models.CASCADE, related_name='ads')
     cities = models.ManyToManyField('City', related_name='ads')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # created_at + срок жизни категории, пересчитывается в save()
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
     author = models.ForeignKey(User, on_delete=models.PROTECT, related_name='ads', null=True, blank=True, default=None)
     is_confident = models.BooleanField(default=False)
     is_paid = models.BooleanField(default=False)
+
+    objects = AdQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='ad_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='ad_category_created_idx'),
+            models.Index(fields=['is_paid', '-created_at', '-id'], name='ad_paid_created_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='ad_author_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='ad_updated_idx'),
+        ]
+
     def __str__(self):
         return f"{self.contact_phone} - {self.category.name_kg}"
 
-    def is_expired(self):
-        if self.category.ru_name.lower() == "попутка":
-            lifetime = timedelta(days=5)
-        else:
-            lifetime = timedelta(days=30)
+    def save(self, *args, **kwargs):
+        from .utils import normalize_phone
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'contact_phone' in update_fields:
+            # Любой путь сохранения (вьюхи, админка, скрипты) держит индекс по телефону в актуальном виде
+            self.phone_normalized = normalize_phone(self.contact_phone)
+            if update_fields is not None:
+                update_fields = kwargs['update_fields'] = {*update_fields, 'phone_normalized'}
+        if update_fields is None or {'created_at', 'category'} & set(update_fields):
+            # У новой записи created_at ещё не проставлен auto_now_add
+            created_at = self.created_at or timezone.now()
+            self.expires_at = created_at + timedelta(days=self.category.lifetime_days)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'expires_at'}
+        super().save(*args, **kwargs)
 
-        return timezone.now() > self.created_at + lifetime
+    def is_expired(self):
+        return self.expires_at is not None and timezone.now() > self.expires_at
 
 
 class AdPhoto(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает обработки'),
+        (STATUS_READY, 'Готово'),
+        (STATUS_FAILED, 'Ошибка обработки'),
+    ]
+
     ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='photos')
-    image = models.ImageField(upload_to='ad_photos/')
+    # Файл хранится под хэшем содержимого, общий для одинаковых загрузок
+    image = models.ImageField(upload_to=ShardedUploadTo('ad_photos'), storage=media_storage)
+    # pending — в image лежит исходная загрузка, сжатую версию готовит process_image_jobs
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_READY)
+    # Уменьшенные копии WebP/JPEG (ads/images.py), строятся после сохранения файла
+    image_variants = models.JSONField(default=dict, blank=True)
+
+
+class MediaBlob(models.Model):
+    """
+    Файл в blobs/ (ads/storage.py) и число записей, которые на него ссылаются.
+    variants — производные, общие для всех ссылок; source_sha256 — хэш исходной
+    загрузки, из которой получен этот сжатый файл: повторную загрузку тех же
+    байтов не нужно сжимать заново.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    refcount = models.IntegerField(default=0)
+    variants = models.JSONField(default=dict, blank=True)
+    source_sha256 = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.path} ({self.refcount})'
 
-    def delete(self, *args, **kwargs):
-        storage, path = self.image.storage, self.image.path
-        super().delete(*args, **kwargs)
-        if storage.exists(path):
-            storage.delete(path)
+
+class ImageJob(models.Model):
+    """
+    Задача фоновой обработки фото (ads/image_jobs.py). Воркер забирает
+    pending-задачи с run_after <= now, при ошибке откладывает повтор,
+    выполненную задачу удаляет.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    photo = models.ForeignKey(AdPhoto, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='image_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.photo_id}: {self.status}'
+
+
+class AdCounter(models.Model):
+    """
+    Денормализованное число объявлений по (город, категория, оплачено).
+    Поддерживается сигналами в ads/counters.py, расхождения чинит reconcile_ad_counters.
+    """
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='ad_counters')
+    category = models.ForeignKey('categories.Category', on_delete=models.CASCADE, related_name='ad_counters')
+    is_paid = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Порядок полей = порядок в индексе: все категории города читаются одним проходом
+            models.UniqueConstraint(fields=['city', 'is_paid', 'category'], name='ad_counter_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.city_id}/{self.category_id}/{self.is_paid}: {self.count}'
+
+
+class AdTombstone(models.Model):
+    """
+    Запись о том, что объявление ушло из ленты города (удалено, истекло,
+    снят город). По ним ads/sync отдаёт клиентам id удалённых объявлений.
+    Хранятся SYNC_TOMBSTONE_RETENTION_DAYS дней.
+    """
+    ad_id = models.BigIntegerField()
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='ad_tombstones')
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'id'], name='ad_tombstone_city_idx'),
+        ]
 
 
 class AdComplaint(models.Model):
@@ -0,0 +1,88 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidPageParams(ValueError):
+    pass
+
+
+def page_params(params, default_limit=20):
+    """
+    (limit, page) из query-параметров ленты. limit ограничивается
+    1..MAX_FEED_LIMIT, нечисловые значения — InvalidPageParams.
+    """
+    try:
+        limit = int(params.get('limit', default_limit))
+        page = int(params.get('page', 1))
+    except (TypeError, ValueError):
+        raise InvalidPageParams(params)
+    return min(max(limit, 1), settings.MAX_FEED_LIMIT), page
+
+
+class CountedPaginator(Paginator):
+    """Paginator с заранее известным числом объектов (из AdCounter) — без COUNT(*)."""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._known_count = count
+
+    @cached_property
+    def count(self):
+        return self._known_count
+
+
+def encode_cursor(created_at, pk):
+    """
+    Упаковывает позицию (created_at, id) последнего объявления страницы
+    в непрозрачную для клиента строку.
+    """
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        created_raw, pk_raw = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_raw), int(pk_raw)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+def paginate_by_cursor(queryset, cursor, limit):
+    """
+    Keyset-пагинация по (-created_at, -id): без COUNT(*) и без OFFSET,
+    каждая страница — это поиск по индексу от позиции курсора.
+    Пустой курсор означает первую страницу. Работает и с values()-выборкой.
+    Возвращает (список объектов, next_cursor или None).
+    """
+    # Пустая страница не даёт курсора: с limit < 1 items[-1] упал бы на пустом списке
+    limit = max(limit, 1)
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    # Берём на один элемент больше, чтобы понять, есть ли следующая страница
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor(last['created_at'], last['id'])
+        else:
+            next_cursor = encode_cursor(last.created_at, last.id)
+    return items, next_cursor
@@ -0,0 +1,159 @@
+"""
+Заглушки для фото, пока грузится оригинал: BlurHash, преобладающий цвет
+и размеры исходника.
+
+Считаются один раз при построении производных (ads/images.build_variants)
+и хранятся в том же JSON <поле>_variants:
+{'width': 1600, 'height': 1200, 'blurhash': 'LEHV6n...', 'color': '#6f5a43'}.
+
+BlurHash кодируется по уменьшенной до THUMB_SIZE копии. Для одного фото
+хватает чистого Python; backfill_photo_placeholders считает пачку сразу
+матричными операциями numpy, если он установлен.
+"""
+import math
+
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:  # numpy не обязателен: пачка считается по одному фото
+    numpy = None
+
+THUMB_SIZE = 32
+# Компонент по длинной и короткой стороне
+COMPONENTS = (4, 3)
+DOMINANT_COLORS = 5
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+# sRGB -> линейная яркость для каждого значения канала
+SRGB_TO_LINEAR = [
+    value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+    for value in (channel / 255 for channel in range(256))
+]
+
+
+def encode83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def linear_to_srgb(value):
+    value = min(1.0, max(0.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def components_for(width, height):
+    """(компонент по X, по Y): больше — вдоль длинной стороны."""
+    long_side, short_side = COMPONENTS
+    return (long_side, short_side) if width >= height else (short_side, long_side)
+
+
+def thumb(img):
+    """Копия THUMB_SIZE x THUMB_SIZE в RGB; пропорции учитываются числом компонент."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img.resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR)
+
+
+def blurhash_factors(small, x_components, y_components):
+    """Коэффициенты косинусного разложения [(r, g, b), ...] по строкам j, затем i."""
+    size = THUMB_SIZE
+    pixels = [tuple(SRGB_TO_LINEAR[c] for c in pixel) for pixel in small.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / size) for x in range(size)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / size) for y in range(size)] for j in range(y_components)]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            r = g = b = 0.0
+            for y in range(size):
+                row = pixels[y * size:(y + 1) * size]
+                for x, (pr, pg, pb) in enumerate(row):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == j == 0 else 2) / (size * size)
+            factors.append((r * scale, g * scale, b * scale))
+    return factors
+
+
+def encode_factors(factors, x_components, y_components):
+    dc, ac = factors[0], factors[1:]
+    result = encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, int(max(abs(v) for factor in ac for v in factor) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+    else:
+        quantised, maximum = 0, 1
+    result += encode83(quantised, 1)
+    r, g, b = (linear_to_srgb(v) for v in dc)
+    result += encode83((r << 16) + (g << 8) + b, 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.copysign(abs(v / maximum) ** 0.5, v) * 9 + 9.5)))
+            for v in factor
+        )
+        result += encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def dominant_color(small):
+    """Самый частый цвет после квантования до DOMINANT_COLORS цветов, '#rrggbb'."""
+    quantized = small.quantize(DOMINANT_COLORS)
+    palette = quantized.getpalette()
+    _, index = max(quantized.getcolors())
+    return '#{:02x}{:02x}{:02x}'.format(*palette[index * 3:index * 3 + 3])
+
+
+def describe(img, width, height):
+    """Заглушка фото по уже уменьшенному img; width и height — размеры исходника."""
+    small = thumb(img)
+    x_components, y_components = components_for(width, height)
+    return {
+        'width': width,
+        'height': height,
+        'blurhash': encode_factors(blurhash_factors(small, x_components, y_components), x_components, y_components),
+        'color': dominant_color(small),
+    }
+
+
+def describe_many(items):
+    """
+    describe() для пачки [(img, width, height), ...]. С numpy разложение всей
+    пачки — одна свёртка по массиву N x THUMB_SIZE x THUMB_SIZE x 3.
+    """
+    if numpy is None or len(items) < 2:
+        return [describe(img, width, height) for img, width, height in items]
+
+    smalls = [thumb(img) for img, _, _ in items]
+    srgb = numpy.stack([numpy.asarray(small, dtype=numpy.float64) for small in smalls]) / 255
+    linear = numpy.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    positions = numpy.arange(THUMB_SIZE) * math.pi / THUMB_SIZE
+    # Базис на максимум компонент; каждому фото потом берётся свой угол сетки
+    most = max(COMPONENTS)
+    cos_x = numpy.cos(numpy.outer(numpy.arange(most), positions))
+    factors = numpy.einsum('jy,ix,nyxc->njic', cos_x, cos_x, linear) / (THUMB_SIZE * THUMB_SIZE)
+    factors[:, 1:, :, :] *= 2
+    factors[:, 0, 1:, :] *= 2
+
+    described = []
+    for n, ((_, width, height), small) in enumerate(zip(items, smalls)):
+        x_components, y_components = components_for(width, height)
+        grid = factors[n, :y_components, :x_components].reshape(-1, 3)
+        described.append({
+            'width': width,
+            'height': height,
+            'blurhash': encode_factors([tuple(map(float, f)) for f in grid], x_components, y_components),
+            'color': dominant_color(small),
+        })
+    return described
+
+
+def placeholder_of(variants):
+    """Заглушка для ответа API из JSON производных; None, если ещё не посчитана."""
+    variants = variants or {}
+    if 'blurhash' not in variants:
+        return None
+    return {key: variants[key] for key in ('width', 'height', 'blurhash', 'color')}
@@ -0,0 +1,137 @@
+"""
+Сериализация объявлений для лент без загрузки моделей целиком.
+
+Объявления выбираются через values() только с нужными колонками, фото,
+города и авторы страницы подгружаются одним запросом каждый. Ссылка на
+фото — это MEDIA_BASE_URL (или абсолютный MEDIA_URL) плюс путь из базы,
+без обращения к storage на каждое фото; так же строятся ссылки на
+производные размеры (images_srcset). Заглушки фото (images_placeholders)
+берутся из того же JSON производных.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.encoding import filepath_to_uri
+
+from .models import Ad, AdPhoto
+from .placeholders import placeholder_of
+
+AD_FIELDS = ('id', 'description', 'contact_phone', 'category_id', 'category__name_kg', 'created_at')
+DETAILED_AD_FIELDS = AD_FIELDS + ('author_id', 'is_paid')
+
+
+def ad_rows(queryset, detailed=False):
+    """values()-выборка объявлений; порядок и фильтры берутся из queryset."""
+    return queryset.values(*(DETAILED_AD_FIELDS if detailed else AD_FIELDS))
+
+
+def ad_rows_by_ids(queryset, ad_ids, detailed=False):
+    """Строки объявлений в порядке ad_ids (например, по рангу поиска)."""
+    rows = {row['id']: row for row in ad_rows(queryset.order_by().filter(id__in=ad_ids), detailed)}
+    return [rows[ad_id] for ad_id in ad_ids if ad_id in rows]
+
+
+def media_prefix(request=None):
+    """Общий префикс ссылок на медиа: CDN, абсолютный MEDIA_URL или относительный без запроса."""
+    if settings.MEDIA_BASE_URL:
+        return settings.MEDIA_BASE_URL.rstrip('/') + '/'
+    if request is not None:
+        return request.build_absolute_uri(settings.MEDIA_URL)
+    return settings.MEDIA_URL
+
+
+def srcset_map(variants, prefix):
+    """Производные фото для клиента: {'webp': {'160': url, ...}, 'jpeg': {...}}."""
+    srcset = {}
+    for width, paths in (variants or {}).get('sizes', {}).items():
+        for ext, path in paths.items():
+            srcset.setdefault(ext, {})[width] = prefix + filepath_to_uri(path)
+    return srcset
+
+
+def photo_entries_by_ad(ad_ids, prefix):
+    """
+    Фото объявлений: {ad_id: [(url, srcset_map, заглушка), ...]} одним запросом.
+    Фото в очереди на сжатие (ads/image_jobs.py) не отдаются: это несжатый исходник.
+    """
+    entries = defaultdict(list)
+    rows = AdPhoto.objects.filter(ad_id__in=ad_ids)\
+                          .exclude(status=AdPhoto.STATUS_PENDING)\
+                          .order_by('id')\
+                          .values_list('ad_id', 'image', 'image_variants')
+    for ad_id, path, variants in rows:
+        if path:
+            entries[ad_id].append((
+                prefix + filepath_to_uri(path), srcset_map(variants, prefix), placeholder_of(variants),
+            ))
+    return entries
+
+
+def photos_by_ad(ad_ids, prefix):
+    return {
+        ad_id: [url for url, _, _ in entries]
+        for ad_id, entries in photo_entries_by_ad(ad_ids, prefix).items()
+    }
+
+
+def cities_by_ad(ad_ids):
+    cities = defaultdict(list)
+    rows = Ad.cities.through.objects.filter(ad_id__in=ad_ids)\
+                                    .order_by('id')\
+                                    .values_list('ad_id', 'city_id', 'city__name')
+    for ad_id, city_id, name in rows:
+        cities[ad_id].append((city_id, name))
+    return cities
+
+
+def author_names(author_ids):
+    author_ids = {author_id for author_id in author_ids if author_id is not None}
+    if not author_ids:
+        return {}
+    return dict(get_user_model().objects.filter(id__in=author_ids).values_list('id', 'name'))
+
+
+def serialize_ads(rows, request=None, detailed=False, with_paid=False, with_category_id=False):
+    """
+    Список объявлений в формате лент.
+    detailed — модераторский вид: category_id, города и автор (строки из ad_rows(..., detailed=True)).
+    with_paid — добавить is_paid, with_category_id — category_id без остального модераторского вида.
+    """
+    rows = list(rows)
+    ad_ids = [row['id'] for row in rows]
+    if not ad_ids:
+        return []
+
+    photos = photo_entries_by_ad(ad_ids, media_prefix(request))
+    if detailed:
+        cities = cities_by_ad(ad_ids)
+        authors = author_names(row['author_id'] for row in rows)
+
+    data = []
+    for row in rows:
+        item = {
+            "id": row['id'],
+            "description": row['description'],
+            "contact_phone": row['contact_phone'],
+            "category": row['category__name_kg'],
+        }
+        if detailed or with_category_id:
+            item["category_id"] = row['category_id']
+        if detailed:
+            ad_cities = cities.get(row['id'], [])
+            item["cities"] = [name for _, name in ad_cities]
+            item["cities_ids"] = [city_id for city_id, _ in ad_cities]
+        item["created_at"] = row['created_at'].isoformat()
+        if detailed:
+            item["author"] = authors.get(row['author_id'])
+        if with_paid:
+            item["is_paid"] = row['is_paid']
+        ad_photos = photos.get(row['id'], [])
+        item["images"] = [url for url, _, _ in ad_photos]
+        # Параллельно images: уменьшенные копии каждого фото для srcset
+        item["images_srcset"] = [srcset for _, srcset, _ in ad_photos]
+        # и заглушки {width, height, blurhash, color} (None, пока не посчитаны)
+        item["images_placeholders"] = [placeholder for _, _, placeholder in ad_photos]
+        data.append(item)
+    return data
@@ -0,0 +1,367 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Ad
+from .translit import fold, similarity, trigrams
+from .utils import normalize_phone
+
+# Сколько объявлений отдаёт поиск
+SEARCH_LIMIT = 30
+
+# Минимальная триграммная похожесть слова запроса и слова из словаря
+FUZZY_MIN_SIMILARITY = 0.3
+
+# Сколько похожих слов словаря подставлять вместо одного слова запроса
+FUZZY_TERMS_PER_WORD = 8
+
+# Сколько слов-кандидатов из триграммного индекса словаря переранжировать в Python
+FUZZY_TERM_CANDIDATES = 300
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+PHONE_QUERY_RE = re.compile(r"^[\d\s+()\-]+$")
+
+
+def phone_search_terms(phone):
+    """
+    Телефон индексируется в двух видах: 996XXXXXXXXX и без кода страны,
+    чтобы находились и «+996 555…», и «0555…», и «555…».
+    """
+    normalized = normalize_phone(phone)
+    if normalized:
+        return f"{normalized} {normalized[3:]}"
+    return re.sub(r"\D+", "", phone or "")
+
+
+def phone_query_prefix(query):
+    """Цифры из запроса-телефона в том виде, в котором их искать по префиксу."""
+    digits = re.sub(r"\D+", "", query)
+    if digits.startswith("0"):
+        digits = digits[1:]
+    return digits
+
+
+def is_phone_query(query):
+    return bool(PHONE_QUERY_RE.match(query))
+
+
+class SearchBackend:
+    """
+    Общий интерфейс полнотекстового поиска по объявлениям.
+    search() возвращает id объявлений города в порядке релевантности:
+    сначала точные совпадения по словам (ranked_search), затем нечёткие
+    совпадения по триграммам сложенного текста (fuzzy_search) —
+    они находят «toyota» по «тойота», «онгой» по «оңой» и опечатки.
+    """
+
+    def index_ad(self, ad):
+        pass
+
+    def remove_ads(self, ad_ids):
+        pass
+
+    def rebuild(self):
+        for ad in Ad.objects.only("id", "description", "contact_phone").iterator(chunk_size=1000):
+            self.index_ad(ad)
+
+    def ranked_search(self, query, city_id, limit, category_id=None):
+        raise NotImplementedError
+
+    def fuzzy_search(self, query, city_id, limit, category_id=None):
+        return []
+
+    def search(self, query, city_id, limit=SEARCH_LIMIT, category_id=None):
+        ad_ids = self.ranked_search(query, city_id, limit, category_id)
+        if len(ad_ids) < limit and not is_phone_query(query):
+            seen = set(ad_ids)
+            for ad_id in self.fuzzy_search(query, city_id, limit, category_id):
+                if ad_id not in seen:
+                    ad_ids.append(ad_id)
+                    seen.add(ad_id)
+                if len(ad_ids) >= limit:
+                    break
+        return ad_ids
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    FTS5-таблица ads_ad_fts (слова описания и телефон, ранжирование bm25)
+    и FTS5-таблица ads_ad_folded со сложенным текстом. В обеих rowid = id объявления.
+
+    Нечёткий поиск идёт через словарь сложенных слов ads_search_term
+    с триграммным FTS5-индексом ads_search_term_trigram: каждое слово запроса
+    заменяется похожими словами словаря, и уже они ищутся в ads_ad_folded.
+    Словарь на порядки меньше корпуса, поэтому объединение триграмм по нему дешёвое.
+    """
+
+    table = "ads_ad_fts"
+    folded_table = "ads_ad_folded"
+    term_table = "ads_search_term"
+    term_trigram_table = "ads_search_term_trigram"
+
+    def index_ad(self, ad):
+        folded = fold(ad.description)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [ad.pk])
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, description, phone) VALUES (%s, %s, %s)",
+                [ad.pk, ad.description or "", phone_search_terms(ad.contact_phone)],
+            )
+            cursor.execute(f"DELETE FROM {self.folded_table} WHERE rowid = %s", [ad.pk])
+            cursor.execute(
+                f"INSERT INTO {self.folded_table} (rowid, folded) VALUES (%s, %s)",
+                [ad.pk, folded],
+            )
+            # Новые слова пополняют словарь, триггер добавляет их в триграммный индекс
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO {self.term_table} (term) VALUES (%s)",
+                [[term] for term in set(folded.split())],
+            )
+
+    def remove_ads(self, ad_ids):
+        # Словарь не чистим: слово без объявлений просто ничего не найдёт
+        ad_ids = list(ad_ids)
+        if not ad_ids:
+            return
+        placeholders = ", ".join(["%s"] * len(ad_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ad_ids)
+            cursor.execute(f"DELETE FROM {self.folded_table} WHERE rowid IN ({placeholders})", ad_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(f"DELETE FROM {self.folded_table}")
+            cursor.execute(f"DELETE FROM {self.term_table}")
+            cursor.execute(f"DELETE FROM {self.term_trigram_table}")
+        super().rebuild()
+
+    def build_match(self, query):
+        if is_phone_query(query):
+            digits = phone_query_prefix(query)
+            return f'phone : "{digits}"*' if digits else None
+        words = WORD_RE.findall(query.lower())
+        if not words:
+            return None
+        # Каждое слово ищем по префиксу: «тойо» найдёт «тойота»
+        return " ".join(f'"{word}"*' for word in words)
+
+    def filter_sql(self, table, city_id, category_id):
+        sql = f"""
+            AND EXISTS (
+                SELECT 1 FROM ads_ad_cities c
+                WHERE c.ad_id = {table}.rowid AND c.city_id = %s
+            )"""
+        params = [city_id]
+        if category_id:
+            sql += f"""
+            AND EXISTS (
+                SELECT 1 FROM ads_ad a
+                WHERE a.id = {table}.rowid AND a.category_id = %s
+            )"""
+            params.append(category_id)
+        return sql, params
+
+    def ranked_search(self, query, city_id, limit, category_id=None):
+        match = self.build_match(query)
+        if not match:
+            return []
+        filter_sql, filter_params = self.filter_sql(self.table, city_id, category_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT rowid FROM {self.table}
+                WHERE {self.table} MATCH %s {filter_sql}
+                ORDER BY bm25({self.table})
+                LIMIT %s
+                """,
+                [match, *filter_params, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def similar_terms(self, word):
+        """Слова словаря, похожие на слово запроса, по убыванию похожести."""
+        word_trigrams = trigrams(word)
+        match = " OR ".join(f'"{trigram}"' for trigram in sorted(word_trigrams))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT term FROM {self.term_trigram_table}
+                WHERE {self.term_trigram_table} MATCH %s
+                ORDER BY bm25({self.term_trigram_table})
+                LIMIT %s
+                """,
+                [match, FUZZY_TERM_CANDIDATES],
+            )
+            candidates = [row[0].strip() for row in cursor.fetchall()]
+        scored = sorted(
+            ((similarity(word, term), term) for term in candidates),
+            reverse=True,
+        )
+        return [term for score, term in scored[:FUZZY_TERMS_PER_WORD] if score >= FUZZY_MIN_SIMILARITY]
+
+    def fuzzy_search(self, query, city_id, limit, category_id=None):
+        words = fold(query).split()
+        # Короткие слова («уй»/«ui») по триграммам не сравнить — не требуем их, если есть длинные
+        long_words = [word for word in words if len(word) >= 3]
+        groups = []
+        for word in long_words or words:
+            # Слово может быть недопечатано — оставляем и префиксный вариант
+            alternatives = [f'"{word}"*']
+            if len(word) >= 3:
+                alternatives += [f'"{term}"' for term in self.similar_terms(word) if term != word]
+            groups.append("(" + " OR ".join(alternatives) + ")")
+        if not groups:
+            return []
+
+        filter_sql, filter_params = self.filter_sql(self.folded_table, city_id, category_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT rowid FROM {self.folded_table}
+                WHERE {self.folded_table} MATCH %s {filter_sql}
+                ORDER BY bm25({self.folded_table})
+                LIMIT %s
+                """,
+                [" AND ".join(groups), *filter_params, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Таблица ads_ad_search: tsvector с GIN-индексом (ранжирование ts_rank_cd)
+    и сложенный текст с GIN-индексом gin_trgm_ops (word_similarity из pg_trgm).
+    """
+
+    table = "ads_ad_search"
+
+    def index_ad(self, ad):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {self.table} (ad_id, document, folded)
+                VALUES (
+                    %s,
+                    setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B'),
+                    %s
+                )
+                ON CONFLICT (ad_id) DO UPDATE SET document = EXCLUDED.document, folded = EXCLUDED.folded
+                """,
+                [ad.pk, ad.description or "", phone_search_terms(ad.contact_phone), fold(ad.description)],
+            )
+
+    def remove_ads(self, ad_ids):
+        ad_ids = list(ad_ids)
+        if not ad_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE ad_id = ANY(%s)", [ad_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        super().rebuild()
+
+    def build_tsquery(self, query):
+        if is_phone_query(query):
+            digits = phone_query_prefix(query)
+            return f"{digits}:*" if digits else None
+        words = WORD_RE.findall(query.lower())
+        if not words:
+            return None
+        return " & ".join(f"{word}:*" for word in words)
+
+    def filter_sql(self, city_id, category_id):
+        sql = """
+            AND EXISTS (
+                SELECT 1 FROM ads_ad_cities c
+                WHERE c.ad_id = s.ad_id AND c.city_id = %s
+            )"""
+        params = [city_id]
+        if category_id:
+            sql += """
+            AND EXISTS (
+                SELECT 1 FROM ads_ad a
+                WHERE a.id = s.ad_id AND a.category_id = %s
+            )"""
+            params.append(category_id)
+        return sql, params
+
+    def ranked_search(self, query, city_id, limit, category_id=None):
+        tsquery = self.build_tsquery(query)
+        if not tsquery:
+            return []
+        filter_sql, filter_params = self.filter_sql(city_id, category_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT s.ad_id FROM {self.table} s
+                WHERE s.document @@ to_tsquery('simple', %s) {filter_sql}
+                ORDER BY ts_rank_cd(s.document, to_tsquery('simple', %s)) DESC
+                LIMIT %s
+                """,
+                [tsquery, *filter_params, tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def fuzzy_search(self, query, city_id, limit, category_id=None):
+        folded = fold(query).strip()
+        if not folded:
+            return []
+        filter_sql, filter_params = self.filter_sql(city_id, category_id)
+        with connection.cursor() as cursor:
+            # Оператор <% использует GIN-индекс и порог из настройки pg_trgm
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)",
+                [str(FUZZY_MIN_SIMILARITY)],
+            )
+            cursor.execute(
+                f"""
+                SELECT s.ad_id FROM {self.table} s
+                WHERE %s <%% s.folded {filter_sql}
+                ORDER BY word_similarity(%s, s.folded) DESC
+                LIMIT %s
+                """,
+                [folded, *filter_params, folded, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SubstringSearchBackend(SearchBackend):
+    """Запасной вариант без индекса: подстрока в SQL, но LIMIT тоже в SQL."""
+
+    def ranked_search(self, query, city_id, limit, category_id=None):
+        ads = Ad.objects.in_city(city_id)\
+                        .filter(Q(description__icontains=query) | Q(contact_phone__icontains=query))\
+                        .order_by('-created_at')
+        if category_id:
+            ads = ads.filter(category_id=category_id)
+        return list(ads.values_list('id', flat=True)[:limit])
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        _backend = _select_backend()
+    return _backend
+
+
+def _select_backend():
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    if connection.vendor == "sqlite":
+        # FTS5-таблицы создаются миграциями только если SQLite собран с FTS5 (trigram — с 3.34)
+        tables = [SQLiteFTSBackend.table, SQLiteFTSBackend.folded_table, SQLiteFTSBackend.term_trigram_table]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name IN (%s, %s, %s)",
+                tables,
+            )
+            if cursor.fetchone()[0] == len(tables):
+                return SQLiteFTSBackend()
+    return SubstringSearchBackend()
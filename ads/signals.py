@@ -0,0 +1,336 @@
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.apps import apps
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+from categories.models import Category
+from . import counters, sync
+from .images import MEDIA_FIELDS, ensure_variants, variant_paths
+from .models import Ad, AdPhoto, City
+from .search import get_search_backend
+from .storage import acquire, delete_unused, is_blob, release
+
+
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_operation():
+    """
+    Отключает обработчики удаления объявлений и фото в текущем потоке.
+    Массовая операция (ads/cleanup.py) обновляет счётчики, журнал, индекс
+    и кэш сама — одним запросом на пачку, а не на каждую строку.
+    """
+    previous = getattr(_bulk, 'active', False)
+    _bulk.active = True
+    try:
+        yield
+    finally:
+        _bulk.active = previous
+
+
+def skip_in_bulk(handler):
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        if getattr(_bulk, 'active', False):
+            return None
+        return handler(*args, **kwargs)
+    return wrapper
+
+
+def feed_pairs_for_ads(ad_ids):
+    """Пары (город, категория), в лентах которых сейчас стоят эти объявления."""
+    return set(
+        Ad.cities.through.objects.filter(ad_id__in=ad_ids)
+                                 .values_list('city_id', 'ad__category_id')
+    )
+
+
+def touch_ads(ad_ids):
+    """
+    Поднимает updated_at объявлений, у которых сменились пути фото:
+    дельта-синхронизация (ads/sync.py) отдаст их клиентам заново.
+    """
+    Ad.objects.filter(pk__in=ad_ids).update(updated_at=timezone.now())
+
+
+def touch_owners(model, pks):
+    """
+    Для записей без своего updated_at (фото объявлений, фото и позиции
+    каталога бизнес-карточек) поднимает updated_at записей, на которые они
+    ссылаются: синхронизация и ETag списков смотрят только на владельца.
+    Нужна там, где файлы и *_variants переписываются через update().
+    """
+    if not pks or any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        return
+    for field in model._meta.concrete_fields:
+        owner = field.related_model if field.many_to_one else None
+        if owner and any(f.name == 'updated_at' for f in owner._meta.concrete_fields):
+            owner_ids = model._default_manager.filter(pk__in=pks).values(field.attname)
+            owner._default_manager.filter(pk__in=owner_ids).update(updated_at=timezone.now())
+
+
+def feeds_changed(pairs):
+    """
+    Ленты пар (city_id, category_id) изменились: поднимаем версию городов.
+    Она входит в ключи кэша страниц (ads/feed_cache.py) и в ETag лент —
+    старые страницы перестают читаться, клиентам больше не отдаётся 304.
+    Версия — время изменения в микросекундах (и не меньше прежней + 1):
+    после пересоздания базы или отката транзакции тот же город с тем же
+    id не получит номер, под которым в кэше уже лежат чужие страницы.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return
+    City.objects.filter(id__in={city_id for city_id, _ in pairs})\
+                .update(ads_version=Greatest(F('ads_version') + 1, Value(time.time_ns() // 1000)))
+
+
+# --- Поисковый индекс ---
+
+@receiver(post_save, sender=Ad)
+def index_ad_for_search(sender, instance, **kwargs):
+    get_search_backend().index_ad(instance)
+
+
+@receiver(post_delete, sender=Ad)
+@skip_in_bulk
+def remove_ad_from_search(sender, instance, **kwargs):
+    get_search_backend().remove_ads([instance.pk])
+
+
+# --- Кэш и версии публичной ленты ---
+
+@receiver(pre_save, sender=Ad)
+def remember_ad_category(sender, instance, **kwargs):
+    # При смене категории объявление уходит из ленты старой категории — её тоже сбрасываем
+    instance._old_category_id = None
+    instance._old_is_paid = None
+    if instance.pk:
+        old = Ad.objects.filter(pk=instance.pk).values_list('category_id', 'is_paid').first()
+        if old:
+            instance._old_category_id, instance._old_is_paid = old
+
+
+@receiver(post_save, sender=Ad)
+def invalidate_feed_on_ad_save(sender, instance, created, **kwargs):
+    if created:
+        # Города новому объявлению ставятся после save() — сброс придёт из m2m_changed
+        return
+    categories = {instance.category_id, getattr(instance, '_old_category_id', None)} - {None}
+    city_ids = list(instance.cities.values_list('id', flat=True))
+    feeds_changed([(city_id, category_id) for city_id in city_ids for category_id in categories])
+
+
+@receiver(pre_delete, sender=Ad)
+@skip_in_bulk
+def remember_ad_feeds(sender, instance, **kwargs):
+    # После удаления связей с городами уже не будет
+    instance._feed_pairs = feed_pairs_for_ads([instance.pk])
+
+
+@receiver(post_delete, sender=Ad)
+@skip_in_bulk
+def invalidate_feed_on_ad_delete(sender, instance, **kwargs):
+    feeds_changed(getattr(instance, '_feed_pairs', ()))
+
+
+@receiver(m2m_changed, sender=Ad.cities.through)
+def invalidate_feed_on_cities_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            instance._feed_pairs = {
+                (instance.pk, category_id)
+                for category_id in instance.ads.values_list('category_id', flat=True).distinct()
+            }
+        else:
+            instance._feed_pairs = feed_pairs_for_ads([instance.pk])
+    elif action == 'post_clear':
+        feeds_changed(getattr(instance, '_feed_pairs', ()))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        if reverse:
+            # instance — город, pk_set — id объявлений
+            categories = Ad.objects.filter(pk__in=pk_set).values_list('category_id', flat=True).distinct()
+            feeds_changed([(instance.pk, category_id) for category_id in categories])
+        else:
+            feeds_changed([(city_id, instance.category_id) for city_id in pk_set])
+
+
+# --- Ссылки на общие файлы blobs/ (ads/storage.py) ---
+
+_media_fields = {}
+
+
+def media_fields_of(sender):
+    return _media_fields.get(sender, ())
+
+
+def remember_media_names(sender, instance, **kwargs):
+    # Имена файлов на момент загрузки из базы: по ним post_save видит замену
+    instance._media_names = {field: getattr(instance, field).name for field in media_fields_of(sender)}
+
+
+def update_media_refs_on_save(sender, instance, created, **kwargs):
+    previous = {} if created else getattr(instance, '_media_names', {})
+    current = {field: getattr(instance, field).name for field in media_fields_of(sender)}
+    replaced = []
+    for field, name in current.items():
+        if name == previous.get(field):
+            continue
+        if name:
+            acquire(name)
+        if previous.get(field):
+            replaced.append((field, previous[field]))
+    for field, name in replaced:
+        delete_unused(instance._meta.get_field(field).storage, release([name]))
+    instance._media_names = current
+
+
+@skip_in_bulk
+def release_media_on_delete(sender, instance, **kwargs):
+    # Срабатывает и при удалении queryset-ом и каскадом: файл уходит вместе
+    # с последней ссылкой, а не остаётся сиротой
+    for field in media_fields_of(sender):
+        name = getattr(instance, field).name
+        unused = release([name])
+        if name and not is_blob(name):
+            # У старых путей производные свои, у blobs/ — общие в MediaBlob
+            unused.extend(variant_paths(getattr(instance, f'{field}_variants')))
+        delete_unused(instance._meta.get_field(field).storage, unused)
+
+
+for label, field in MEDIA_FIELDS:
+    _media_fields.setdefault(apps.get_model(label), []).append(field)
+for model in _media_fields:
+    label = model._meta.label
+    post_init.connect(remember_media_names, sender=model, dispatch_uid=f'media_names_{label}')
+    post_save.connect(update_media_refs_on_save, sender=model, dispatch_uid=f'media_refs_save_{label}')
+    post_delete.connect(release_media_on_delete, sender=model, dispatch_uid=f'media_refs_delete_{label}')
+
+
+@receiver(post_save, sender=AdPhoto)
+def build_photo_variants(sender, instance, **kwargs):
+    # Регистрируется раньше сброса кэша: лента пересоберётся уже с производными.
+    # Исходник в очереди на сжатие — производные построит воркер после подмены файла
+    if instance.status != AdPhoto.STATUS_PENDING:
+        ensure_variants(instance, 'image')
+
+
+@receiver(post_save, sender=AdPhoto)
+@receiver(post_delete, sender=AdPhoto)
+@skip_in_bulk
+def invalidate_feed_on_photo_change(sender, instance, **kwargs):
+    feeds_changed(feed_pairs_for_ads([instance.ad_id]))
+
+
+@receiver(post_save, sender=Category)
+def invalidate_feed_on_category_save(sender, instance, created, **kwargs):
+    # Название категории выводится в каждом объявлении ленты
+    if created:
+        return
+    city_ids = City.objects.values_list('id', flat=True)
+    feeds_changed([(city_id, instance.pk) for city_id in city_ids])
+
+
+# --- Счётчики AdCounter ---
+
+def _through_filter(instance, reverse, pk_set=None):
+    if reverse:
+        # instance — город, pk_set — id объявлений
+        lookup = {'city_id': instance.pk}
+        if pk_set is not None:
+            lookup['ad_id__in'] = pk_set
+    else:
+        lookup = {'ad_id': instance.pk}
+        if pk_set is not None:
+            lookup['city_id__in'] = pk_set
+    return lookup
+
+
+@receiver(post_save, sender=Ad)
+def update_counters_on_ad_save(sender, instance, created, **kwargs):
+    if created:
+        # Новое объявление посчитается при добавлении городов
+        return
+    old_key = (instance._old_category_id, instance._old_is_paid)
+    if old_key == (None, None) or old_key == (instance.category_id, instance.is_paid):
+        return
+    new_keys = counters.counter_keys(ad_id=instance.pk)
+    counters.apply([(city_id, *old_key) for city_id, _, _ in new_keys.elements()], sign=-1)
+    counters.apply(new_keys)
+
+
+@receiver(pre_delete, sender=Ad)
+@skip_in_bulk
+def remember_ad_counters(sender, instance, **kwargs):
+    instance._counter_keys = counters.counter_keys(ad_id=instance.pk)
+
+
+@receiver(post_delete, sender=Ad)
+@skip_in_bulk
+def update_counters_on_ad_delete(sender, instance, **kwargs):
+    counters.apply(getattr(instance, '_counter_keys', ()), sign=-1)
+
+
+@receiver(m2m_changed, sender=Ad.cities.through)
+def update_counters_on_cities_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._removed_counter_keys = counters.counter_keys(**_through_filter(instance, reverse))
+    elif action == 'pre_remove' and pk_set:
+        # В pk_set могут быть и несвязанные id — считаем только реально существующие связи
+        instance._removed_counter_keys = counters.counter_keys(**_through_filter(instance, reverse, pk_set))
+    elif action in ('post_clear', 'post_remove'):
+        counters.apply(getattr(instance, '_removed_counter_keys', ()), sign=-1)
+        instance._removed_counter_keys = ()
+    elif action == 'post_add' and pk_set:
+        # pk_set после add содержит только действительно добавленные связи
+        counters.apply(counters.counter_keys(**_through_filter(instance, reverse, pk_set)))
+
+
+# --- Журнал удалений для ads/sync ---
+
+@receiver(post_delete, sender=Ad)
+@skip_in_bulk
+def record_tombstones_on_ad_delete(sender, instance, **kwargs):
+    city_ids = {city_id for city_id, _ in getattr(instance, '_feed_pairs', ())}
+    sync.record_deletions((instance.pk, city_id) for city_id in city_ids)
+
+
+@receiver(m2m_changed, sender=Ad.cities.through)
+def record_tombstones_on_cities_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' or (action == 'pre_remove' and pk_set):
+        lookup = _through_filter(instance, reverse, pk_set if action == 'pre_remove' else None)
+        instance._removed_links = list(Ad.cities.through.objects.filter(**lookup).values_list('ad_id', 'city_id'))
+    elif action in ('post_clear', 'post_remove'):
+        sync.record_deletions(getattr(instance, '_removed_links', ()))
+        instance._removed_links = ()
+    elif action == 'post_add' and pk_set:
+        # Выборка синхронизации идёт по updated_at: объявление, добавленное
+        # в город (или возвращённое в него), должно прийти клиентам города
+        touch_ads(pk_set if reverse else [instance.pk])
+
+
+# --- Срок жизни объявлений ---
+
+@receiver(pre_save, sender=Category)
+def remember_category_lifetime(sender, instance, **kwargs):
+    instance._old_lifetime_days = None
+    if instance.pk:
+        instance._old_lifetime_days = Category.objects.filter(pk=instance.pk)\
+                                                      .values_list('lifetime_days', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+def recompute_expiry_on_lifetime_change(sender, instance, created, **kwargs):
+    if created or instance._old_lifetime_days == instance.lifetime_days:
+        return
+    Ad.objects.filter(category=instance)\
+              .update(expires_at=F('created_at') + timedelta(days=instance.lifetime_days))
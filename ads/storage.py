@@ -0,0 +1,175 @@
+"""
+Хранилище фото с дедупликацией по содержимому.
+
+DedupStorage кладёт файл по хэшу SHA-256 содержимого:
+blobs/ab/cd/abcd....jpg. Повторная загрузка тех же байтов (модераторы
+перевыкладывают одно фото в разных городах) не пишет новый файл, а
+возвращает уже существующий путь.
+
+На один файл могут ссылаться несколько записей, поэтому число ссылок
+хранится в MediaBlob.refcount. Его поддерживают сигналы (ads/signals.py)
+при сохранении и удалении записей с полями из MEDIA_FIELDS, а массовая
+очистка ads/cleanup.py — через release(). Файл и его производные
+удаляются, когда уходит последняя ссылка.
+
+Пути вне blobs/ (загруженные до дедупликации) обслуживаются по-старому:
+удаляются вместе с записью. dedupe_media переносит их в blobs/.
+
+Поля без дедупликации (иконки категорий, логотипы досок) раскладываются
+ShardedUploadTo по тем же двухуровневым подкаталогам: ad_photos/ab/cd/<имя>.
+Старые плоские пути переносит shard_media.
+"""
+import hashlib
+import os
+import uuid
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from .images import variant_paths
+
+BLOB_ROOT = 'blobs'
+
+
+def blob_path(digest, ext):
+    return f'{BLOB_ROOT}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_ROOT + '/')
+
+
+def blob_digest(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def shard_path(prefix, name, key):
+    """prefix/ab/cd/<имя файла>, где ab и cd — первые символы key."""
+    return f'{prefix}/{key[:2]}/{key[2:4]}/{os.path.basename(name)}'
+
+
+def is_flat(name, prefix):
+    """Лежит ли файл прямо в каталоге prefix (загружен до шардирования)."""
+    return os.path.dirname(name) == prefix
+
+
+@deconstructible
+class ShardedUploadTo:
+    """
+    upload_to, который кладёт файл в prefix/ab/cd/: в одном каталоге
+    остаётся не больше нескольких сотен файлов. Подкаталог случайный —
+    имена фото с телефонов (image.jpg) часто совпадают.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix.strip('/')
+
+    def __call__(self, instance, filename):
+        return shard_path(self.prefix, filename, uuid.uuid4().hex)
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedUploadTo) and self.prefix == other.prefix
+
+
+def hash_content(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupStorage(FileSystemStorage):
+    """FileSystemStorage, который сохраняет файл под хэшем его содержимого."""
+
+    def _save(self, name, content):
+        path = blob_path(hash_content(content), os.path.splitext(name)[1])
+        full_path = self.path(path)
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # Через временный файл: параллельная загрузка тех же байтов
+            # не увидит недописанный файл
+            tmp_path = f'{full_path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        return path
+
+
+def media_storage():
+    return DedupStorage()
+
+
+def acquire(name, count=1):
+    """Добавляет count ссылок на файл name (для путей вне blobs/ ничего не делает)."""
+    from .models import MediaBlob
+
+    if not is_blob(name):
+        return
+    if MediaBlob.objects.filter(path=name).update(refcount=F('refcount') + count):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(path=name, sha256=blob_digest(name), refcount=count)
+    except IntegrityError:
+        MediaBlob.objects.filter(path=name).update(refcount=F('refcount') + count)
+
+
+def release(names):
+    """
+    Снимает по ссылке за каждое имя. Возвращает пути, которые больше никому
+    не нужны: файлы blobs/ без ссылок с их производными и все пути вне blobs/.
+    Вызывается внутри транзакции; файлы удаляет вызывающий — после коммита.
+    """
+    from .models import MediaBlob
+
+    names = [name for name in names if name]
+    unused = [name for name in names if not is_blob(name)]
+    counts = Counter(name for name in names if is_blob(name))
+    for name, count in counts.items():
+        MediaBlob.objects.filter(path=name).update(refcount=F('refcount') - count)
+    orphaned = MediaBlob.objects.filter(path__in=list(counts), refcount__lte=0)
+    for path, variants in orphaned.values_list('path', 'variants'):
+        unused.append(path)
+        unused.extend(variant_paths(variants))
+    orphaned.delete()
+    return unused
+
+
+def delete_unused(storage, paths):
+    """
+    Удаляет файлы после коммита. Файл blobs/ пропускается, если на него
+    успела появиться новая ссылка: та же картинка загружена заново.
+    """
+    from .models import MediaBlob
+
+    def delete():
+        blobs_in_use = set(
+            MediaBlob.objects.filter(path__in=[path for path in paths if is_blob(path)])
+                             .values_list('path', flat=True)
+        )
+        for path in paths:
+            if path in blobs_in_use:
+                continue
+            try:
+                storage.delete(path)
+            except FileNotFoundError:
+                pass
+
+    if paths:
+        transaction.on_commit(delete)
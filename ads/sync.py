@@ -0,0 +1,110 @@
+"""
+Дельта-синхронизация ленты города для мобильных клиентов.
+
+Клиент хранит токен и присылает его в ads/sync/<city_id>?since=<token>.
+В ответ приходят объявления, созданные или изменённые после токена
+(по индексу (updated_at, id)), и id объявлений, ушедших из ленты города —
+из журнала AdTombstone. Журнал чистится через SYNC_TOMBSTONE_RETENTION_DAYS
+дней, поэтому токены старше этого срока отклоняются: клиент должен
+перезагрузить ленту целиком.
+"""
+import base64
+import binascii
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Ad, AdTombstone
+from .pagination import InvalidCursor
+from .projections import AD_FIELDS
+
+SYNC_LIMIT = 200
+
+
+class ExpiredToken(Exception):
+    pass
+
+
+def encode_token(updated_at, ad_id, tombstone_id, issued_at):
+    raw = f"{updated_at.isoformat()}|{ad_id}|{tombstone_id}|{issued_at.isoformat()}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token):
+    padded = token + "=" * (-len(token) % 4)
+    try:
+        updated_raw, ad_id, tombstone_id, issued_raw = base64.urlsafe_b64decode(padded).decode().split("|")
+        return (
+            datetime.fromisoformat(updated_raw),
+            int(ad_id),
+            int(tombstone_id),
+            datetime.fromisoformat(issued_raw),
+        )
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor(token)
+
+
+def retention_start(now=None):
+    return (now or timezone.now()) - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+
+
+def initial_token(city_id):
+    """Токен «с этого момента» — для клиента, который только что загрузил ленту."""
+    now = timezone.now()
+    last_tombstone = AdTombstone.objects.filter(city_id=city_id).aggregate(last=Max('id'))['last'] or 0
+    return encode_token(now, 0, last_tombstone, now)
+
+
+def record_deletions(links):
+    """Пишет в журнал пары (ad_id, city_id), ушедшие из лент."""
+    links = set(links)
+    if links:
+        AdTombstone.objects.bulk_create([
+            AdTombstone(ad_id=ad_id, city_id=city_id) for ad_id, city_id in links
+        ])
+
+
+def prune_tombstones(now=None):
+    deleted, _ = AdTombstone.objects.filter(deleted_at__lt=retention_start(now)).delete()
+    return deleted
+
+
+def changes_since(city_id, token, limit=SYNC_LIMIT):
+    """
+    Изменения ленты города после токена.
+    Возвращает (строки объявлений values(), удалённые id, новый токен, есть ли ещё).
+    """
+    updated_at, ad_id, tombstone_id, issued_at = decode_token(token)
+    if issued_at < retention_start():
+        raise ExpiredToken(token)
+
+    rows = list(
+        Ad.objects.in_city(city_id)
+                  .filter(is_paid=True)
+                  .filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=ad_id))
+                  .order_by('updated_at', 'id')
+                  .values(*AD_FIELDS, 'updated_at')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        updated_at, ad_id = rows[-1]['updated_at'], rows[-1]['id']
+
+    tombstones = list(
+        AdTombstone.objects.filter(city_id=city_id, id__gt=tombstone_id)
+                           .order_by('id')
+                           .values_list('id', 'ad_id')
+    )
+    if tombstones:
+        tombstone_id = tombstones[-1][0]
+    deleted = list(dict.fromkeys(deleted_id for _, deleted_id in tombstones))
+    if deleted:
+        # Объявление могли вернуть в город после снятия — оно уже не удалено
+        present = set(Ad.objects.in_city(city_id).filter(id__in=deleted, is_paid=True)
+                                .values_list('id', flat=True))
+        deleted = [deleted_id for deleted_id in deleted if deleted_id not in present]
+
+    next_token = encode_token(updated_at, ad_id, tombstone_id, timezone.now())
+    return rows, deleted, next_token, has_more
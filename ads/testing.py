@@ -0,0 +1,27 @@
+"""Общие помощники для тестов приложений, работающих с фото."""
+import io
+import multiprocessing
+import os
+
+from PIL import Image
+
+
+def noise_jpeg(size=(1000, 1000)):
+    """JPEG из шума: почти не сжимается, поэтому удобен для проверки целевого размера."""
+    output = io.BytesIO()
+    Image.effect_noise(size, 60).convert('RGB').save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+def square_or_fail(value):
+    """Для тестов пула процессов: квадрат числа, на отрицательном — ValueError."""
+    if value < 0:
+        raise ValueError(value)
+    return value * value
+
+
+def exit_in_worker(value):
+    """Для тестов пула процессов: в процессе пула падает, как при OOM, в основном возвращает value."""
+    if multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return value
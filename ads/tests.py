@@ -1,3 +1,1229 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import re
+import struct
+import tempfile
+import zlib
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from categories.models import Category
+from users.models import User
+from PIL import Image
+
+from . import archive, cleanup, counters, image_jobs, images
+from .images import variant_paths
+from .media_gc import find_orphans
+from .models import Ad, AdPhoto, AdTombstone, City, ImageJob, MediaBlob
+from .pagination import decode_cursor, encode_cursor
+from .placeholders import placeholder_of
+from .testing import exit_in_worker, noise_jpeg, square_or_fail
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class FeedQueryPlanTests(TestCase):
+    """
+    Каждая лента должна читаться по индексу: без полного сканирования таблицы
+    и без временного B-дерева для ORDER BY.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        cls.moderator = User.objects.create_user(phone='+996555000111', name='Мод', is_staff=True)
+        cls.admin = User.objects.create_superuser(phone='+996555000222', name='Шеф')
+        for i in range(5):
+            ad = Ad.objects.create(
+                description=f'Объявление {i}',
+                contact_phone='+996555123456',
+                category=cls.category,
+                author=cls.moderator,
+                is_paid=i % 2 == 0,
+            )
+            ad.cities.set([cls.city])
+
+    def _auth(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+    def assertIndexedFeed(self, url, data=None, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, data or {}, **extra)
+        self.assertEqual(response.status_code, 200, url)
+
+        # Страница ленты (ORDER BY) или строки, найденные поисковым индексом (id IN ...)
+        feed_queries = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "ads_ad"' in q['sql']
+            and ('ORDER BY' in q['sql'] or '"ads_ad"."id" IN (' in q['sql'])
+        ]
+        self.assertTrue(feed_queries, f'{url}: не найден запрос ленты')
+
+        for sql in feed_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                details = [row[3] for row in cursor.fetchall()]
+            for detail in details:
+                self.assertNotIn('TEMP B-TREE', detail, f'{url}: {details}')
+                self.assertFalse(
+                    re.match(r'SCAN \S+$', detail),
+                    f'{url}: полное сканирование {details}',
+                )
+
+    def test_city_category_feed(self):
+        self.assertIndexedFeed(f'/ads/city/{self.city.id}/category/0/')
+        self.assertIndexedFeed(f'/ads/city/{self.city.id}/category/{self.category.id}/')
+        self.assertIndexedFeed(f'/ads/city/{self.city.id}/category/0/', {'cursor': ''})
+
+    def test_public_feed(self):
+        self.assertIndexedFeed(f'/ads/public-city/{self.city.id}/category/0')
+        self.assertIndexedFeed(f'/ads/public-city/{self.city.id}/category/{self.category.id}')
+        self.assertIndexedFeed(f'/ads/public-city/{self.city.id}/category/0', {'cursor': ''})
+
+    def test_my_feeds(self):
+        auth = self._auth(self.moderator)
+        self.assertIndexedFeed(f'/ads/my-city/{self.city.id}/category/0/', **auth)
+        self.assertIndexedFeed(f'/ads/my-city/{self.city.id}/category/{self.category.id}/', {'cursor': ''}, **auth)
+        self.assertIndexedFeed(f'/ads/my-ads/{self.city.id}/0/', **auth)
+        self.assertIndexedFeed(f'/ads/my-ads/{self.city.id}/0/', {'search': 'объявление'}, **auth)
+
+    def test_city_and_search_feeds(self):
+        self.assertIndexedFeed(f'/ads/get/{self.city.id}')
+        self.assertIndexedFeed(f'/ads/search/{self.city.id}/')
+
+    def test_moderation_feeds(self):
+        self.assertIndexedFeed(f'/ads/by_moderator/{self.moderator.id}/')
+        self.assertIndexedFeed(f'/ads/by_moderator/{self.moderator.id}/', {'city_id': self.city.id})
+        self.assertIndexedFeed('/ads/admin/unpaid-ads/', **self._auth(self.admin))
+
+
+def png_bomb(width, height):
+    """Серый PNG из нулей: несколько сотен КБ на диске, width*height байт в памяти."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    compressor = zlib.compressobj(9)
+    rows = b'\0' * (width + 1) * 1000  # байт фильтра + строка
+    data = b''.join(compressor.compress(rows) for _ in range(height // 1000)) + compressor.flush()
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+        + chunk(b'IDAT', data)
+        + chunk(b'IEND', b'')
+    )
+
+
+def peak_rss():
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@skipUnless(resource, 'getrusage есть только в Unix')
+@override_settings(AD_IMAGE_PROCESSING='sync')
+class UploadLimitsTests(TestCase):
+    """
+    Загрузка не должна раздувать память воркера: файлы пишутся во временные
+    файлы, слишком большое изображение отклоняется по заголовку до декодирования.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        cls.moderator = User.objects.create_user(phone='+996555000111', name='Мод', role='moderator')
+        cls.token = Token.objects.create(user=cls.moderator)
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def create_ad(self, *images):
+        return self.client.post('/ads/create/', {
+            'description': 'Сатылат',
+            'contact_phone': '+996555123456',
+            'category': self.category.id,
+            'cities': str(self.city.id),
+            'images': list(images),
+        }, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_pixel_bomb_rejected_before_decoding(self):
+        # 400 Мп: распакованный занял бы 400 МБ, сжатый весит ~400 КБ
+        bomb = SimpleUploadedFile('bomb.png', png_bomb(20000, 20000), content_type='image/png')
+        before = peak_rss()
+        response = self.create_ad(bomb)
+        self.assertEqual(response.status_code, 400)
+        self.assertLess(peak_rss() - before, 64 * 1024 * 1024)
+        self.assertFalse(Ad.objects.exists())
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=64 * 1024)
+    def test_file_size_cap(self):
+        output = io.BytesIO()
+        Image.effect_noise((1000, 1000), 60).save(output, format='JPEG', quality=95)
+        response = self.create_ad(SimpleUploadedFile('big.jpg', output.getvalue(), content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Ad.objects.exists())
+
+    def test_not_an_image_rejected(self):
+        response = self.create_ad(SimpleUploadedFile('photo.jpg', b'<?php echo 1; ?>', content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_photo_accepted(self):
+        output = io.BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(output, format='JPEG')
+        response = self.create_ad(SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(AdPhoto.objects.filter(ad_id=response.json()['ad_id']).count(), 1)
+
+
+class MediaServingTests(TestCase):
+    """Файлы MEDIA_URL: условные запросы, Range и передача прокси."""
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.name = 'blobs/ab/cd/abcd.jpg'
+        path = os.path.join(settings.MEDIA_ROOT, self.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(bytes(range(256)) * 4)
+
+    def test_full_file_is_immutable(self):
+        response = self.client.get('/media/' + self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(256)) * 4)
+        self.assertIn('immutable', response['Cache-Control'])
+        again = self.client.get('/media/' + self.name, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_range(self):
+        response = self.client.get('/media/' + self.name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(self.client.get('/media/' + self.name, HTTP_RANGE='bytes=2000-').status_code, 416)
+
+    @override_settings(MEDIA_SERVING='accel')
+    def test_accel_redirect(self):
+        response = self.client.get('/media/' + self.name)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+
+    def test_outside_upload_dirs_not_served(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/cache/media_shard.json').status_code, 404)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'feeds': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'cursor-tests'},
+})
+class CursorPaginationTests(TestCase):
+    """Курсор ленты проходит все объявления ровно по одному разу, в том числе с одинаковым created_at."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        same_time = timezone.now() - timedelta(hours=1)
+        cls.ads = []
+        for index in range(7):
+            ad = Ad.objects.create(description=f'Сатылат {index}', contact_phone='+996555123456',
+                                   category=cls.category, is_paid=True)
+            ad.cities.set([cls.city])
+            cls.ads.append(ad)
+        # Половина объявлений с одной датой: порядок внутри решает id
+        Ad.objects.filter(pk__in=[ad.pk for ad in cls.ads[:4]]).update(created_at=same_time)
+
+    def get_page(self, cursor):
+        return self.client.get(f'/ads/public-city/{self.city.id}/category/0', {'cursor': cursor, 'limit': 3})
+
+    def test_round_trip(self):
+        expected = list(Ad.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen, cursor = [], ''
+        while True:
+            data = self.get_page(cursor).json()
+            seen.extend(item['id'] for item in data['results'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+            self.assertEqual(decode_cursor(cursor), (
+                Ad.objects.get(pk=seen[-1]).created_at, seen[-1],
+            ))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor(self):
+        for cursor in ('не-base64', encode_cursor(timezone.now(), 1)[:-4], 'MjAyNi0wMS0wMQ'):
+            response = self.get_page(cursor)
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {'detail': 'Неверный курсор'})
+
+    def test_limit_below_one(self):
+        for limit in (0, -1):
+            response = self.client.get(f'/ads/public-city/{self.city.id}/category/0', {'cursor': '', 'limit': limit})
+            self.assertEqual(response.status_code, 200, limit)
+            self.assertEqual(len(response.json()['results']), 1)
+
+            response = self.client.get(f'/ads/public-city/{self.city.id}/category/0', {'limit': limit})
+            self.assertEqual(response.status_code, 200, limit)
+            self.assertEqual(response.json()['total_pages'], 7)
+
+    @override_settings(MAX_FEED_LIMIT=2)
+    def test_limit_clamped(self):
+        response = self.client.get(f'/ads/public-city/{self.city.id}/category/0', {'limit': 500})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(response.json()['total_pages'], 4)
+
+    def test_non_integer_params(self):
+        user = User.objects.create_user(phone='+996555000222', name='Асан')
+        token = Token.objects.create(user=user)
+        paths = [f'/ads/public-city/{self.city.id}/category/0', f'/ads/city/{self.city.id}/category/0/',
+                 f'/ads/my-city/{self.city.id}/category/0/']
+        for path in paths:
+            for params in ({'limit': 'abc'}, {'page': '1.5'}, {'cursor': '', 'limit': 'abc'}):
+                response = self.client.get(path, params, HTTP_AUTHORIZATION=f'Token {token.key}')
+                self.assertEqual(response.status_code, 400, (path, params))
+                self.assertEqual(response.json(), {'detail': 'limit и page должны быть целыми числами'})
+
+
+class SearchTests(TestCase):
+    """Поиск объявлений: точные совпадения по словам, затем транслит и опечатки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def create_ad(self, description, phone='+996555123456'):
+        ad = Ad.objects.create(description=description, contact_phone=phone, category=self.category, is_paid=True)
+        ad.cities.set([self.city])
+        return ad
+
+    def search(self, query):
+        response = self.client.get(f'/ads/search/{self.city.id}/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()]
+
+    def test_transliteration_and_typo(self):
+        ad = self.create_ad('Тойота Камри сатылат, абалы жакшы')
+        self.create_ad('Үй ижарага берилет')
+        self.assertEqual(self.search('toyota'), [ad.id])
+        self.assertEqual(self.search('тайота'), [ad.id])
+        self.assertEqual(self.search('kamry'), [ad.id])
+
+    def test_exact_matches_ranked_before_fuzzy(self):
+        fuzzy = self.create_ad('Тойота сатылат')
+        exact = self.create_ad('Toyota сатылат')
+        self.assertEqual(self.search('toyota'), [exact.id, fuzzy.id])
+
+    def test_bm25_ranking_and_prefix(self):
+        long = self.create_ad('Сатылат: ' + 'абалы жакшы, баасы келишим, ' * 10 + 'камри')
+        short = self.create_ad('Камри сатылат')
+        self.assertEqual(self.search('камри'), [short.id, long.id])
+        # Последнее слово ищется по префиксу — подсказки по мере ввода
+        self.assertEqual(self.search('кам'), [short.id, long.id])
+
+    def test_phone_search(self):
+        ad = self.create_ad('Үй ижарага берилет', phone='0700 11-22-33')
+        self.create_ad('Камри сатылат', phone='+996555123456')
+        for query in ('0700 11', '+996 700 112', '700112233'):
+            self.assertEqual(self.search(query), [ad.id], query)
+
+    def test_other_city_and_deleted_ads_not_found(self):
+        ad = self.create_ad('Камри сатылат')
+        elsewhere = self.create_ad('Камри сатылат')
+        elsewhere.cities.set([City.objects.create(name='Өзгөн')])
+        self.assertEqual(self.search('камри'), [ad.id])
+        ad.delete()
+        self.assertEqual(self.search('камри'), [])
+
+
+class PhoneLookupTests(TestCase):
+    """phone_normalized заполняется при любом save(), а не только во вьюхах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        cls.moderator = User.objects.create_user(phone='+996555000111', name='Мод', role='moderator')
+        cls.token = Token.objects.create(user=cls.moderator)
+
+    def lookup(self, phone):
+        response = self.client.get('/ads/by-phone/', {'phone': phone},
+                                   HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return [item['id'] for item in response.json()['ads']]
+
+    def test_orm_save_and_edit(self):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='0555 12-34-56', category=self.category)
+        self.assertEqual(ad.phone_normalized, '996555123456')
+        self.assertEqual(self.lookup('0555 12'), [ad.id])
+
+        ad.contact_phone = '+996 700 111 222'
+        ad.save(update_fields=['contact_phone'])
+        self.assertEqual(self.lookup('0555 12'), [])
+        self.assertEqual(self.lookup('0700 111'), [ad.id])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'feeds': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'feed-tests'},
+})
+class FeedCacheTests(TestCase):
+    """Кэш страниц публичной ленты сбрасывается версией города из базы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def setUp(self):
+        caches['feeds'].clear()
+
+    def create_ad(self):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                               category=self.category, is_paid=True)
+        ad.cities.set([self.city])
+        return ad
+
+    def feed_ids(self):
+        response = self.client.get(f'/ads/public-city/{self.city.id}/category/0')
+        return [item['id'] for item in response.json()['results']]
+
+    def test_page_served_from_cache_until_city_changes(self):
+        first = self.create_ad()
+        self.assertEqual(self.feed_ids(), [first.id])
+        with self.assertNumQueries(1):
+            # Только версия города: страница из кэша
+            self.assertEqual(self.feed_ids(), [first.id])
+        second = self.create_ad()
+        self.assertEqual(self.feed_ids(), [second.id, first.id])
+
+    def test_delete_bumps_city_version(self):
+        ad = self.create_ad()
+        self.feed_ids()
+        version = City.objects.get(pk=self.city.pk).ads_version
+        ad.delete()
+        self.assertGreater(City.objects.get(pk=self.city.pk).ads_version, version)
+        self.assertEqual(self.feed_ids(), [])
+
+    @override_settings(HIDE_EXPIRED_ADS=True)
+    def test_expiry_changes_etag_and_page(self):
+        soon, later = self.create_ad(), self.create_ad()
+        now = timezone.now()
+        Ad.objects.filter(pk=soon.pk).update(expires_at=now + timedelta(minutes=1))
+        Ad.objects.filter(pk=later.pk).update(expires_at=now + timedelta(days=1))
+        response = self.client.get(f'/ads/public-city/{self.city.id}/category/0')
+        self.assertEqual([item['id'] for item in response.json()['results']], [later.id, soon.id])
+
+        # Объявление истекло без записи в базу: ни 304, ни страницы из кэша
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(minutes=2)):
+            response = self.client.get(f'/ads/public-city/{self.city.id}/category/0',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [later.id])
+
+    @override_settings(HIDE_EXPIRED_ADS=True)
+    def test_total_count_skips_expired(self):
+        expired, live = self.create_ad(), self.create_ad()
+        Ad.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        # Счётчик ещё видит истекшее объявление до ночной очистки
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=True), 2)
+        for path in (f'/ads/public-city/{self.city.id}/category/0', f'/ads/city/{self.city.id}/category/0/'):
+            data = self.client.get(path).json()
+            self.assertEqual([item['id'] for item in data['results']], [live.id], path)
+            self.assertEqual((data['total_count'], data['total_pages']), (1, 1), path)
+
+
+@override_settings(AD_IMAGE_PROCESSING='async')
+class ImageJobTests(TestCase):
+    """Очередь сжатия фото: ленты не видят исходник, повтор с удвоением задержки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                                    category=self.category, is_paid=True)
+        self.ad.cities.set([self.city])
+        self.photo = image_jobs.save_ad_photo(self.ad, SimpleUploadedFile('a.jpg', noise_jpeg()))
+
+    def feed_images(self):
+        response = self.client.get(f'/ads/public-city/{self.city.id}/category/0')
+        return response.json()['results'][0]['images']
+
+    def test_pending_photo_hidden_until_processed(self):
+        self.assertEqual(self.photo.status, AdPhoto.STATUS_PENDING)
+        self.assertEqual(self.feed_images(), [])
+        before = Ad.objects.get(pk=self.ad.pk).updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(image_jobs.run_worker(workers=1, once=True), (1, 0))
+        photo = AdPhoto.objects.get(pk=self.photo.pk)
+        self.assertEqual(photo.status, AdPhoto.STATUS_READY)
+        self.assertNotEqual(photo.image.name, self.photo.image.name)
+        self.assertEqual(len(self.feed_images()), 1)
+        # Дельта-синхронизация должна отдать объявление с новым путём
+        self.assertGreater(Ad.objects.get(pk=self.ad.pk).updated_at, before)
+
+    def test_retry_with_backoff(self):
+        job = ImageJob.objects.get(photo=self.photo)
+        delays = []
+        with mock.patch.object(image_jobs, 'process_photo', side_effect=OSError('битый файл')), \
+                self.assertLogs('ads.image_jobs', 'ERROR'):
+            for _ in range(image_jobs.IMAGE_JOB_MAX_ATTEMPTS):
+                ImageJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                started = timezone.now()
+                self.assertEqual(image_jobs.run_worker(workers=1, once=True), (0, 1))
+                job.refresh_from_db()
+                delays.append(round((job.run_after - started).total_seconds() / image_jobs.IMAGE_JOB_RETRY_DELAY))
+        self.assertEqual(delays[:-1], [1, 2, 4, 8])
+        self.assertEqual(job.status, ImageJob.STATUS_FAILED)
+        self.assertEqual(job.attempts, image_jobs.IMAGE_JOB_MAX_ATTEMPTS)
+        self.assertEqual(AdPhoto.objects.get(pk=self.photo.pk).status, AdPhoto.STATUS_FAILED)
+        self.assertEqual(image_jobs.run_worker(workers=1, once=True), (0, 0))
+
+
+class ShardMediaTests(TestCase):
+    """shard_media переносит плоские пути в prefix/ab/cd/ и не теряет файлов."""
+
+    def setUp(self):
+        self.media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(
+            MEDIA_ROOT=self.media_root,
+            MEDIA_SHARD_CHECKPOINT=os.path.join(self.media_root, 'shard.json'),
+        ))
+        category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        self.ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456', category=category)
+        os.makedirs(os.path.join(self.media_root, 'ad_photos'))
+        for name in ('ad_photos/a.jpg', 'ad_photos/b.jpg'):
+            Image.new('RGB', (64, 48), 'teal').save(os.path.join(self.media_root, name))
+            AdPhoto.objects.bulk_create([AdPhoto(ad=self.ad, image=name)])
+
+    def test_moves_files_and_bumps_ads(self):
+        before = Ad.objects.get(pk=self.ad.pk).updated_at
+        call_command('shard_media', batch_size=1, stdout=io.StringIO())
+        for photo in AdPhoto.objects.all():
+            self.assertRegex(photo.image.name, r'^ad_photos/[0-9a-f]{2}/[0-9a-f]{2}/[ab]\.jpg$')
+            self.assertTrue(os.path.exists(photo.image.path))
+        self.assertNotIn('a.jpg', os.listdir(os.path.join(self.media_root, 'ad_photos')))
+        self.assertGreater(Ad.objects.get(pk=self.ad.pk).updated_at, before)
+        self.assertFalse(os.path.exists(settings.MEDIA_SHARD_CHECKPOINT))
+
+    def test_resumes_after_crash(self):
+        from .management.commands import shard_media
+
+        unlink = shard_media.Command.unlink
+        calls = []
+
+        def crash_after_first_batch(command, state, checkpoint):
+            calls.append(state['unlink'])
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return unlink(command, state, checkpoint)
+
+        with mock.patch.object(shard_media.Command, 'unlink', crash_after_first_batch), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('shard_media', batch_size=1, stdout=io.StringIO())
+        call_command('shard_media', batch_size=1, stdout=io.StringIO())
+        names = sorted(AdPhoto.objects.values_list('image', flat=True))
+        self.assertTrue(all(os.path.exists(os.path.join(self.media_root, name)) for name in names))
+        self.assertFalse(any(os.path.exists(os.path.join(self.media_root, f'ad_photos/{n}.jpg')) for n in 'ab'))
+
+
+class AdCounterTests(TestCase):
+    """Счётчики AdCounter совпадают с таблицей связей после любых изменений."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.other_city = City.objects.create(name='Өзгөн')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def create_ad(self, cities=None, **fields):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                               category=self.category, **fields)
+        ad.cities.set(cities or [self.city])
+        return ad
+
+    def assertCountersExact(self):
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_mark_ads_as_paid_command(self):
+        self.create_ad()
+        self.create_ad(cities=[self.city, self.other_city])
+        call_command('mark_ads_as_paid', stdout=io.StringIO())
+        self.assertCountersExact()
+        response = self.client.get(f'/ads/counts/{self.city.id}/')
+        self.assertEqual(response.json()['total'], 2)
+        self.assertEqual(counters.feed_count(self.other_city.id, is_paid=True), 1)
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=False), 0)
+
+    def test_create_and_delete(self):
+        first = self.create_ad(is_paid=True)
+        second = self.create_ad(cities=[self.city, self.other_city], is_paid=True)
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.city.id, self.category.id, is_paid=True), 2)
+        first.delete()
+        Ad.objects.filter(pk=second.pk).delete()
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=True), 0)
+
+    def test_city_changes(self):
+        ad = self.create_ad(is_paid=True)
+        ad.cities.add(self.other_city)
+        self.assertCountersExact()
+        ad.cities.remove(self.city)
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=True), 0)
+        ad.cities.set([self.city])
+        self.assertCountersExact()
+        self.other_city.ads.clear()
+        self.city.ads.clear()
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=True), 0)
+
+    def test_is_paid_and_category_flips(self):
+        ad = self.create_ad(cities=[self.city, self.other_city])
+        ad.is_paid = True
+        ad.save()
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.other_city.id, is_paid=True), 1)
+        ad.category = Category.objects.create(name_kg='Үй', ru_name='Недвижимость')
+        ad.save(update_fields=['category'])
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.city.id, self.category.id, is_paid=True), 0)
+
+    def test_mark_paid_endpoint(self):
+        ad = self.create_ad()
+        admin = User.objects.create_user(phone='+996555000222', name='Админ', is_staff=True)
+        response = self.client.post('/ads/admin/mark-paid/', {'ad_id': ad.id},
+                                    HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=admin).key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertCountersExact()
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=True), 1)
+
+
+class SyncTests(TestCase):
+    """Дельта-синхронизация: изменённые объявления, журнал удалений и устаревшие токены."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.other_city = City.objects.create(name='Өзгөн')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def create_ad(self):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                               category=self.category, is_paid=True)
+        ad.cities.set([self.city])
+        return ad
+
+    def sync(self, since=None):
+        response = self.client.get(f'/ads/sync/{self.city.id}', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_and_tombstones(self):
+        kept, removed, moved = self.create_ad(), self.create_ad(), self.create_ad()
+        removed_id = removed.id
+        token = self.sync()['token']
+
+        created = self.create_ad()
+        kept.description = 'Сатылат, арзан'
+        kept.save()
+        removed.delete()
+        moved.cities.set([self.other_city])
+        data = self.sync(token)
+        self.assertEqual([item['id'] for item in data['ads']], [created.id, kept.id])
+        self.assertEqual(sorted(data['deleted']), sorted([removed_id, moved.id]))
+        self.assertFalse(data['has_more'])
+
+        # Токен сдвинулся: повторный запрос пустой
+        token = data['token']
+        self.assertEqual(self.sync(token)['ads'], [])
+        self.assertEqual(self.sync(token)['deleted'], [])
+
+        # Вернули в город — объявление приходит снова и не считается удалённым
+        moved.cities.add(self.city)
+        data = self.sync(token)
+        self.assertEqual([item['id'] for item in data['ads']], [moved.id])
+        self.assertEqual(data['deleted'], [])
+
+    def test_bad_and_expired_tokens(self):
+        response = self.client.get(f'/ads/sync/{self.city.id}', {'since': 'не-токен'})
+        self.assertEqual(response.status_code, 400)
+
+        token = self.sync()['token']
+        later = timezone.now() + timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get(f'/ads/sync/{self.city.id}', {'since': token})
+        self.assertEqual(response.status_code, 410)
+
+    def test_prune_tombstones(self):
+        self.create_ad().delete()
+        self.assertEqual(AdTombstone.objects.count(), 1)
+        later = timezone.now() + timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS + 1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            call_command('prune_ad_tombstones', stdout=io.StringIO())
+        self.assertEqual(AdTombstone.objects.count(), 0)
+
+
+class ExpiryTests(TestCase):
+    """expires_at = created_at + срок жизни категории и пересчитывается вместе с ними."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        cls.ride = Category.objects.create(name_kg='Жүргүнчү', ru_name='Попутка', lifetime_days=5)
+
+    def create_ad(self, category=None):
+        return Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                                 category=category or self.category)
+
+    def test_stamped_on_create(self):
+        ad = self.create_ad()
+        ad.refresh_from_db()
+        # created_at проставляет auto_now_add уже после save(): расходятся на микросекунды
+        self.assertAlmostEqual(ad.expires_at, ad.created_at + timedelta(days=30), delta=timedelta(seconds=1))
+        self.assertFalse(ad.is_expired())
+
+    def test_recomputed_with_category_or_created_at(self):
+        ad = self.create_ad()
+        ad.category = self.ride
+        ad.save(update_fields=['category'])
+        ad.refresh_from_db()
+        self.assertEqual(ad.expires_at, ad.created_at + timedelta(days=5))
+
+        ad.created_at -= timedelta(days=10)
+        ad.save(update_fields=['created_at'])
+        ad.refresh_from_db()
+        self.assertEqual(ad.expires_at, ad.created_at + timedelta(days=5))
+
+        # Без category и created_at в update_fields срок не трогается
+        expires_at = ad.expires_at
+        ad.category = self.category
+        ad.save(update_fields=['description'])
+        ad.refresh_from_db()
+        self.assertEqual(ad.expires_at, expires_at)
+
+    def test_mark_paid_restarts_lifetime(self):
+        ad = self.create_ad(self.ride)
+        Ad.objects.filter(pk=ad.pk).update(created_at=timezone.now() - timedelta(days=10),
+                                           expires_at=timezone.now() - timedelta(days=5))
+        admin = User.objects.create_user(phone='+996555000333', name='Админ', is_staff=True)
+        response = self.client.post('/ads/admin/mark-paid/', {'ad_id': ad.id},
+                                    HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=admin).key}')
+        self.assertEqual(response.status_code, 200)
+        ad.refresh_from_db()
+        self.assertEqual(ad.expires_at, ad.created_at + timedelta(days=5))
+        self.assertFalse(ad.is_expired())
+
+    def test_lifetime_change_restamps_category_ads(self):
+        ads = [self.create_ad(), self.create_ad()]
+        other = self.create_ad(self.ride)
+        other_expires_at = Ad.objects.get(pk=other.pk).expires_at
+        self.category.lifetime_days = 7
+        self.category.save()
+        for ad in ads:
+            ad.refresh_from_db()
+            self.assertEqual(ad.expires_at, ad.created_at + timedelta(days=7))
+        other.refresh_from_db()
+        self.assertEqual(other.expires_at, other_expires_at)
+
+    def test_ride_lifetime_migration(self):
+        migration = importlib.import_module('categories.migrations.0007_category_lifetime_days')
+        Category.objects.filter(pk=self.ride.pk).update(lifetime_days=30)
+        migration.set_ride_lifetime(django_apps, None)
+        self.ride.refresh_from_db()
+        self.category.refresh_from_db()
+        self.assertEqual(self.ride.lifetime_days, 5)
+        self.assertEqual(self.category.lifetime_days, 30)
+
+
+class CleanupTests(TestCase):
+    """Пакетная очистка продолжает прерванный запуск с того же порога и дочищает файлы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def setUp(self):
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.checkpoint_path = os.path.join(self.root, 'cleanup.json')
+        self.enterContext(override_settings(MEDIA_ROOT=self.root, EXPIRY_CLEANUP_CHECKPOINT=self.checkpoint_path))
+
+    def create_ad(self, expires_in, photo=None):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                               category=self.category, is_paid=True)
+        ad.cities.set([self.city])
+        if photo:
+            os.makedirs(os.path.join(self.root, 'ad_photos'), exist_ok=True)
+            with open(os.path.join(self.root, 'ad_photos', photo), 'wb') as f:
+                f.write(noise_jpeg((32, 32)))
+            AdPhoto.objects.create(ad=ad, image=f'ad_photos/{photo}')
+        Ad.objects.filter(pk=ad.pk).update(expires_at=timezone.now() + expires_in)
+        return ad
+
+    def photo_exists(self, name):
+        return os.path.exists(os.path.join(self.root, 'ad_photos', name))
+
+    def test_resume_after_crash_between_commit_and_files(self):
+        expired = [self.create_ad(-timedelta(days=1), photo=f'{index}.jpg') for index in range(3)]
+        # Падение после коммита первой пачки, до удаления её файлов
+        with mock.patch.object(cleanup, 'delete_files', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                cleanup.cleanup_expired_ads(batch_size=2)
+        state = cleanup.Checkpoint(self.checkpoint_path).load()
+        self.assertEqual(state['deleted_ads'], 2)
+        # Фото пачки и их производные: строки уже удалены, файлы ещё нет
+        self.assertLessEqual({'ad_photos/0.jpg', 'ad_photos/1.jpg'}, set(state['pending_files']))
+        self.assertTrue(self.photo_exists('0.jpg'))
+        self.assertEqual(Ad.objects.count(), 1)
+
+        # Истекло уже после начала прерванного запуска — порог тот же, не трогаем
+        late = self.create_ad(timedelta(minutes=1))
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(minutes=2)):
+            stats = cleanup.cleanup_expired_ads(batch_size=2)
+        self.assertTrue(stats['finished'])
+        self.assertEqual(stats['total_deleted_ads'], 3)
+        self.assertEqual(list(Ad.objects.values_list('id', flat=True)), [late.id])
+        self.assertFalse(any(self.photo_exists(f'{index}.jpg') for index in range(len(expired))))
+        self.assertEqual([files for _, _, files in os.walk(os.path.join(self.root, 'ad_photos')) if files], [])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+        self.assertEqual(AdTombstone.objects.count(), 3)
+
+    def test_time_budget_and_lock(self):
+        self.create_ad(-timedelta(days=1))
+        stats = cleanup.cleanup_expired_ads(max_seconds=0)
+        self.assertFalse(stats['finished'])
+        self.assertEqual(Ad.objects.count(), 1)
+        self.assertTrue(os.path.exists(self.checkpoint_path))
+
+        running = cleanup.Checkpoint(self.checkpoint_path)
+        running.acquire()
+        try:
+            with self.assertRaises(cleanup.CleanupLocked):
+                cleanup.cleanup_expired_ads()
+        finally:
+            running.release()
+        self.assertTrue(cleanup.cleanup_expired_ads()['finished'])
+        self.assertEqual(Ad.objects.count(), 0)
+
+
+class ExpiredReportTests(TestCase):
+    """count_expired_ads --format json: один документ с теми же цифрами, что и текстовый отчёт."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.cars = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        cls.flats = Category.objects.create(name_kg='Үй', ru_name='Недвижимость')
+
+    def create_ad(self, category, expires_in, photos=0):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456', category=category)
+        ad.cities.set([self.city])
+        AdPhoto.objects.bulk_create(AdPhoto(ad=ad, image=f'ad_photos/{ad.id}-{index}.jpg')
+                                    for index in range(photos))
+        Ad.objects.filter(pk=ad.pk).update(expires_at=timezone.now() + expires_in)
+        return ad
+
+    def report(self, *args):
+        stdout = io.StringIO()
+        call_command('count_expired_ads', '--format', 'json', *args, stdout=stdout)
+        return json.loads(stdout.getvalue())
+
+    def test_json_report(self):
+        expired = self.create_ad(self.cars, -timedelta(days=1), photos=2)
+        self.create_ad(self.cars, -timedelta(hours=1))
+        self.create_ad(self.flats, -timedelta(days=3), photos=1)
+        self.create_ad(self.cars, timedelta(days=1, hours=1))
+        self.create_ad(self.flats, timedelta(days=2, hours=1))
+        self.create_ad(self.flats, timedelta(days=2, hours=2))
+        self.create_ad(self.flats, timedelta(days=10))
+
+        data = self.report('--category', '--expiring', '3', '--detailed')
+        self.assertEqual(data['total_expired_count'], 3)
+        self.assertEqual(data['total_expired_media_count'], 3)
+        self.assertEqual(data['by_category'], [
+            {'category_id': self.cars.id, 'category': 'Унаа', 'expired_count': 2, 'media_count': 2},
+            {'category_id': self.flats.id, 'category': 'Үй', 'expired_count': 1, 'media_count': 1},
+        ])
+        self.assertEqual(data['expiring_histogram'], {'1': 1, '2': 2, '3': 0})
+        self.assertEqual(len(data['expired_ads']), 3)
+        self.assertEqual({ad['id']: ad['media_count'] for ad in data['expired_ads']}[expired.id], 2)
+        self.assertNotIn('cleanup', data)
+
+    def test_empty_report(self):
+        data = self.report('--category', '--detailed')
+        self.assertEqual(data['total_expired_count'], 0)
+        self.assertEqual(data['by_category'], [])
+        self.assertEqual(data['expired_ads'], [])
+
+
+class ArchiveTests(TestCase):
+    """Архив держит файлы фото до восстановления, восстановленное встаёт в начало ленты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def setUp(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(
+            MEDIA_ROOT=root, AD_ARCHIVE_PATH=os.path.join(root, 'archive.sqlite3'),
+            EXPIRY_CLEANUP_CHECKPOINT=os.path.join(root, 'cleanup.json'),
+        ))
+        self.ad = Ad.objects.create(description='Сатылат', contact_phone='0555 12-34-56',
+                                    category=self.category, is_paid=True)
+        self.ad.cities.set([self.city])
+        self.photo = image_jobs.save_ad_photo(self.ad, SimpleUploadedFile('a.jpg', noise_jpeg((200, 200))))
+        self.blob = MediaBlob.objects.get(path=self.photo.image.name)
+        self.created_at = timezone.now() - timedelta(days=40)
+        Ad.objects.filter(pk=self.ad.pk).update(created_at=self.created_at,
+                                                expires_at=timezone.now() - timedelta(days=1))
+
+    def archive_ad(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cleanup.cleanup_expired_ads(archive=True)
+        self.assertFalse(Ad.objects.filter(pk=self.ad.pk).exists())
+
+    def blob_on_disk(self):
+        return os.path.exists(os.path.join(settings.MEDIA_ROOT, self.blob.path))
+
+    def test_archive_keeps_blob_until_restore(self):
+        self.archive_ad()
+        self.assertEqual(MediaBlob.objects.get(pk=self.blob.pk).refcount, 1)
+        self.assertTrue(self.blob_on_disk())
+        self.assertNotIn(self.blob.path, [path for path, _ in find_orphans(min_age=0)])
+
+        call_command('restore_archived_ads', self.ad.pk, stdout=io.StringIO())
+        ad = Ad.objects.get(pk=self.ad.pk)
+        self.assertGreater(ad.created_at, self.created_at)
+        self.assertFalse(ad.is_expired())
+        self.assertEqual(list(ad.photos.values_list('image', flat=True)), [self.blob.path])
+        # Ссылка архива перешла к восстановленному фото
+        self.assertEqual(MediaBlob.objects.get(pk=self.blob.pk).refcount, 1)
+        self.assertEqual(archive.pending_restore([self.ad.pk]), [])
+
+    def test_purge_releases_blob(self):
+        self.archive_ad()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive.purge_media(timezone.now() + timedelta(seconds=1)), 1)
+        self.assertFalse(MediaBlob.objects.filter(pk=self.blob.pk).exists())
+        self.assertFalse(self.blob_on_disk())
+        # Запись остаётся для поиска по номеру, повторный проход её не трогает
+        self.assertEqual(len(archive.lookup_by_phone('996555')), 1)
+        self.assertEqual(archive.purge_media(timezone.now() + timedelta(seconds=1)), 0)
+
+    def test_lookup_by_phone(self):
+        self.archive_ad()
+        user = User.objects.create_user(phone='+996555000111', name='Мод', role='moderator')
+        headers = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=user).key}'}
+
+        def lookup(**params):
+            response = self.client.get('/ads/archive/by-phone/', {'phone': '0555 12', **params}, **headers)
+            self.assertEqual(response.status_code, 200)
+            return [entry['id'] for entry in response.json()['ads']]
+
+        day = self.created_at.date()
+        self.assertEqual(lookup(), [self.ad.pk])
+        self.assertEqual(lookup(**{'from': day.isoformat(), 'to': (day + timedelta(days=1)).isoformat()}), [self.ad.pk])
+        self.assertEqual(lookup(**{'to': day.isoformat()}), [])
+        response = self.client.get('/ads/archive/by-phone/', {'phone': '0555 12', 'from': '01.01.2026'}, **headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_restore_restores_counters_and_feed(self):
+        self.archive_ad()
+        self.assertEqual(counters.feed_count(self.city.id, is_paid=True), 0)
+        call_command('restore_archived_ads', '--phone', '0555', stdout=io.StringIO())
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+        response = self.client.get(f'/ads/public-city/{self.city.id}/category/0')
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.ad.pk])
+
+    def test_date_bounds_in_project_timezone(self):
+        midnight = timezone.make_aware(datetime(2026, 1, 2), timezone.get_fixed_timezone(6 * 60))
+        self.assertEqual(archive.format_date(midnight), '2026-01-01 18:00:00.000000')
+        self.assertEqual(archive.format_date(datetime(2026, 1, 2)), '2026-01-02 00:00:00.000000')
+
+
+def exif_jpeg(size, orientation):
+    output = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    Image.effect_noise(size, 60).convert('RGB').save(output, format='JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+
+@override_settings(AD_IMAGE_MAX_EDGE=800)
+class ImageCompressionTests(TestCase):
+    """Сжатие фото: укладывается в целевой размер, если можно, и не больше AD_IMAGE_MAX_EDGE."""
+
+    def test_pick_quality_fits_target(self):
+        img = Image.open(io.BytesIO(noise_jpeg((400, 400))))
+        target = len(images.encode(img, 60).getvalue())
+        quality = images.pick_quality(img, target, quality=85, min_quality=40)
+        self.assertGreaterEqual(quality, 60 - images.QUALITY_TOLERANCE)
+        self.assertLessEqual(images.encode(img, quality).tell(), target)
+
+    def test_pick_quality_falls_back_to_min_quality(self):
+        img = Image.open(io.BytesIO(noise_jpeg((400, 400))))
+        self.assertEqual(images.pick_quality(img, 100, quality=85, min_quality=40), 40)
+        self.assertEqual(images.pick_quality(img, 10 ** 7, quality=85, min_quality=40), 85)
+
+    def test_compress_limits_size_and_edge(self):
+        png = io.BytesIO()
+        Image.linear_gradient('L').resize((2400, 1200)).convert('RGB').save(png, format='PNG')
+        result = images.compress_image(SimpleUploadedFile('photo.png', png.getvalue()))
+        self.assertEqual(result.name, 'photo.jpg')
+        self.assertLessEqual(result.size, images.TARGET_IMAGE_SIZE)
+        with Image.open(result) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (800, 400)))
+
+        result = images.compress_image(SimpleUploadedFile('noise.jpg', noise_jpeg((1200, 1000))), target_size=150 * 1024)
+        self.assertLessEqual(result.size, 150 * 1024)
+        with Image.open(result) as img:
+            self.assertEqual(max(img.size), 800)
+
+    def test_exif_orientation_applied(self):
+        # Orientation 6 — снято с поворотом на 90°: ширина и высота меняются местами
+        result = images.compress_image(SimpleUploadedFile('rotated.jpg', exif_jpeg((1200, 600), 6)))
+        with Image.open(result) as img:
+            self.assertEqual(img.size, (400, 800))
+            self.assertNotIn(0x0112, img.getexif())
+
+
+class ImageVariantTests(TestCase):
+    """Производные WebP/JPEG: размеры, форматы, поворот по EXIF и пересборка только при смене файла."""
+
+    def setUp(self):
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.root))
+
+    def write(self, name, data):
+        os.makedirs(os.path.dirname(os.path.join(self.root, name)), exist_ok=True)
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+        return name
+
+    def variant_sizes(self, variants):
+        sizes = {}
+        for width, paths in variants['sizes'].items():
+            for ext, path in paths.items():
+                with Image.open(os.path.join(self.root, path)) as img:
+                    sizes[width, ext] = (img.format, img.size)
+        return sizes
+
+    def test_sizes_and_formats(self):
+        variants = images.build_variants(self.root, self.write('ad_photos/a.jpg', noise_jpeg((1600, 1200))))
+        self.assertEqual(variants['src'], 'ad_photos/a.jpg')
+        self.assertEqual(self.variant_sizes(variants), {
+            ('160', 'webp'): ('WEBP', (160, 120)), ('160', 'jpeg'): ('JPEG', (160, 120)),
+            ('480', 'webp'): ('WEBP', (480, 360)), ('480', 'jpeg'): ('JPEG', (480, 360)),
+            ('1080', 'webp'): ('WEBP', (1080, 810)), ('1080', 'jpeg'): ('JPEG', (1080, 810)),
+        })
+
+    def test_larger_widths_skipped(self):
+        variants = images.build_variants(self.root, self.write('ad_photos/a.jpg', noise_jpeg((600, 400))))
+        self.assertEqual(list(variants['sizes']), ['160', '480'])
+        # Самая маленькая строится всегда, но без увеличения
+        variants = images.build_variants(self.root, self.write('ad_photos/b.jpg', noise_jpeg((100, 80))))
+        self.assertEqual(self.variant_sizes(variants), {
+            ('160', 'webp'): ('WEBP', (100, 80)), ('160', 'jpeg'): ('JPEG', (100, 80)),
+        })
+
+    def test_exif_rotation_swaps_width(self):
+        variants = images.build_variants(self.root, self.write('ad_photos/a.jpg', exif_jpeg((1200, 600), 6)))
+        self.assertEqual(list(variants['sizes']), ['160', '480'])
+        self.assertEqual(self.variant_sizes(variants)['480', 'jpeg'], ('JPEG', (480, 960)))
+
+    def test_rebuilt_only_when_source_changes(self):
+        category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456', category=category)
+        photo = AdPhoto.objects.create(ad=ad, image=self.write('ad_photos/a.jpg', noise_jpeg((600, 400))))
+        old_paths = list(images.variant_paths(photo.image_variants))
+        self.assertEqual(photo.image_variants['src'], 'ad_photos/a.jpg')
+        self.assertEqual(AdPhoto.objects.get(pk=photo.pk).image_variants, photo.image_variants)
+
+        with mock.patch.object(images, 'build_variants', wraps=images.build_variants) as build:
+            photo.save()
+            build.assert_not_called()
+            photo.image = self.write('ad_photos/b.jpg', noise_jpeg((300, 200)))
+            photo.save()
+            build.assert_called_once()
+        self.assertEqual(photo.image_variants['src'], 'ad_photos/b.jpg')
+        self.assertEqual(list(photo.image_variants['sizes']), ['160'])
+        self.assertFalse(any(os.path.exists(os.path.join(self.root, path)) for path in old_paths))
+
+
+class MediaBlobTests(TestCase):
+    """Одинаковые фото хранятся одним файлом blobs/, файл уходит с последней ссылкой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def setUp(self):
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.root))
+
+    def create_ad(self):
+        ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                               category=self.category, is_paid=True)
+        ad.cities.set([self.city])
+        return ad
+
+    def on_disk(self, name):
+        return os.path.exists(os.path.join(self.root, name))
+
+    def test_refcount_follows_references(self):
+        content = noise_jpeg((300, 300))
+        first, second = self.create_ad(), self.create_ad()
+        photos = [image_jobs.save_ad_photo(ad, SimpleUploadedFile('a.jpg', content)) for ad in (first, second)]
+        name = photos[0].image.name
+        self.assertEqual(photos[1].image.name, name)
+        self.assertTrue(name.startswith('blobs/'))
+        blob = MediaBlob.objects.get(path=name)
+        self.assertEqual(blob.refcount, 2)
+        self.assertTrue(blob.variants)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(MediaBlob.objects.get(path=name).refcount, 1)
+        self.assertTrue(self.on_disk(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(MediaBlob.objects.filter(path=name).exists())
+        self.assertFalse(self.on_disk(name))
+        self.assertFalse(any(self.on_disk(path) for path in variant_paths(blob.variants)))
+
+    def test_dedupe_media_folds_legacy_copies(self):
+        os.makedirs(os.path.join(self.root, 'ad_photos'))
+        content = noise_jpeg((300, 300))
+        ads = [self.create_ad() for _ in range(3)]
+        for index, ad in enumerate(ads):
+            with open(os.path.join(self.root, 'ad_photos', f'{index}.jpg'), 'wb') as f:
+                f.write(content)
+            AdPhoto.objects.create(ad=ad, image=f'ad_photos/{index}.jpg')
+        Ad.objects.update(updated_at=timezone.now() - timedelta(days=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=io.StringIO())
+        names = set(AdPhoto.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(name.startswith('blobs/') and self.on_disk(name))
+        self.assertEqual(MediaBlob.objects.get(path=name).refcount, 3)
+        self.assertFalse(any(self.on_disk(f'ad_photos/{index}.jpg') for index in range(3)))
+        # Новые пути должны дойти до клиентов синхронизации
+        self.assertFalse(Ad.objects.filter(updated_at__lt=timezone.now() - timedelta(hours=1)).exists())
+
+
+def solid_jpeg(size, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+class PlaceholderTests(TestCase):
+    """BlurHash, цвет и размеры фото считаются при загрузке и отдаются в ленте."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = Category.objects.create(name_kg='Унаа', ru_name='Авто')
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.ad = Ad.objects.create(description='Сатылат', contact_phone='+996555123456',
+                                    category=self.category, is_paid=True)
+        self.ad.cities.set([self.city])
+
+    def upload(self, content):
+        photo = image_jobs.save_ad_photo(self.ad, SimpleUploadedFile('a.jpg', content))
+        return AdPhoto.objects.get(pk=photo.pk)
+
+    def test_placeholder_in_variants_and_feed(self):
+        landscape = self.upload(solid_jpeg((640, 480), (200, 30, 30)))
+        portrait = self.upload(solid_jpeg((300, 400), (30, 30, 200)))
+        for photo, size, flag in ((landscape, (640, 480), 'L'), (portrait, (300, 400), 'T')):
+            placeholder = placeholder_of(photo.image_variants)
+            self.assertEqual((placeholder['width'], placeholder['height']), size)
+            # Первый символ — число компонент: 4x3 вдоль длинной стороны
+            self.assertEqual(placeholder['blurhash'][0], flag)
+            self.assertEqual(len(placeholder['blurhash']), 4 + 2 * 12)
+        self.assertEqual(placeholder_of(landscape.image_variants)['color'][:3], '#c8')
+
+        response = self.client.get(f'/ads/public-city/{self.city.id}/category/0')
+        item = response.json()['results'][0]
+        self.assertEqual(item['images_placeholders'],
+                         [placeholder_of(landscape.image_variants), placeholder_of(portrait.image_variants)])
+
+    def test_backfill_fills_missing_placeholders(self):
+        photo = self.upload(noise_jpeg((400, 300)))
+        expected = placeholder_of(photo.image_variants)
+        stripped = {key: value for key, value in photo.image_variants.items()
+                    if key not in ('width', 'height', 'blurhash', 'color')}
+        AdPhoto.objects.filter(pk=photo.pk).update(image_variants=stripped)
+        MediaBlob.objects.filter(path=photo.image.name).update(variants=stripped)
+        self.assertIsNone(placeholder_of(AdPhoto.objects.get(pk=photo.pk).image_variants))
+
+        call_command('backfill_photo_placeholders', stdout=io.StringIO())
+        filled = placeholder_of(AdPhoto.objects.get(pk=photo.pk).image_variants)
+        self.assertEqual((filled['width'], filled['height']), (expected['width'], expected['height']))
+        self.assertEqual(filled['blurhash'][0], expected['blurhash'][0])
+        self.assertEqual(MediaBlob.objects.get(path=photo.image.name).variants['blurhash'], filled['blurhash'])
+
+
+@override_settings(AD_IMAGE_POOL_WORKERS=2)
+class ProcessPoolTests(TestCase):
+    """pool_results: порядок вызовов, исключения по месту и замена сломанного пула."""
+
+    def setUp(self):
+        self.addCleanup(self.shutdown_pool)
+
+    def shutdown_pool(self):
+        if images._pool is not None:
+            images._pool.shutdown(wait=True, cancel_futures=True)
+            images._pool = None
+
+    def test_order_and_exceptions(self):
+        results = images.pool_results(square_or_fail, [(3,), (-1,), (2,), (5,)])
+        self.assertEqual([results[0], results[2], results[3]], [9, 4, 25])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[1].args, (-1,))
+
+    def test_broken_pool_replaced_and_calls_done_inline(self):
+        pool = images.process_pool()
+        self.assertEqual(images.pool_results(exit_in_worker, [(1,), (2,), (3,)]), [1, 2, 3])
+        self.assertIsNot(images.process_pool(), pool)
+        self.assertEqual(images.pool_results(square_or_fail, [(2,), (4,)]), [4, 16])
+
+    @override_settings(AD_IMAGE_POOL_WORKERS=1)
+    def test_single_worker_runs_inline(self):
+        results = images.pool_results(square_or_fail, [(2,), (-2,)])
+        self.assertEqual(results[0], 4)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsNone(images._pool)
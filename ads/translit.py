@@ -0,0 +1,58 @@
+import re
+
+# Кириллица (русский + кыргызский) -> латиница в том виде, как её набирают в телефонах
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    "ң": "ng", "ө": "o", "ү": "u",
+}
+
+# Латинские варианты одних и тех же звуков сводим к одному написанию
+LATIN_VARIANTS = [
+    ("zh", "j"),
+    ("kh", "h"),
+    ("x", "h"),
+    ("w", "v"),
+    ("q", "k"),
+    ("ö", "o"),
+    ("ü", "u"),
+    ("ñ", "ng"),
+]
+
+NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+REPEAT_RE = re.compile(r"(.)\1+")
+
+
+def fold(text):
+    """
+    Приводит текст к одной «сложенной» форме независимо от алфавита:
+    нижний регистр, транслитерация в латиницу, ң/ө/ү -> ng/o/u,
+    схлопывание удвоенных букв («тоо» и «to» совпадут).
+    Слова разделяются одним пробелом.
+    """
+    if not text:
+        return ""
+    text = text.casefold()
+    text = "".join(CYRILLIC_TO_LATIN.get(ch, ch) for ch in text)
+    for variant, canonical in LATIN_VARIANTS:
+        text = text.replace(variant, canonical)
+    text = NON_WORD_RE.sub(" ", text)
+    text = REPEAT_RE.sub(r"\1", text)
+    return " ".join(text.split())
+
+
+def trigrams(word):
+    """Множество символьных триграмм слова с пробелами на границах: « to», «toy», …, «ta »."""
+    padded = f" {word.strip()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Похожесть двух слов по триграммам (как similarity из pg_trgm): |A ∩ B| / |A ∪ B|."""
+    ta, tb = trigrams(a), trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
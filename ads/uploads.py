@@ -0,0 +1,105 @@
+"""
+Приём загружаемых фото без лишней памяти.
+
+ImageUploadHandler заменяет стандартные обработчики Django: каждый файл
+пишется во временный файл (в памяти не собирается даже маленький), размер
+файла и всего запроса ограничен, а формат и размеры в пикселях проверяются
+по заголовку, как только он пришёл, — до какого-либо декодирования.
+Отклонённая загрузка обрывает разбор запроса: DRF отвечает 400
+"Multipart form parse error - ...", остальные вьюхи — 400 Bad Request.
+
+Что прошло проверку, декодируется в ads/images.open_downscaled: baseline
+JPEG уменьшается уже при декодировании (draft) и может быть большим
+(IMAGE_MAX_PIXELS), остальные форматы распаковываются целиком, поэтому
+для них порог ниже (IMAGE_MAX_DECODE_PIXELS).
+"""
+import io
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Сколько байт начала файла держать для разбора заголовка. У JPEG перед
+# размерами могут стоять EXIF с превью и ICC-профиль.
+HEADER_LIMIT = 256 * 1024
+
+
+class UploadRejected(SuspiciousOperation, MultiPartParserError):
+    pass
+
+
+def decoded_fully(img):
+    """Распакуется ли изображение целиком (без уменьшения при декодировании)."""
+    # Прогрессивный JPEG libjpeg держит в памяти целиком даже с draft
+    return img.format not in ('JPEG', 'MPO') or 'progressive' in img.info or 'progression' in img.info
+
+
+def pixel_limit(img):
+    return settings.IMAGE_MAX_DECODE_PIXELS if decoded_fully(img) else settings.IMAGE_MAX_PIXELS
+
+
+def inspect_image(fp):
+    """
+    Формат и размеры по заголовку: (format, width, height). Пиксели не
+    декодируются. Бросает UploadRejected, если формат не разрешён или
+    изображение слишком большое; OSError — если заголовок не разобрать.
+    """
+    try:
+        img = Image.open(fp)
+    except Image.DecompressionBombError as error:
+        raise UploadRejected(str(error))
+    with img:
+        if img.format not in settings.UPLOAD_IMAGE_FORMATS:
+            raise UploadRejected(f'Формат {img.format} не поддерживается')
+        width, height = img.size
+        if width * height > pixel_limit(img):
+            raise UploadRejected(f'Слишком большое изображение: {width}x{height}')
+        return img.format, width, height
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет файлы во временные файлы, проверяя размер и заголовок на лету."""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > settings.UPLOAD_MAX_REQUEST_SIZE:
+            raise UploadRejected(f'Запрос больше {filesizeformat(settings.UPLOAD_MAX_REQUEST_SIZE)}')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.head = b''
+        self.checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.UPLOAD_MAX_FILE_SIZE:
+            self.reject(f'Файл {self.file_name} больше {filesizeformat(settings.UPLOAD_MAX_FILE_SIZE)}')
+        if not self.checked:
+            self.head += raw_data[:HEADER_LIMIT - len(self.head)]
+            try:
+                inspect_image(io.BytesIO(self.head))
+                self.checked = True
+            except UploadRejected as error:
+                self.reject(f'{self.file_name}: {error}')
+            except (OSError, SyntaxError, ValueError):
+                # Заголовок пришёл не целиком — ждём следующих кусков
+                if len(self.head) >= HEADER_LIMIT:
+                    self.reject(f'{self.file_name}: не изображение')
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            # Файл меньше HEADER_LIMIT и целиком лежит в head
+            try:
+                inspect_image(io.BytesIO(self.head))
+            except UploadRejected as error:
+                self.reject(f'{self.file_name}: {error}')
+            except (OSError, SyntaxError, ValueError):
+                self.reject(f'{self.file_name}: не изображение')
+        return super().file_complete(file_size)
+
+    def reject(self, message):
+        # Временный файл удаляется при закрытии
+        self.file.close()
+        raise UploadRejected(message)
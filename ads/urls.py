@@ -16,6 +16,11 @@ from .views import (
     UpdateCityInfoView,
     UnpaidAdsView,
     MarkAdAsPaidView,
+    AdsByPhoneView,
+    FeedCacheStatsView,
+    AdCountsByCityView,
+    AdSyncView,
+    ArchivedAdsByPhoneView,
 )
 
 urlpatterns = [
@@ -29,8 +34,13 @@ urlpatterns = [
     path('my-ads/<int:city_id>/<int:category_id>/', AdsByCityAndCategoryViewMineSearch.as_view(), name='my-ads-by-city-category'),
     path('edit/<int:ad_id>/', EditAdView.as_view()),
     path('delete/<int:ad_id>/', DeleteAdView.as_view(), name='delete_ad'),
+    path('by-phone/', AdsByPhoneView.as_view(), name='ads-by-phone'),
+    path('archive/by-phone/', ArchivedAdsByPhoneView.as_view(), name='archived-ads-by-phone'),
 
     path('public-city/<int:city_id>/category/<int:category_id>', PublicAdsByCityAndCategoryView.as_view()),
+    path('counts/<int:city_id>/', AdCountsByCityView.as_view(), name='ad-counts-by-city'),
+    path('sync/<int:city_id>', AdSyncView.as_view(), name='ad-sync-noslash'),
+    path('sync/<int:city_id>/', AdSyncView.as_view(), name='ad-sync'),
     # support both with and without trailing slash for backward compatibility with mobile client
     path('search/<int:city_id>', AdSearchView.as_view(), name='ad-search-noslash'),
     path('search/<int:city_id>/', AdSearchView.as_view(), name='ad-search'),
@@ -44,4 +54,5 @@ urlpatterns = [
     # Admin endpoints
     path('admin/unpaid-ads/', UnpaidAdsView.as_view(), name='admin-unpaid-ads'),
     path('admin/mark-paid/', MarkAdAsPaidView.as_view(), name='admin-mark-ad-paid'),
+    path('admin/feed-cache-stats/', FeedCacheStatsView.as_view(), name='admin-feed-cache-stats'),
 ]
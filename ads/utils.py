@@ -1,116 +1,158 @@
 from django.utils import timezone
 from datetime import timedelta
+import re
+from typing import Optional
+from django.db.models import Count, Max, Q
 from .models import Ad
 
 
-def count_expired_ads():
+def normalize_phone(raw: str) -> Optional[str]:
+    if not raw:
+        return None
+    digits = re.sub(r"\D+", "", raw)
+    if digits.startswith("996"):
+        if len(digits) == 12:
+            return digits
+        if len(digits) > 12 and digits[:12].isdigit():
+            return digits[:12]
+    if digits.startswith("0"):
+        rest = digits[1:]
+        if len(rest) == 9:
+            return "996" + rest
+    if len(digits) == 9:
+        return "996" + digits
+    if len(digits) == 10 and digits.startswith("0"):
+        return "996" + digits[1:]
+    if len(digits) == 12 and digits.startswith("996"):
+        return digits
+    return None
+
+
+def normalize_phone_prefix(raw: str) -> str:
     """
-    Подсчитывает количество объявлений, которые являются кандидатами на удаление
-    (истекшие объявления в зависимости от категории)
-    """
-    expired_count = 0
-    expired_media_count = 0
-    expired_ads = []
-    
-    all_ads = Ad.objects.all()
-    
-    for ad in all_ads:
-        if ad.is_expired():
-            media_count = ad.photos.count()
-            expired_count += 1
-            expired_media_count += media_count
-            expired_ads.append({
-                'id': ad.id,
-                'contact_phone': ad.contact_phone,
-                'category': ad.category.name_kg,
-                'created_at': ad.created_at,
-                'is_expired': True,
-                'media_count': media_count,
-            })
-    
-    return {
-        'total_expired_count': expired_count,
-        'total_expired_media_count': expired_media_count,
-        'expired_ads': expired_ads
-    }
+    Приводит начало номера, набранное модератором («0555 12», «+996 555», «555»),
+    к префиксу формы 996XXXXXXXXX.
+    """
+    digits = re.sub(r"\D+", "", raw or "")
+    if not digits or digits.startswith("996"):
+        return digits[:12]
+    if digits.startswith("0"):
+        digits = digits[1:]
+    return ("996" + digits)[:12]
 
 
-def cleanup_expired_ads():
+def prefix_range(prefix: str):
     """
-    Удаляет истекшие объявления и связанные медиафайлы.
-    Возвращает словарь со статистикой.
+    Границы [prefix, upper) для поиска по префиксу сравнением строк:
+    в отличие от LIKE такой диапазон всегда идёт по обычному B-tree индексу.
     """
-    deleted_ads = 0
-    deleted_media = 0
-    details = []
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return prefix, upper
 
-    for ad in Ad.objects.all():
-        if not ad.is_expired():
-            continue
 
-        media_count = ad.photos.count()
+def expired_ads_queryset(now=None):
+    """Истекшие объявления — диапазон по индексу expires_at."""
+    return Ad.objects.filter(expires_at__lt=now or timezone.now())
 
-        # Удаляем фото через delete(), чтобы стерлись файлы с диска
-        for photo in ad.photos.all():
-            photo.delete()
 
-        ad_id = ad.id
-        ad.delete()
+def count_expired_ads(now=None):
+    """
+    Подсчитывает количество объявлений, которые являются кандидатами на удаление
+    (истекшие объявления в зависимости от категории), и их медиафайлы — одним запросом
+    """
+    return expired_ads_queryset(now).aggregate(
+        total_expired_count=Count('id', distinct=True),
+        total_expired_media_count=Count('photos'),
+    )
 
-        deleted_ads += 1
-        deleted_media += media_count
-        details.append({
-            'id': ad_id,
-            'deleted_media': media_count,
-        })
 
-    return {
-        'deleted_ads': deleted_ads,
-        'deleted_media': deleted_media,
-        'details': details,
-    }
+def iter_expired_ads(now=None, chunk_size=2000):
+    """Истекшие объявления по одному словарю, без загрузки всей выборки в память."""
+    rows = expired_ads_queryset(now).values('id', 'contact_phone', 'category__name_kg', 'created_at', 'expires_at')\
+                                    .annotate(media_count=Count('photos'))\
+                                    .order_by('expires_at', 'id')
+    for row in rows.iterator(chunk_size=chunk_size):
+        row['category'] = row.pop('category__name_kg')
+        yield row
+
+
+def cleanup_expired_ads(**options):
+    """
+    Удаляет истекшие объявления и связанные медиафайлы.
+    Пакетный конвейер с чекпоинтом — см. ads/cleanup.py.
+    Возвращает словарь со статистикой.
+    """
+    from .cleanup import cleanup_expired_ads as run_cleanup
+    return run_cleanup(**options)
+
+
+def get_expired_stats_by_category(now=None):
+    """Истекшие объявления и их медиафайлы по категориям — один GROUP BY."""
+    rows = expired_ads_queryset(now).values('category_id', 'category__name_kg')\
+                                    .annotate(expired_count=Count('id', distinct=True),
+                                              media_count=Count('photos'))\
+                                    .order_by('category_id')
+    return [{
+        'category_id': row['category_id'],
+        'category': row['category__name_kg'],
+        'expired_count': row['expired_count'],
+        'media_count': row['media_count'],
+    } for row in rows]
 
 
 def get_expired_ads_by_category():
     """
     Возвращает сгруппированную по категориям статистику истекших объявлений
     """
-    from categories.models import Category
-    
     expired_by_category = {}
-    
-    for category in Category.objects.all():
-        category_ads = Ad.objects.filter(category=category)
-        expired_count = sum(1 for ad in category_ads if ad.is_expired())
-        
-        if expired_count > 0:
-            expired_by_category[category.name_kg] = expired_count
-    
+    for row in get_expired_stats_by_category():
+        name = row['category']
+        expired_by_category[name] = expired_by_category.get(name, 0) + row['expired_count']
     return expired_by_category
 
 
+def get_expiring_histogram(days, now=None):
+    """
+    Сколько объявлений истечёт через 1, 2, …, days полных дней: условные
+    агрегаты по диапазонам expires_at в одном запросе.
+    """
+    now = now or timezone.now()
+    buckets = {
+        str(day): Count('id', filter=Q(expires_at__gte=now + timedelta(days=day),
+                                       expires_at__lt=now + timedelta(days=day + 1)))
+        for day in range(1, days + 1)
+    }
+    counts = Ad.objects.filter(expires_at__gte=now + timedelta(days=1),
+                               expires_at__lt=now + timedelta(days=days + 1))\
+                       .aggregate(**buckets)
+    return {int(day): count for day, count in counts.items()}
+
+
 def get_ads_expiring_soon(days=3):
     """
     Возвращает объявления, которые истекут в ближайшие дни
     """
-    soon_expiring_ads = []
-    
-    for ad in Ad.objects.all():
-        if ad.category.name.lower() == "попутка":
-            lifetime = timedelta(days=5)
-        else:
-            lifetime = timedelta(days=30)
-        
-        expiry_date = ad.created_at + lifetime
-        time_until_expiry = expiry_date - timezone.now()
-        
-        if 0 < time_until_expiry.days <= days:
-            soon_expiring_ads.append({
-                'id': ad.id,
-                'contact_phone': ad.contact_phone,
-                'category': ad.category.name_kg,
-                'created_at': ad.created_at,
-                'expires_in_days': time_until_expiry.days
-            })
-    
-    return soon_expiring_ads
+    now = timezone.now()
+    # Целых дней до истечения от 1 до days включительно
+    soon = Ad.objects.filter(expires_at__gte=now + timedelta(days=1),
+                             expires_at__lt=now + timedelta(days=days + 1))\
+                     .values('id', 'contact_phone', 'category__name_kg', 'created_at', 'expires_at')\
+                     .order_by('expires_at')
+
+    return [{
+        'id': ad['id'],
+        'contact_phone': ad['contact_phone'],
+        'category': ad['category__name_kg'],
+        'created_at': ad['created_at'],
+        'expires_in_days': (ad['expires_at'] - now).days
+    } for ad in soon.iterator()]
+
+
+def queryset_etag(queryset, field='updated_at'):
+    """
+    Дешёвый валидатор для списка: число строк и время последнего изменения
+    одним агрегирующим запросом. Удаление меняет число, правка — время.
+    """
+    stamp = queryset.order_by().aggregate(count=Count('pk'), last=Max(field))
+    last = stamp['last'].timestamp() if stamp['last'] else 0
+    return f"{stamp['count']}-{last}"
@@ -1,26 +1,37 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, authentication
-from .models import Ad, AdPhoto, City, AdComplaint
+from .models import Ad, AdCounter, City, AdComplaint
 from categories.models import Category
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.shortcuts import get_object_or_404
 from django.core.paginator import Paginator, EmptyPage
+from .pagination import paginate_by_cursor, page_params, InvalidCursor, InvalidPageParams, CountedPaginator
+from .search import get_search_backend, SEARCH_LIMIT
+from .utils import normalize_phone_prefix, prefix_range, queryset_etag
+from . import archive, counters, feed_cache, sync
+from .image_jobs import save_ad_photos
+from .projections import ad_rows, ad_rows_by_ids, serialize_ads, media_prefix, photos_by_ad, cities_by_ad
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 from users.models import ModeratorActivityStat
 from django.utils import timezone
 import pytz
-import io
-from PIL import Image
-from django.core.files.base import ContentFile
+from datetime import datetime
 
-# Target image size in bytes (300KB)
-TARGET_IMAGE_SIZE = 300 * 1024
+# Max results for the moderator search over a city feed
+MINE_SEARCH_LIMIT = 100
+
+# Phone lookup: minimal prefix length (in 996XXXXXXXXX form) and result cap
+PHONE_LOOKUP_MIN_PREFIX = 6
+PHONE_LOOKUP_LIMIT = 100
 
 def format_phone(phone: str) -> str:
     """Format phone number to ensure it starts with a plus sign."""
@@ -29,38 +40,15 @@ def format_phone(phone: str) -> str:
     return phone if phone.startswith('+') else f"+{phone}"
 
 
-def compress_image(image, target_size=TARGET_IMAGE_SIZE, quality=85, min_quality=40):
+def feed_paginator(rows, limit, city_id, category_id, **filters):
     """
-    Compress an image to be under the target_size while maintaining aspect ratio.
-    Returns a ContentFile with the compressed image data.
+    Пагинатор ленты. Общее число берётся из счётчиков AdCounter, а не COUNT(*);
+    при HIDE_EXPIRED_ADS счётчики учитывают ещё не удалённые истекшие объявления,
+    поэтому считаем по самой ленте.
     """
-    img = Image.open(image)
-    
-    # Convert to RGB if image is in RGBA mode (to avoid issues with JPEG)
-    if img.mode in ('RGBA', 'P'):
-        img = img.convert('RGB')
-    
-    # Start with original size and reduce quality until under target size
-    current_quality = quality
-    output = io.BytesIO()
-    
-    while current_quality >= min_quality:
-        output.seek(0)
-        output.truncate()
-        
-        # Save with current quality setting
-        img.save(output, format='JPEG', quality=current_quality, optimize=True)
-        
-        # If we're under target size or at minimum quality, we're done
-        if output.tell() <= target_size or current_quality <= min_quality:
-            break
-            
-        # Reduce quality for next iteration
-        current_quality -= 5
-    
-    # Create a ContentFile with the compressed image data
-    output.seek(0)
-    return ContentFile(output.read(), name=image.name)
+    if settings.HIDE_EXPIRED_ADS:
+        return Paginator(rows, limit)
+    return CountedPaginator(rows, limit, counters.feed_count(city_id, category_id, **filters))
 
 
 class CreateAdView(APIView):
@@ -96,13 +84,9 @@ class CreateAdView(APIView):
             is_paid=True  # Automatically mark new ads as paid
         )   
         ad.cities.set(cities)
-        for image in request.FILES.getlist("images"):
-            # Check if image is larger than 50KB before compressing
-            if image.size > 50 * 1024:  # Only compress if larger than 50KB
-                compressed_image = compress_image(image)
-                AdPhoto.objects.create(ad=ad, image=compressed_image)
-            else:
-                AdPhoto.objects.create(ad=ad, image=image)
+        # Сжатие сразу (все фото параллельно) или в фоне (AD_IMAGE_PROCESSING),
+        # мелкие фото как есть
+        save_ad_photos(ad, request.FILES.getlist("images"))
 
         
         now = timezone.now().astimezone(pytz.timezone('Asia/Bishkek'))
@@ -166,12 +150,7 @@ class CreateDraftAdView(APIView):
         ad.cities.set(cities)
         
         # Handle image uploads
-        for image in request.FILES.getlist("images"):
-            if image.size > 50 * 1024:  # Only compress if larger than 50KB
-                compressed_image = compress_image(image)
-                AdPhoto.objects.create(ad=ad, image=compressed_image)
-            else:
-                AdPhoto.objects.create(ad=ad, image=image)
+        save_ad_photos(ad, request.FILES.getlist("images"))
 
         # Update moderator stats if user is authenticated
         if request.user.is_authenticated:
@@ -225,27 +204,30 @@ class UnpaidAdsView(APIView):
     permission_classes = [IsAdminUser]  # Only accessible by admin users
     
     def get(self, request):
-        # Get all unpaid ads with related data to avoid N+1 queries
-        ads = Ad.objects.filter(is_paid=False)\
-                      .select_related('category')\
-                      .prefetch_related('cities', 'photos')\
-                      .order_by('-created_at')
+        # Only the needed columns; cities and photos are loaded with one query each
+        ads = list(Ad.objects.filter(is_paid=False)
+                             .order_by('-created_at')
+                             .values('id', 'description', 'contact_phone', 'created_at',
+                                     'category_id', 'category__name_kg', 'is_confident'))
+        ad_ids = [ad['id'] for ad in ads]
+        photos = photos_by_ad(ad_ids, media_prefix())
+        cities = cities_by_ad(ad_ids)
         
         # Prepare response data
         data = []
         for ad in ads:
             data.append({
-                'id': ad.id,
-                'description': ad.description,
-                'contact_phone': ad.contact_phone,
-                'created_at': ad.created_at,
+                'id': ad['id'],
+                'description': ad['description'],
+                'contact_phone': ad['contact_phone'],
+                'created_at': ad['created_at'],
                 'category': {
-                    'id': ad.category.id,
-                    'name': ad.category.name_kg
+                    'id': ad['category_id'],
+                    'name': ad['category__name_kg']
                 },
-                'cities': [{'id': city.id, 'name': city.name} for city in ad.cities.all()],
-                'photos': [photo.image.url for photo in ad.photos.all() if photo.image],
-                'is_confident': ad.is_confident,
+                'cities': [{'id': city_id, 'name': name} for city_id, name in cities.get(ad['id'], [])],
+                'photos': photos.get(ad['id'], []),
+                'is_confident': ad['is_confident'],
                 'author': None
             })
             
@@ -277,11 +259,16 @@ class MarkAdAsPaidView(APIView):
         # Mark as paid and refresh creation date to now
         ad.is_paid = True
         ad.created_at = timezone.now()
-        ad.save(update_fields=["is_paid", "created_at"])
+        ad.save(update_fields=["is_paid", "created_at", "updated_at"])
 
         return Response({"message": "Ad marked as paid", "ad_id": ad.id}, status=200)
 
 
+def cities_list_etag(request):
+    return 'cities-' + queryset_etag(City.objects.all())
+
+
+@method_decorator(condition(etag_func=cities_list_etag), name='get')
 class CitiesListView(View):
     def get(self, request):
         cities = City.objects.all().order_by('name')
@@ -321,18 +308,8 @@ class AdsByCityView(View):
         except City.DoesNotExist:
             return JsonResponse({"detail": "Город не найден"}, status=404)
 
-        ads = Ad.objects.filter(cities=city).select_related('category').prefetch_related('photos').order_by('-created_at')
-
-        ads_data = []
-        for ad in ads:
-            ads_data.append({
-                "id": ad.id,
-                "description": ad.description,
-                "contact_phone": ad.contact_phone,
-                "category": ad.category.name_kg if ad.category else None,
-                "created_at": ad.created_at.isoformat(),
-                "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
-            })
+        ads = ad_rows(Ad.objects.unexpired().in_city(city.id).order_by('-created_at'))
+        ads_data = serialize_ads(ads, request)
 
         return JsonResponse(ads_data, safe=False)
     
@@ -340,10 +317,7 @@ class AdsByCityView(View):
 class AdsByCityAndCategoryView(View):
     def get(self, request, city_id, category_id):
         # Формируем оптимизированный QuerySet
-        ads_query = Ad.objects.select_related('category')\
-                             .prefetch_related('photos', 'cities')\
-                             .filter(cities__id=city_id)\
-                             .order_by('-created_at')
+        ads_query = Ad.objects.unexpired().in_city(city_id).order_by('-created_at')
 
         if category_id != 0:
             ads_query = ads_query.filter(category_id=category_id)
@@ -355,30 +329,34 @@ class AdsByCityAndCategoryView(View):
             if category_id != 0 and not Category.objects.filter(id=category_id).exists():
                 return JsonResponse({"detail": "Категория не найдена"}, status=404)
 
-        # Параметры пагинации
-        page = int(request.GET.get('page', 1))
-        limit = int(request.GET.get('limit', 20))
-        paginator = Paginator(ads_query, limit)
-        
+        # Дальше только нужные колонки через values()
+        rows = ad_rows(ads_query, detailed=True)
+
+        # Параметры пагинации: cursor — keyset-режим, page — старый режим для прежних версий приложения
         try:
-            ads_page = paginator.page(page)
-        except EmptyPage:
-            ads_page = []
-
-        ads_data = []
-        for ad in ads_page:
-            cities = ad.cities.all()
-            ads_data.append({
-                "id": ad.id,
-                "description": ad.description,
-                "contact_phone": ad.contact_phone,
-                "category": ad.category.name_kg if ad.category else None,
-                "category_id": ad.category.id if ad.category else None,
-                "cities": [city.name for city in cities],
-                "cities_ids": [city.id for city in cities],
-                "created_at": ad.created_at.isoformat(),
-                "author": ad.author.name if ad.author else None,
-                "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
+            limit, page = page_params(request.GET)
+        except InvalidPageParams:
+            return JsonResponse({"detail": "limit и page должны быть целыми числами"}, status=400)
+        cursor_mode = 'cursor' in request.GET
+        if cursor_mode:
+            try:
+                ads_page, next_cursor = paginate_by_cursor(rows, request.GET.get('cursor'), limit)
+            except InvalidCursor:
+                return JsonResponse({"detail": "Неверный курсор"}, status=400)
+        else:
+            paginator = feed_paginator(rows, limit, city_id, category_id)
+
+            try:
+                ads_page = paginator.page(page)
+            except EmptyPage:
+                ads_page = []
+
+        ads_data = serialize_ads(ads_page, request, detailed=True)
+
+        if cursor_mode:
+            return JsonResponse({
+                "results": ads_data,
+                "next_cursor": next_cursor,
             })
 
         return JsonResponse({
@@ -395,10 +373,7 @@ class AdsByCityAndCategoryViewMine(APIView):
 
     def get(self, request, city_id, category_id):
         # Формируем оптимизированный QuerySet
-        ads_query = Ad.objects.select_related('category')\
-                             .prefetch_related('photos', 'cities')\
-                             .filter(cities__id=city_id, author=request.user)\
-                             .order_by('-created_at')
+        ads_query = Ad.objects.in_city(city_id).filter(author=request.user).order_by('-created_at')
 
         if category_id != 0:
             ads_query = ads_query.filter(category_id=category_id)
@@ -410,30 +385,34 @@ class AdsByCityAndCategoryViewMine(APIView):
             if category_id != 0 and not Category.objects.filter(id=category_id).exists():
                 return Response({"detail": "Категория не найдена"}, status=404)
 
-        # Параметры пагинации
-        page = int(request.GET.get('page', 1))
-        limit = int(request.GET.get('limit', 20))
-        paginator = Paginator(ads_query, limit)
-        
+        # Дальше только нужные колонки через values()
+        rows = ad_rows(ads_query, detailed=True)
+
+        # Параметры пагинации: cursor — keyset-режим, page — старый режим для прежних версий приложения
         try:
-            ads_page = paginator.page(page)
-        except EmptyPage:
-            ads_page = []
-
-        ads_data = []
-        for ad in ads_page:
-            cities = ad.cities.all()
-            ads_data.append({
-                "id": ad.id,
-                "description": ad.description,
-                "contact_phone": ad.contact_phone,
-                "category": ad.category.name_kg if ad.category else None,
-                "category_id": ad.category.id if ad.category else None,
-                "cities": [city.name for city in cities],
-                "cities_ids": [city.id for city in cities],
-                "created_at": ad.created_at.isoformat(),
-                "author": ad.author.name if ad.author else None,
-                "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
+            limit, page = page_params(request.GET)
+        except InvalidPageParams:
+            return Response({"detail": "limit и page должны быть целыми числами"}, status=400)
+        cursor_mode = 'cursor' in request.GET
+        if cursor_mode:
+            try:
+                ads_page, next_cursor = paginate_by_cursor(rows, request.GET.get('cursor'), limit)
+            except InvalidCursor:
+                return Response({"detail": "Неверный курсор"}, status=400)
+        else:
+            paginator = Paginator(rows, limit)
+
+            try:
+                ads_page = paginator.page(page)
+            except EmptyPage:
+                ads_page = []
+
+        ads_data = serialize_ads(ads_page, request, detailed=True)
+
+        if cursor_mode:
+            return Response({
+                "results": ads_data,
+                "next_cursor": next_cursor,
             })
 
         return Response({
@@ -494,21 +473,46 @@ class EditAdView(APIView):
         # Если переданы новые фотографии — удаляем старые и добавляем новые
         if request.FILES.getlist("images"):
             ad.photos.all().delete()
-            for image in request.FILES.getlist("images"):
-                AdPhoto.objects.create(ad=ad, image=image)
+            save_ad_photos(ad, request.FILES.getlist("images"))
 
         ad.save()
 
         return Response({"message": "Объявление обновлено"}, status=200)
     
 
+def public_feed_version(request, city_id):
+    # Версия города растёт при любом изменении его объявлений (ads/signals.py);
+    # читается один раз на запрос — для ETag и для ключа кэша страниц
+    if not hasattr(request, '_feed_version'):
+        request._feed_version = feed_cache.feed_version(city_id)
+    return request._feed_version
+
+
+def public_feed_etag(request, city_id, category_id):
+    version = public_feed_version(request, city_id)
+    if version is None:
+        return None
+    return f'feed-{city_id}-{category_id}-{version}'
+
+
+@method_decorator(condition(etag_func=public_feed_etag), name='get')
 class PublicAdsByCityAndCategoryView(View):
     def get(self, request, city_id, category_id):
+        # Первые страницы ленты отдаются из кэша уже сериализованными
+        cache_key = feed_cache.page_key(request, city_id, category_id, public_feed_version(request, city_id))
+        if cache_key:
+            content = feed_cache.get_page(cache_key)
+            if content is not None:
+                return HttpResponse(content, content_type='application/json')
+
+        response = self.build_response(request, city_id, category_id)
+        if cache_key and response.status_code == 200:
+            feed_cache.set_page(cache_key, response.content)
+        return response
+
+    def build_response(self, request, city_id, category_id):
         # Формируем оптимизированный QuerySet
-        ads_query = Ad.objects.select_related('category')\
-                             .prefetch_related('photos')\
-                             .filter(cities__id=city_id, is_paid=True)\
-                             .order_by('-created_at')
+        ads_query = Ad.objects.unexpired().in_city(city_id).filter(is_paid=True).order_by('-created_at')
 
         if category_id != 0:
             ads_query = ads_query.filter(category_id=category_id)
@@ -520,26 +524,35 @@ class PublicAdsByCityAndCategoryView(View):
             if category_id != 0 and not Category.objects.filter(id=category_id).exists():
                 return JsonResponse({"detail": "Категория не найдена"}, status=404)
 
-        # Параметры пагинации
-        page = int(request.GET.get('page', 1))
-        limit = int(request.GET.get('limit', 20))
-        paginator = Paginator(ads_query, limit)
+        # Дальше только нужные колонки через values()
+        rows = ad_rows(ads_query)
+
+        # Параметры пагинации: cursor — keyset-режим, page — старый режим для прежних версий приложения
         try:
-            ads_page = paginator.page(page)
-        except EmptyPage:
-            ads_page = []
-
-        ads_data = [
-            {
-                "id": ad.id,
-                "description": ad.description,
-                "contact_phone": ad.contact_phone,
-                "category": ad.category.name_kg if ad.category else None,
-                "created_at": ad.created_at.isoformat(),
-                "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
-            }
-            for ad in ads_page
-        ]
+            limit, page = page_params(request.GET)
+        except InvalidPageParams:
+            return JsonResponse({"detail": "limit и page должны быть целыми числами"}, status=400)
+        cursor_mode = 'cursor' in request.GET
+        if cursor_mode:
+            try:
+                ads_page, next_cursor = paginate_by_cursor(rows, request.GET.get('cursor'), limit)
+            except InvalidCursor:
+                return JsonResponse({"detail": "Неверный курсор"}, status=400)
+        else:
+            paginator = feed_paginator(rows, limit, city_id, category_id, is_paid=True)
+
+            try:
+                ads_page = paginator.page(page)
+            except EmptyPage:
+                ads_page = []
+
+        ads_data = serialize_ads(ads_page, request)
+
+        if cursor_mode:
+            return JsonResponse({
+                "results": ads_data,
+                "next_cursor": next_cursor,
+            })
 
         return JsonResponse({
             "results": ads_data,
@@ -550,38 +563,43 @@ class PublicAdsByCityAndCategoryView(View):
     
 
 
+def city_counts_etag(request, city_id):
+    return public_feed_etag(request, city_id, 'counts')
+
+
+@method_decorator(condition(etag_func=city_counts_etag), name='get')
+class AdCountsByCityView(View):
+    def get(self, request, city_id):
+        # Один проход по индексу (city, is_paid, category) таблицы счётчиков
+        rows = AdCounter.objects.filter(city_id=city_id, is_paid=True, count__gt=0)\
+                                .order_by('category_id')\
+                                .values_list('category_id', 'count')
+        categories = [{"category_id": category_id, "count": count} for category_id, count in rows]
+        if not categories and not City.objects.filter(id=city_id).exists():
+            return JsonResponse({"detail": "Город не найден"}, status=404)
+        return JsonResponse({
+            "city_id": city_id,
+            "total": sum(item["count"] for item in categories),
+            "categories": categories,
+        })
+
+
 class AdSearchView(View):
     def get(self, request, city_id):
-        query = request.GET.get('q', '').strip().lower()
-        print("123123")
+        query = request.GET.get('q', '').strip()
 
         # Проверка: город существует?
         if not City.objects.filter(id=city_id).exists():
             return JsonResponse({"detail": "Город не найден"}, status=404)
 
-        # Базовый запрос по городу
-        ads_query = Ad.objects.select_related('category')\
-                              .prefetch_related('photos')\
-                              .filter(cities__id=city_id)\
-                              .order_by('-created_at')
-
-        # Фильтрация вручную по описанию и телефону
         if query:
-            ads_query = [
-                ad for ad in ads_query
-                if query in (ad.description or '').lower() or query in (ad.contact_phone or '').lower()
-            ]
+            # Поиск, фильтр по городу и LIMIT выполняются в индексе, сюда приходят только id
+            ad_ids = get_search_backend().search(query, city_id=city_id, limit=SEARCH_LIMIT)
+            ads = ad_rows_by_ids(Ad.objects.unexpired(), ad_ids)
         else:
-            ads_query = list(ads_query)
+            ads = ad_rows(Ad.objects.unexpired().in_city(city_id).order_by('-created_at'))[:SEARCH_LIMIT]
 
-        ads_data = [{
-            "id": ad.id,
-            "description": ad.description,
-            "contact_phone": ad.contact_phone,
-            "category": ad.category.name_kg if ad.category else None,
-            "created_at": ad.created_at.isoformat(),
-            "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
-        } for ad in ads_query[:30]]  # Ограничение на первые 50 объявлений
+        ads_data = serialize_ads(ads, request)
 
         return JsonResponse(ads_data, safe=False)
     
@@ -604,37 +622,22 @@ class AdsByModeratorView(View):
         city_id = request.GET.get("city_id")
         category_id = request.GET.get("category_id")
 
-        ads_query = Ad.objects.filter(author=moderator).select_related('category').prefetch_related('photos', 'cities')
+        ads_query = Ad.objects.filter(author=moderator)
 
         if city_id:
-            ads_query = ads_query.filter(cities__id=city_id)
+            ads_query = ads_query.in_city(city_id)
 
         if category_id:
             ads_query = ads_query.filter(category__id=category_id)
 
         ads_query = ads_query.order_by('-created_at')
 
-        ads_data = []
-        cities_set = set()
-
-        for ad in ads_query:
-            ad_cities = ad.cities.all()
-            ads_data.append({
-                "id": ad.id,
-                "description": ad.description,
-                "contact_phone": ad.contact_phone,
-                "category": ad.category.name_kg if ad.category else None,
-                "category_id": ad.category.id if ad.category else None,
-                "cities": [city.name for city in ad_cities],
-                "cities_ids": [city.id for city in ad_cities],
-                "created_at": ad.created_at.isoformat(),
-                "author": ad.author.name if ad.author else None,
-                "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
-            })
+        ads_data = serialize_ads(ad_rows(ads_query, detailed=True), request, detailed=True)
 
-            # Собираем уникальные города
-            for city in ad_cities:
-                cities_set.add((city.id, city.name))
+        # Собираем уникальные города
+        cities_set = set()
+        for ad in ads_data:
+            cities_set.update(zip(ad["cities_ids"], ad["cities"]))
 
         # Преобразуем в список словарей
         cities_list = [{"id": cid, "name": cname} for cid, cname in cities_set]
@@ -657,10 +660,7 @@ class AdsByCityAndCategoryViewMineSearch(APIView):
         except City.DoesNotExist:
             return Response({"detail": "Город не найден"}, status=404)
 
-        ads_query = Ad.objects.filter(cities=city)\
-                              .select_related('category')\
-                              .prefetch_related('photos', 'cities')\
-                              .order_by('-created_at')
+        ads_query = Ad.objects.in_city(city.id).order_by('-created_at')
 
         if category_id != 0:
             try:
@@ -669,33 +669,120 @@ class AdsByCityAndCategoryViewMineSearch(APIView):
             except Category.DoesNotExist:
                 return Response({"detail": "Категория не найдена"}, status=404)
 
-        # Обработка параметра поиска вручную (в Python)
-        search_query = request.GET.get('search', '').strip().lower()
-        filtered_ads = []
-        for ad in ads_query:
-            description = ad.description.lower() if ad.description else ''
-            contact_phone = ad.contact_phone.lower() if ad.contact_phone else ''
-            if search_query in description or search_query in contact_phone:
-                filtered_ads.append(ad)
-
-        ads_data = []
-        for ad in filtered_ads:
-            cities = ad.cities.all()
-            ads_data.append({
-                "id": ad.id,
-                "description": ad.description,
-                "contact_phone": ad.contact_phone,
-                "category": ad.category.name_kg if ad.category else None,
-                "category_id": ad.category.id,
-                "cities": [city.name for city in cities],
-                "cities_ids": [city.id for city in cities],
-                "created_at": ad.created_at.isoformat(),
-                "author": ad.author.name if ad.author else None,
-                "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
-            })
+        # Поиск по индексу: точные совпадения, затем нечёткие (транслит, опечатки)
+        search_query = request.GET.get('search', '').strip()
+        if search_query:
+            ad_ids = get_search_backend().search(
+                search_query,
+                city_id=city.id,
+                limit=MINE_SEARCH_LIMIT,
+                category_id=category_id or None,
+            )
+            filtered_ads = ad_rows_by_ids(ads_query, ad_ids, detailed=True)
+        else:
+            filtered_ads = ad_rows(ads_query, detailed=True)
+
+        ads_data = serialize_ads(filtered_ads, request, detailed=True)
 
         return Response({
             "ads": ads_data,
             "cities": [city.name for city in City.objects.all()],
             "moderator_name": request.user.name or request.user.phone
-        })
\ No newline at end of file
+        })
+
+
+class AdsByPhoneView(APIView):
+    """
+    Все объявления с номером, начинающимся на переданный префикс:
+    модераторы проверяют повторные подачи. Поиск идёт по индексу phone_normalized.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        prefix = normalize_phone_prefix(request.GET.get('phone', ''))
+        if len(prefix) < PHONE_LOOKUP_MIN_PREFIX:
+            return Response({"error": "Введите хотя бы первые цифры номера"}, status=400)
+
+        lower, upper = prefix_range(prefix)
+        ads_query = Ad.objects.filter(phone_normalized__gte=lower, phone_normalized__lt=upper)\
+                              .order_by('-created_at')[:PHONE_LOOKUP_LIMIT]
+        ads_data = serialize_ads(ad_rows(ads_query, detailed=True), request, detailed=True, with_paid=True)
+
+        return Response({
+            "phone_prefix": prefix,
+            "count": len(ads_data),
+            "ads": ads_data,
+        })
+
+
+def archive_day_start(value):
+    day = datetime.strptime(value, '%Y-%m-%d')
+    return timezone.make_aware(day) if settings.USE_TZ else day
+
+
+class ArchivedAdsByPhoneView(APIView):
+    """
+    Поиск по холодному архиву истекших объявлений: ?phone=<префикс>,
+    необязательно ?from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД по дате подачи (to не включается).
+    Только чтение: вернуть объявление может restore_archived_ads.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        prefix = normalize_phone_prefix(request.GET.get('phone', ''))
+        if len(prefix) < PHONE_LOOKUP_MIN_PREFIX:
+            return Response({"error": "Введите хотя бы первые цифры номера"}, status=400)
+
+        try:
+            # Границы — полночь в поясе проекта; при USE_TZ archive.format_date приведёт их к UTC
+            date_from, date_to = (
+                archive_day_start(request.GET[key]) if request.GET.get(key) else None
+                for key in ('from', 'to')
+            )
+        except ValueError:
+            return Response({"error": "Дата должна быть в формате ГГГГ-ММ-ДД"}, status=400)
+
+        ads_data = archive.lookup_by_phone(prefix, date_from, date_to)
+        return Response({
+            "phone_prefix": prefix,
+            "count": len(ads_data),
+            "ads": ads_data,
+        })
+
+
+class AdSyncView(View):
+    """
+    Дельта-синхронизация публичной ленты города: ?since=<token> из прошлого ответа.
+    Без since — пустой ответ и токен «с текущего момента».
+    """
+    def get(self, request, city_id):
+        if not City.objects.filter(id=city_id).exists():
+            return JsonResponse({"detail": "Город не найден"}, status=404)
+
+        since = request.GET.get('since')
+        if not since:
+            return JsonResponse({"ads": [], "deleted": [], "token": sync.initial_token(city_id), "has_more": False})
+
+        try:
+            rows, deleted, token, has_more = sync.changes_since(city_id, since)
+        except InvalidCursor:
+            return JsonResponse({"detail": "Неверный токен"}, status=400)
+        except sync.ExpiredToken:
+            return JsonResponse({"detail": "Токен устарел, загрузите ленту заново"}, status=410)
+
+        return JsonResponse({
+            "ads": serialize_ads(rows, request, with_category_id=True),
+            "deleted": deleted,
+            "token": token,
+            "has_more": has_more,
+        })
+
+
+class FeedCacheStatsView(APIView):
+    """
+    Счётчики попаданий/промахов кэша публичной ленты
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(feed_cache.stats())
@@ -0,0 +1,29 @@
+"""
+Поднимает Django поверх временной SQLite-базы и временного MEDIA_ROOT,
+чтобы бенчмарки не трогали рабочие данные. Импортировать до моделей.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "threeseven.settings")
+
+WORK_DIR = tempfile.mkdtemp(prefix="aimak-bench-")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES["default"]["NAME"] = os.path.join(WORK_DIR, "bench.sqlite3")
+settings.MEDIA_ROOT = os.path.join(WORK_DIR, "media")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+call_command("migrate", verbosity=0)
@@ -0,0 +1,116 @@
+"""
+Сжатие фото при загрузке: прежний цикл (полный кадр, качество 85, 80, ... 40)
+против ads/images.compress_image (draft/reduce, AD_IMAGE_MAX_EDGE, бинарный
+поиск качества).
+
+    python -m benchmarks.bench_compress_image --photos 12
+    python -m benchmarks.bench_compress_image --dir ~/sample-photos
+
+Без --dir генерируется корпус «фотографий» 4000x3000 и 3024x4032 с шумом
+и EXIF-ориентацией, чтобы JPEG весил как снимок с телефона.
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import time
+
+from benchmarks import _django  # noqa: F401
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+from ads.images import TARGET_IMAGE_SIZE, compress_image
+
+SIZES = [(4000, 3000), (3024, 4032), (4032, 3024), (2560, 1920)]
+
+
+def legacy_compress_image(image, target_size=TARGET_IMAGE_SIZE, quality=85, min_quality=40):
+    """compress_image из ads/views.py до переноса в ads/images.py."""
+    img = Image.open(image)
+    if img.mode in ('RGBA', 'P'):
+        img = img.convert('RGB')
+    current_quality = quality
+    output = io.BytesIO()
+    while current_quality >= min_quality:
+        output.seek(0)
+        output.truncate()
+        img.save(output, format='JPEG', quality=current_quality, optimize=True)
+        if output.tell() <= target_size or current_quality <= min_quality:
+            break
+        current_quality -= 5
+    output.seek(0)
+    return ContentFile(output.read(), name=image.name)
+
+
+def synthetic_photo(rng, width, height):
+    # Шум, растянутый с меньшего кадра, сжимается примерно как фактура на фото
+    channels = [
+        Image.effect_noise((width // rng.choice([2, 3, 4]), height // rng.choice([2, 3, 4])), rng.randint(15, 35))
+             .resize((width, height), Image.BICUBIC)
+        for _ in range(3)
+    ]
+    gradient = Image.linear_gradient('L').resize((width, height))
+    img = Image.merge('RGB', [Image.blend(channel, gradient, 0.5) for channel in channels])
+    exif = Image.Exif()
+    exif[0x0112] = rng.choice([1, 6, 8])
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=92, exif=exif)
+    return output.getvalue()
+
+
+def load_corpus(args):
+    if args.dir:
+        corpus = []
+        for name in sorted(os.listdir(args.dir)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.heic')):
+                with open(os.path.join(args.dir, name), 'rb') as f:
+                    corpus.append((name, f.read()))
+        return corpus
+    rng = random.Random(42)
+    return [
+        (f'photo_{i}.jpg', synthetic_photo(rng, *SIZES[i % len(SIZES)]))
+        for i in range(args.photos)
+    ]
+
+
+def run(func, corpus):
+    timings, sizes, over_target = [], [], 0
+    for name, data in corpus:
+        upload = SimpleUploadedFile(name, data, content_type='image/jpeg')
+        started = time.perf_counter()
+        result = func(upload)
+        timings.append((time.perf_counter() - started) * 1000)
+        sizes.append(result.size)
+        over_target += result.size > TARGET_IMAGE_SIZE
+        last_dimensions = Image.open(io.BytesIO(result.read())).size
+    return timings, sizes, over_target, last_dimensions
+
+
+def report(label, timings, sizes, over_target, dimensions):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(
+        f"{label:<8} median {statistics.median(timings):7.1f} ms   p95 {p95:7.1f} ms   "
+        f"size avg {statistics.mean(sizes) / 1024:6.1f} KB   over target {over_target}   "
+        f"last {dimensions[0]}x{dimensions[1]}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--photos', type=int, default=12)
+    parser.add_argument('--dir', default=None, help='Каталог с настоящими фото вместо синтетики')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    print(f"Фото: {len(corpus)}, исходный размер в среднем "
+          f"{statistics.mean(len(data) for _, data in corpus) / 1024:.0f} KB")
+    report('legacy', *run(legacy_compress_image, corpus))
+    report('new', *run(compress_image, corpus))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Сериализация страницы ленты: модели + build_absolute_uri на каждое фото
+(как было во вьюхах) против values()-проекции из ads/projections.py.
+
+    python -m benchmarks.bench_feed_serialization --ads 5000 --photos 3
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import _django  # noqa: F401
+
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from ads.models import Ad, AdPhoto, City
+from ads.projections import ad_rows, serialize_ads
+from categories.models import Category
+from users.models import User
+
+
+def build_corpus(ads_count, photos_per_ad):
+    rng = random.Random(42)
+    city = City.objects.create(name="Ноокат")
+    categories = [Category.objects.create(name_kg=f"Кат {i}", ru_name=f"Кат {i}") for i in range(8)]
+    authors = [User.objects.create_user(phone=f"+99655500{i:04d}", name=f"Мод {i}") for i in range(20)]
+
+    through = Ad.cities.through
+    batch = 2000
+    with transaction.atomic():
+        for start in range(0, ads_count, batch):
+            ads = Ad.objects.bulk_create([
+                Ad(
+                    description=f"Объявление {start + i}",
+                    contact_phone=f"+996{rng.randint(500000000, 799999999)}",
+                    category=rng.choice(categories),
+                    author=rng.choice(authors),
+                    is_paid=True,
+                )
+                for i in range(min(batch, ads_count - start))
+            ])
+            through.objects.bulk_create([through(ad_id=ad.id, city_id=city.id) for ad in ads])
+            AdPhoto.objects.bulk_create([
+                AdPhoto(ad=ad, image=f"ad_photos/{ad.id}_{n}.jpg")
+                for ad in ads for n in range(photos_per_ad)
+            ])
+    return city
+
+
+def legacy_page(request, city_id, limit):
+    ads = Ad.objects.select_related('category')\
+                    .prefetch_related('photos', 'cities')\
+                    .filter(cities__id=city_id)\
+                    .order_by('-created_at')[:limit]
+    data = []
+    for ad in ads:
+        cities = ad.cities.all()
+        data.append({
+            "id": ad.id,
+            "description": ad.description,
+            "contact_phone": ad.contact_phone,
+            "category": ad.category.name_kg if ad.category else None,
+            "category_id": ad.category.id if ad.category else None,
+            "cities": [city.name for city in cities],
+            "cities_ids": [city.id for city in cities],
+            "created_at": ad.created_at.isoformat(),
+            "author": ad.author.name if ad.author else None,
+            "images": [request.build_absolute_uri(photo.image.url) for photo in ad.photos.all()],
+        })
+    return data
+
+
+def projected_page(request, city_id, limit):
+    rows = ad_rows(Ad.objects.in_city(city_id).order_by('-created_at'), detailed=True)[:limit]
+    return serialize_ads(rows, request, detailed=True)
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            result = fn()
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(ctx.captured_queries), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ads", type=int, default=5000)
+    parser.add_argument("--photos", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    city = build_corpus(args.ads, args.photos)
+    request = RequestFactory().get("/", SERVER_NAME="127.0.0.1")
+    print(f"Корпус: {args.ads} объявлений, по {args.photos} фото\n")
+    print(f"{'страница':>8} {'модели':>10} {'запросов':>9} {'values()':>10} {'запросов':>9} {'ускорение':>10}")
+
+    for limit in (20, 50, 100):
+        legacy_ms, legacy_queries, legacy = measure(lambda: legacy_page(request, city.id, limit), args.repeat)
+        fast_ms, fast_queries, fast = measure(lambda: projected_page(request, city.id, limit), args.repeat)
+        assert legacy == fast, "ответы разошлись"
+        print(
+            f"{limit:>8} {legacy_ms:>8.1f}ms {legacy_queries:>9} {fast_ms:>8.1f}ms {fast_queries:>9}"
+            f" {legacy_ms / fast_ms:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Сколько воркер занят одним запросом к MEDIA_URL: прежняя раздача
+django.views.static.serve против ads/media_serving в режимах python
+(FileResponse), accel (X-Accel-Redirect) и sendfile (X-Sendfile).
+
+    python -m benchmarks.bench_media_serving --sizes 30 300 2000 --requests 200
+
+Тело ответа вычитывается целиком, как это делает WSGI-сервер: в режимах
+python и static воркер занят, пока не отдаст последний байт, в режимах
+accel и sendfile тело пустое и файл отдаёт прокси. Middleware одинаковы
+для всех режимов и в замер не входят. На медленных клиентах без
+буферизации прокси разница ещё больше: static и python держат воркер всё
+время передачи.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks import _django  # noqa: F401
+
+from django.conf import settings
+from django.test import RequestFactory
+from django.views.static import serve
+
+from ads.media_serving import serve_media
+
+
+def static_serve(request, path):
+    return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+
+def occupancy(view, factory, names, headers):
+    """Медиана времени от вызова вьюхи до закрытия ответа, мс."""
+    timings = []
+    for name in names:
+        request = factory.get(settings.MEDIA_URL + name, headers=headers)
+        started = time.perf_counter()
+        response = view(request, name)
+        for _ in response:
+            pass
+        response.close()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 300, 2000], help='Размеры файлов, КБ')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--range', default='bytes=0-65535', help='Заголовок Range для второго прохода')
+    args = parser.parse_args()
+
+    factory = RequestFactory()
+    modes = [
+        ('static', static_serve, None),
+        ('python', serve_media, 'python'),
+        ('accel', serve_media, 'accel'),
+        ('sendfile', serve_media, 'sendfile'),
+    ]
+    print(f"Запросов на замер: {args.requests}, время воркера на запрос (медиана), ms")
+    print(f"{'КБ':>6} {'Range':>6} " + ' '.join(f'{mode:>9}' for mode, _, _ in modes))
+    for size in args.sizes:
+        # Разные файлы: замер не сводится к одному файлу в кэше страниц
+        names = []
+        for i in range(min(args.requests, 50)):
+            name = f'blobs/{i:02x}/{size:04x}/{i:064x}.jpg'
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size * 1024))
+            names.append(name)
+        names = (names * (args.requests // len(names) + 1))[:args.requests]
+
+        for headers in ({}, {'Range': args.range}):
+            row = []
+            for _, view, serving in modes:
+                if serving:
+                    settings.MEDIA_SERVING = serving
+                row.append(occupancy(view, factory, names, headers))
+            label = 'да' if headers else 'нет'
+            print(f"{size:>6} {label:>6} " + ' '.join(f'{ms:>9.3f}' for ms in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Поиск по синтетическому корпусу объявлений: индекс (точный + нечёткий)
+против старой фильтрации подстрокой в Python.
+
+    python -m benchmarks.bench_search --ads 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import _django  # noqa: F401
+
+from django.db import transaction
+
+from ads.models import Ad, City
+from ads.search import get_search_backend
+from categories.models import Category
+
+WORDS = [
+    "сатылат", "продаю", "срочно", "арзан", "дешево", "тойота", "хонда", "камри", "приус",
+    "квартира", "үй", "жер", "участок", "такси", "оңой", "жол", "ош", "бишкек", "ноокат",
+    "кызмат", "ремонт", "телефон", "айфон", "самсунг", "балдар", "кийим", "өкүз", "уй",
+    "toyota", "honda", "arzan", "satylat", "kvartira", "taksi", "ongoy", "jol",
+    "керек", "ижарага", "аренда", "комната", "машина", "мотоцикл", "велосипед", "диван",
+]
+
+# Запрос -> как его набирают: транслит, опечатки, смешанный алфавит
+QUERIES = [
+    "тойота", "toyota", "тайота", "toyta", "kvartira", "квартра", "ongoy jol", "оңой",
+    "satylat ui", "айфон", "iphone", "ремонт телефон", "bishkek taksi", "диван арзан",
+]
+
+
+def build_corpus(ads_count, cities_count):
+    rng = random.Random(42)
+    cities = [City.objects.create(name=f"Город {i}") for i in range(cities_count)]
+    categories = [Category.objects.create(name_kg=f"Кат {i}", ru_name=f"Кат {i}") for i in range(8)]
+
+    through = Ad.cities.through
+    batch = 5000
+    with transaction.atomic():
+        for start in range(0, ads_count, batch):
+            ads = Ad.objects.bulk_create([
+                Ad(
+                    description=" ".join(rng.choices(WORDS, k=rng.randint(5, 25))),
+                    contact_phone=f"+996{rng.randint(500000000, 799999999)}",
+                    category=rng.choice(categories),
+                    is_paid=True,
+                )
+                for _ in range(min(batch, ads_count - start))
+            ])
+            through.objects.bulk_create([
+                through(ad_id=ad.id, city_id=rng.choice(cities).id) for ad in ads
+            ])
+        get_search_backend().rebuild()
+    return cities
+
+
+def legacy_search(query, city_id):
+    query = query.lower()
+    ads = Ad.objects.filter(cities__id=city_id).order_by('-created_at')
+    return [
+        ad.id for ad in ads
+        if query in (ad.description or '').lower() or query in (ad.contact_phone or '').lower()
+    ][:30]
+
+
+def measure(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ads", type=int, default=100000)
+    parser.add_argument("--cities", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    cities = build_corpus(args.ads, args.cities)
+    print(f"Корпус: {args.ads} объявлений, {args.cities} городов, индекс за {time.perf_counter() - started:.1f} c")
+
+    backend = get_search_backend()
+    city_id = cities[0].id
+    print(f"Бэкенд: {backend.__class__.__name__}\n")
+    print(f"{'запрос':<20} {'индекс p50':>11} {'индекс max':>11} {'найдено':>8} {'python p50':>11} {'найдено':>8}")
+
+    all_timings = []
+    for query in QUERIES:
+        timings, ids = measure(lambda: backend.search(query, city_id=city_id), args.repeat)
+        legacy_timings, legacy_ids = measure(lambda: legacy_search(query, city_id), 1)
+        all_timings += timings
+        print(
+            f"{query:<20} {statistics.median(timings):>9.1f}ms {max(timings):>9.1f}ms {len(ids):>8}"
+            f" {statistics.median(legacy_timings):>9.1f}ms {len(legacy_ids):>8}"
+        )
+
+    all_timings.sort()
+    p95 = all_timings[int(len(all_timings) * 0.95) - 1]
+    print(f"\nИндекс: p50 {statistics.median(all_timings):.1f}ms, p95 {p95:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
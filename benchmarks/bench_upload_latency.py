@@ -0,0 +1,80 @@
+"""
+Время ответа на создание объявления в зависимости от числа фото: прежний
+цикл (каждое фото сжимается по очереди и вставляется отдельным create с
+сигналами) против ads/image_jobs.save_ad_photos (сжатие и производные в
+общем пуле процессов, один bulk_create).
+
+    python -m benchmarks.bench_upload_latency --counts 1 2 4 8 --repeat 3
+    python -m benchmarks.bench_upload_latency --workers 8
+
+Выигрыш ограничен числом ядер: на одном ядре пул не создаётся и оба
+варианта сжимают последовательно.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import _django  # noqa: F401
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from ads.image_jobs import save_ad_photos
+from ads.images import process_pool, process_upload
+from ads.models import Ad, AdPhoto, City, MediaBlob
+from benchmarks.bench_compress_image import SIZES, synthetic_photo
+from categories.models import Category
+
+
+def legacy_save(ad, uploads):
+    """Цикл из CreateAdView до общего пула."""
+    for upload in uploads:
+        AdPhoto.objects.create(ad=ad, image=process_upload(upload, 'ads'))
+
+
+def measure(func, corpus, count, repeat, category, city):
+    timings = []
+    for _ in range(repeat):
+        uploads = [
+            SimpleUploadedFile(f'photo_{i}.jpg', data, content_type='image/jpeg')
+            for i, data in enumerate(corpus[:count])
+        ]
+        # Без этого следующий проход найдёт уже сжатые байты и готовые производные
+        MediaBlob.objects.update(source_sha256=None, variants={})
+        ad = Ad.objects.create(description='bench', contact_phone='+996700000000', category=category)
+        ad.cities.set([city])
+        started = time.perf_counter()
+        func(ad, uploads)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='Размер пула (по умолчанию AD_IMAGE_POOL_WORKERS)')
+    args = parser.parse_args()
+
+    if args.workers:
+        settings.AD_IMAGE_POOL_WORKERS = args.workers
+    settings.AD_IMAGE_PROCESSING = 'sync'
+    rng = random.Random(42)
+    corpus = [synthetic_photo(rng, *SIZES[i % len(SIZES)]) for i in range(max(args.counts))]
+    category = Category.objects.create(name_kg='bench', ru_name='bench')
+    city = City.objects.create(name='bench')
+    if settings.AD_IMAGE_POOL_WORKERS > 1:
+        # Запуск процессов пула не входит в замер: пул живёт между запросами
+        process_pool().submit(sum, []).result()
+
+    print(f"Ядер в пуле: {settings.AD_IMAGE_POOL_WORKERS}, повторов: {args.repeat}")
+    print(f"{'фото':>5} {'legacy, ms':>12} {'pool, ms':>10} {'ускорение':>10}")
+    for count in args.counts:
+        legacy = measure(legacy_save, corpus, count, args.repeat, category, city)
+        pooled = measure(save_ad_photos, corpus, count, args.repeat, category, city)
+        print(f"{count:>5} {legacy:>12.0f} {pooled:>10.0f} {legacy / pooled:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
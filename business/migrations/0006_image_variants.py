@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0005_alter_businesscard_theme_color_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businesscard',
+            name='header_photo_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='businesscard',
+            name='profile_photo_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='businesscatalogitem',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='businessphoto',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:52
+
+import ads.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0006_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='businesscard',
+            name='header_photo',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.media_storage, upload_to='business/header_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='businesscard',
+            name='profile_photo',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.media_storage, upload_to='business/profile_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='businesscatalogitem',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.media_storage, upload_to='business/catalog_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='businessphoto',
+            name='image',
+            field=models.ImageField(storage=ads.storage.media_storage, upload_to='business/carousel_photos/'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:10
+
+import ads.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0007_media_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='businesscard',
+            name='header_photo',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.media_storage, upload_to=ads.storage.ShardedUploadTo('business/header_photos')),
+        ),
+        migrations.AlterField(
+            model_name='businesscard',
+            name='profile_photo',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.media_storage, upload_to=ads.storage.ShardedUploadTo('business/profile_photos')),
+        ),
+        migrations.AlterField(
+            model_name='businesscatalogitem',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.media_storage, upload_to=ads.storage.ShardedUploadTo('business/catalog_photos')),
+        ),
+        migrations.AlterField(
+            model_name='businesscategory',
+            name='icon',
+            field=models.ImageField(blank=True, null=True, upload_to=ads.storage.ShardedUploadTo('business/category_icons')),
+        ),
+        migrations.AlterField(
+            model_name='businessphoto',
+            name='image',
+            field=models.ImageField(storage=ads.storage.media_storage, upload_to=ads.storage.ShardedUploadTo('business/carousel_photos')),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from ads.models import City
+from ads.storage import ShardedUploadTo, media_storage
 from datetime import time
 from colorfield.fields import ColorField
 
@@ -19,7 +20,7 @@ class BusinessCategory(models.Model):
     name_kg = models.CharField(max_length=255)
     name_ru = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
-    icon = models.ImageField(upload_to='business/category_icons/', blank=True, null=True)
+    icon = models.ImageField(upload_to=ShardedUploadTo('business/category_icons'), blank=True, null=True)
     gradient_start = ColorField(default="#000000")
     gradient_end = ColorField(default="#FFFFFF")
 
@@ -35,8 +36,11 @@ class BusinessCard(models.Model):
     name = models.CharField(max_length=255)
     short_description = models.CharField(max_length=500, blank=True, null=True)
     long_description = models.TextField(blank=True, null=True)
-    profile_photo = models.ImageField(upload_to='business/profile_photos/', blank=True, null=True)
-    header_photo = models.ImageField(upload_to='business/header_photos/', blank=True, null=True)
+    profile_photo = models.ImageField(upload_to=ShardedUploadTo('business/profile_photos'), storage=media_storage, blank=True, null=True)
+    header_photo = models.ImageField(upload_to=ShardedUploadTo('business/header_photos'), storage=media_storage, blank=True, null=True)
+    # Уменьшенные копии WebP/JPEG (ads/images.py)
+    profile_photo_variants = models.JSONField(default=dict, blank=True)
+    header_photo_variants = models.JSONField(default=dict, blank=True)
     cta_phone = models.CharField(max_length=20)  # номер для услуги
     additional_phone = models.CharField(max_length=20, blank=True, null=True)
     management_phone = models.CharField(max_length=20, blank=True, null=True)
@@ -82,7 +86,8 @@ class BusinessSchedule(models.Model):
 class BusinessPhoto(models.Model):
     """Дополнительные фото для карусели"""
     business = models.ForeignKey(BusinessCard, on_delete=models.CASCADE, related_name='carousel_photos')
-    image = models.ImageField(upload_to='business/carousel_photos/')
+    image = models.ImageField(upload_to=ShardedUploadTo('business/carousel_photos'), storage=media_storage)
+    image_variants = models.JSONField(default=dict, blank=True)
     position = models.IntegerField(default=0)
 
     class Meta:
@@ -94,7 +99,8 @@ class BusinessCatalogItem(models.Model):
     business = models.ForeignKey(BusinessCard, on_delete=models.CASCADE, related_name='catalog_items')
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
-    photo = models.ImageField(upload_to='business/catalog_photos/', blank=True, null=True)
+    photo = models.ImageField(upload_to=ShardedUploadTo('business/catalog_photos'), storage=media_storage, blank=True, null=True)
+    photo_variants = models.JSONField(default=dict, blank=True)
     price = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     position = models.IntegerField(default=0)
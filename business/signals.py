@@ -0,0 +1,53 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ads.images import ensure_variants
+from .models import BusinessCard, BusinessCatalogItem, BusinessCategory, BusinessPhoto, BusinessSchedule
+
+
+def touch_cards(card_ids):
+    """
+    Поднимает updated_at карточек: по нему считается ETag списка карточек
+    (business/views.py), а у фото, каталога, расписаний и категорий своей
+    отметки времени нет. Пишется через update(), без повторного post_save.
+    """
+    BusinessCard.objects.filter(pk__in=card_ids).update(updated_at=timezone.now())
+
+
+# Производные WebP/JPEG пересобираются, только когда сменился исходный файл
+
+@receiver(post_save, sender=BusinessCard)
+def build_card_variants(sender, instance, **kwargs):
+    changed = ensure_variants(instance, 'profile_photo')
+    changed = ensure_variants(instance, 'header_photo') or changed
+    if changed:
+        # *_variants записаны update() уже после auto_now
+        touch_cards([instance.pk])
+
+
+@receiver(post_save, sender=BusinessPhoto)
+def build_business_photo_variants(sender, instance, **kwargs):
+    ensure_variants(instance, 'image')
+
+
+@receiver(post_save, sender=BusinessCatalogItem)
+def build_catalog_item_variants(sender, instance, **kwargs):
+    ensure_variants(instance, 'photo')
+
+
+@receiver(post_save, sender=BusinessPhoto)
+@receiver(post_save, sender=BusinessCatalogItem)
+@receiver(post_save, sender=BusinessSchedule)
+@receiver(post_delete, sender=BusinessPhoto)
+@receiver(post_delete, sender=BusinessCatalogItem)
+@receiver(post_delete, sender=BusinessSchedule)
+def touch_card_of_child(sender, instance, **kwargs):
+    touch_cards([instance.business_id])
+
+
+@receiver(post_save, sender=BusinessCategory)
+@receiver(pre_delete, sender=BusinessCategory)
+def touch_cards_of_category(sender, instance, **kwargs):
+    # pre_delete: после удаления category_id карточек обнулит SET_NULL, их уже не найти
+    instance.business_cards.update(updated_at=timezone.now())
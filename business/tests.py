@@ -1,3 +1,187 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from ads.models import City
+from ads.testing import noise_jpeg
+from users.models import User
+
+from .models import BusinessCard, BusinessCatalogItem, BusinessCategory, BusinessPhoto, BusinessSchedule
+from .views import NOT_AN_IMAGE
+
+
+def solid_jpeg(size):
+    output = io.BytesIO()
+    Image.new('RGB', size, (200, 80, 40)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def gradient_png(size):
+    output = io.BytesIO()
+    Image.linear_gradient('L').resize(size).convert('RGB').save(output, format='PNG')
+    return output.getvalue()
+
+
+class BusinessVariantTests(TestCase):
+    """Производные WebP/JPEG фото карточки, карусели и каталога строятся сигналами post_save."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = BusinessCategory.objects.create(name_kg='Кафе', name_ru='Кафе')
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.card = BusinessCard.objects.create(
+            city=self.city, category=self.category, name='Дасторкон', cta_phone='+996555123456',
+            profile_photo=SimpleUploadedFile('logo.jpg', solid_jpeg((600, 600))),
+        )
+
+    def test_card_photos(self):
+        card = BusinessCard.objects.get(pk=self.card.pk)
+        self.assertEqual(card.profile_photo_variants['src'], card.profile_photo.name)
+        self.assertEqual(list(card.profile_photo_variants['sizes']), ['160', '480'])
+        self.assertEqual(card.header_photo_variants, {})
+
+        card.header_photo = SimpleUploadedFile('header.jpg', solid_jpeg((1600, 400)))
+        card.save()
+        card.refresh_from_db()
+        self.assertEqual(card.header_photo_variants['src'], card.header_photo.name)
+        self.assertEqual(list(card.header_photo_variants['sizes']), ['160', '480', '1080'])
+
+    def test_carousel_and_catalog_photos(self):
+        photo = BusinessPhoto.objects.create(business=self.card,
+                                             image=SimpleUploadedFile('a.jpg', solid_jpeg((800, 600))))
+        item = BusinessCatalogItem.objects.create(business=self.card, name='Лагман',
+                                                  photo=SimpleUploadedFile('b.jpg', solid_jpeg((200, 200))))
+        self.assertEqual(list(BusinessPhoto.objects.get(pk=photo.pk).image_variants['sizes']), ['160', '480'])
+        self.assertEqual(set(BusinessCatalogItem.objects.get(pk=item.pk).photo_variants['sizes']['160']),
+                         {'webp', 'jpeg'})
+
+        # Фото каталога сняли — описание производных очищается
+        item.photo = None
+        item.save()
+        self.assertEqual(BusinessCatalogItem.objects.get(pk=item.pk).photo_variants, {})
+
+
+@override_settings(IMAGE_UPLOAD_POLICIES={
+    'business': {'max_edge': 800, 'target_size': 150 * 1024},
+    'icons': {'max_edge': 256, 'format': 'PNG'},
+})
+class BusinessUploadTests(TestCase):
+    """Загрузки модератора пережимаются по IMAGE_UPLOAD_POLICIES, не-изображения отклоняются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.moderator = User.objects.create_user(phone='+996555000111', name='Мод', role='moderator')
+        cls.token = Token.objects.create(user=cls.moderator)
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.card = BusinessCard.objects.create(city=self.city, name='Дасторкон', cta_phone='+996555123456')
+
+    def mod_post(self, path, data):
+        return self.client.post(path, data, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_photos_recompressed_in_order(self):
+        response = self.mod_post(f'/business/mod/cards/{self.card.pk}/photos/add/', {'images': [
+            SimpleUploadedFile('wide.jpg', noise_jpeg((2000, 1000))),
+            SimpleUploadedFile('tall.png', gradient_png((600, 1200))),
+        ]})
+        self.assertEqual(response.status_code, 201)
+        sizes = []
+        for photo_id in response.json()['created_ids']:
+            image = BusinessPhoto.objects.get(pk=photo_id).image
+            self.assertLessEqual(image.size, 150 * 1024)
+            with Image.open(image.path) as img:
+                self.assertEqual(img.format, 'JPEG')
+                self.assertFalse(img.getexif())
+                sizes.append(img.size)
+        self.assertEqual(sizes, [(800, 400), (400, 800)])
+
+    def test_icon_stays_png_with_alpha(self):
+        icon = io.BytesIO()
+        Image.new('RGBA', (1024, 1024), (255, 0, 0, 0)).save(icon, format='PNG')
+        response = self.mod_post('/business/mod/categories/create/', {
+            'name_kg': 'Кафе', 'name_ru': 'Кафе', 'icon': SimpleUploadedFile('icon.png', icon.getvalue()),
+        })
+        self.assertEqual(response.status_code, 201)
+        with Image.open(BusinessCategory.objects.get(pk=response.json()['id']).icon.path) as img:
+            self.assertEqual((img.format, img.mode, img.size), ('PNG', 'RGBA', (256, 256)))
+            self.assertEqual(img.getpixel((0, 0))[3], 0)
+
+    def test_not_an_image_rejected(self):
+        # Заголовок цел, данные обрезаны: загрузчик пропускает, Pillow не декодирует
+        broken = SimpleUploadedFile('photo.jpg', noise_jpeg((400, 400))[:2000])
+        response = self.mod_post(f'/business/mod/cards/{self.card.pk}/photos/add/', {'images': [broken]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), NOT_AN_IMAGE)
+        self.assertFalse(BusinessPhoto.objects.exists())
+
+        # Файл без заголовка изображения отклоняет уже ImageUploadHandler
+        response = self.mod_post('/business/mod/cards/create/', {
+            'city_id': self.city.id, 'name': 'Чайхана',
+            'profile_photo': SimpleUploadedFile('logo.jpg', b'not an image'),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BusinessCard.objects.filter(name='Чайхана').exists())
+
+
+class BusinessCardEtagTests(TestCase):
+    """ETag списка карточек меняется при правке фото, каталога, расписаний и категорий."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='Ноокат')
+        cls.category = BusinessCategory.objects.create(name_kg='Кафе', name_ru='Кафе')
+        cls.moderator = User.objects.create_user(phone='+996555000111', name='Мод', role='moderator')
+        cls.token = Token.objects.create(user=cls.moderator)
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.card = BusinessCard.objects.create(city=self.city, category=self.category, name='Дасторкон',
+                                                cta_phone='+996555123456')
+
+    def etag(self, **params):
+        response = self.client.get('/business/cards/', params)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assertEtagChanges(self, change, **params):
+        before = self.etag(**params)
+        change()
+        self.assertNotEqual(self.etag(**params), before)
+
+    def mod_post(self, path, data):
+        response = self.client.post(path, json.dumps(data), content_type='application/json',
+                                    HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_children_change_etag(self):
+        photo = BusinessPhoto(business=self.card, position=1)
+        photo.image.save('a.jpg', SimpleUploadedFile('a.jpg', noise_jpeg((64, 64))), save=False)
+        self.assertEtagChanges(photo.save)
+        self.assertEtagChanges(lambda: BusinessCatalogItem.objects.create(business=self.card, name='Плов'))
+        self.assertEtagChanges(lambda: BusinessSchedule.objects.create(business=self.card, day_of_week=0))
+        self.assertEtagChanges(photo.delete)
+
+    def test_bulk_writes_change_etag(self):
+        first, second = BusinessPhoto.objects.bulk_create([
+            BusinessPhoto(business=self.card, image=f'business/carousel_photos/{name}.jpg', position=position)
+            for position, name in enumerate('ab', 1)
+        ])
+        self.assertEtagChanges(lambda: self.mod_post(f'/business/mod/cards/{self.card.pk}/photos/reorder/',
+                                                     {'order': [second.id, first.id]}))
+        self.assertEtagChanges(lambda: self.mod_post(f'/business/mod/cards/{self.card.pk}/schedules/set/',
+                                                     {'schedules': [{'day_of_week': 1, 'is_closed': True}]}))
+
+    def test_category_delete_changes_filtered_etag(self):
+        # Карточки категории уходят из выборки через SET_NULL, без post_save карточек
+        self.assertEtagChanges(self.category.delete, city_id=self.city.id)
+        self.assertIsNone(BusinessCard.objects.get(pk=self.card.pk).category_id)
@@ -10,6 +10,13 @@ from .models import (
     BusinessCatalogItem,
 )
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from ads.utils import queryset_etag
+from ads.projections import media_prefix, srcset_map
+from ads.images import UPLOAD_ERRORS, process_uploads
+from ads.placeholders import placeholder_of
+from .signals import touch_cards
 import json
 from django.db import models
 
@@ -23,6 +30,28 @@ def abs_url(request, file_field):
         return None
 
 
+def abs_srcset(request, variants):
+    """Уменьшенные копии фото: {'webp': {'160': url, ...}, 'jpeg': {...}}."""
+    return srcset_map(variants, media_prefix(request))
+
+
+NOT_AN_IMAGE = {"error": "Файл не является изображением"}
+
+
+def processed_files(request, fields, policy="business"):
+    """
+    Уменьшенные и пережатые копии файлов из request.FILES для тех полей
+    fields, что пришли в запросе: {поле: ContentFile}. None — один из
+    файлов не читается как изображение.
+    """
+    present = [f for f in fields if f in request.FILES]
+    try:
+        processed = process_uploads([request.FILES[f] for f in present], policy)
+    except UPLOAD_ERRORS:
+        return None
+    return dict(zip(present, processed))
+
+
 class BusinessCategoryListView(APIView):
     permission_classes = [AllowAny]
 
@@ -66,17 +95,19 @@ class ModBusinessCategoryCreateView(APIView):
         name_ru = request.data.get("name_ru")
         gradient_start = request.data.get("gradient_start")
         gradient_end = request.data.get("gradient_end")
-        icon = request.FILES.get("icon")
 
         if not name_kg or not name_ru:
             return Response({"error": "name_kg и name_ru обязательны"}, status=400)
+        files = processed_files(request, ["icon"], policy="icons")
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
 
         cat = BusinessCategory.objects.create(
             name_kg=name_kg,
             name_ru=name_ru,
             gradient_start=gradient_start or "#000000",
             gradient_end=gradient_end or "#FFFFFF",
-            icon=icon,
+            icon=files.get("icon"),
         )
         return Response({"id": cat.id}, status=201)
 
@@ -92,8 +123,11 @@ class ModBusinessCategoryUpdateView(APIView):
             cat.gradient_start = request.data.get("gradient_start") or cat.gradient_start
         if "gradient_end" in request.data:
             cat.gradient_end = request.data.get("gradient_end") or cat.gradient_end
-        if "icon" in request.FILES:
-            cat.icon = request.FILES["icon"]
+        files = processed_files(request, ["icon"], policy="icons")
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
+        if "icon" in files:
+            cat.icon = files["icon"]
         cat.save()
         return Response({"message": "updated"})
 
@@ -154,10 +188,11 @@ class ModBusinessCardCreateView(APIView):
             setattr(card, "theme_color", theme_color)
 
         # photos
-        if "profile_photo" in request.FILES:
-            card.profile_photo = request.FILES["profile_photo"]
-        if "header_photo" in request.FILES:
-            card.header_photo = request.FILES["header_photo"]
+        files = processed_files(request, ["profile_photo", "header_photo"])
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
+        for field, photo in files.items():
+            setattr(card, field, photo)
 
         card.save()
         return Response({"pk": card.pk}, status=201)
@@ -195,10 +230,11 @@ class ModBusinessCardUpdateView(APIView):
         if "theme_color" in request.data:
             setattr(card, "theme_color", request.data.get("theme_color"))
 
-        if "profile_photo" in request.FILES:
-            card.profile_photo = request.FILES["profile_photo"]
-        if "header_photo" in request.FILES:
-            card.header_photo = request.FILES["header_photo"]
+        files = processed_files(request, ["profile_photo", "header_photo"])
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
+        for field, photo in files.items():
+            setattr(card, field, photo)
 
         card.save()
         return Response({"message": "updated"})
@@ -249,6 +285,8 @@ class ModBusinessScheduleSetView(APIView):
         # bulk create requires model instances
         from .models import BusinessSchedule
         BusinessSchedule.objects.bulk_create([BusinessSchedule(**x) for x in to_create])
+        # bulk_create не шлёт post_save — ETag списка карточек поднимаем сами
+        touch_cards([card.pk])
         return Response({"message": "schedules set", "count": len(to_create)})
 
 
@@ -260,12 +298,17 @@ class ModBusinessPhotoAddView(APIView):
         files = request.FILES.getlist("images") or request.FILES.getlist("image")
         if not files:
             return Response({"error": "Пришлите files=images[]"}, status=400)
+        try:
+            # Файлы одного запроса сжимаются параллельно
+            images = process_uploads(files, "business")
+        except UPLOAD_ERRORS:
+            return Response(NOT_AN_IMAGE, status=400)
         created = []
         # append photos to the end based on current max position
         current_max = BusinessPhoto.objects.filter(business=card).aggregate(m=models.Max("position")).get("m") or 0
         pos = current_max + 1
-        for f in files:
-            p = BusinessPhoto.objects.create(business=card, image=f, position=pos)
+        for image in images:
+            p = BusinessPhoto.objects.create(business=card, image=image, position=pos)
             created.append(p.id)
             pos += 1
         return Response({"created_ids": created}, status=201)
@@ -287,7 +330,10 @@ class ModBusinessPhotoReplaceView(APIView):
         p = get_object_or_404(BusinessPhoto, pk=photo_id)
         if "image" not in request.FILES:
             return Response({"error": "Пришлите image файл"}, status=400)
-        p.image = request.FILES["image"]
+        files = processed_files(request, ["image"])
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
+        p.image = files["image"]
         p.save()
         return Response({"message": "replaced"})
 
@@ -311,6 +357,7 @@ class ModBusinessPhotosReorderView(APIView):
         for p in photos:
             p.position = pos_map.get(p.id, p.position)
         BusinessPhoto.objects.bulk_update(photos, ["position"])
+        touch_cards([card.pk])
         return Response({"message": "reordered", "count": photos.count()})
 
 
@@ -331,8 +378,11 @@ class ModBusinessCatalogItemAddView(APIView):
             price=request.data.get("price"),
             position=current_max + 1,
         )
-        if "photo" in request.FILES:
-            item.photo = request.FILES["photo"]
+        files = processed_files(request, ["photo"])
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
+        if "photo" in files:
+            item.photo = files["photo"]
         item.save()
         return Response({"id": item.id}, status=201)
 
@@ -350,8 +400,11 @@ class ModBusinessCatalogItemUpdateView(APIView):
                 item.position = int(request.data.get("position"))
             except Exception:
                 return Response({"error": "position должен быть числом"}, status=400)
-        if "photo" in request.FILES:
-            item.photo = request.FILES["photo"]
+        files = processed_files(request, ["photo"])
+        if files is None:
+            return Response(NOT_AN_IMAGE, status=400)
+        if "photo" in files:
+            item.photo = files["photo"]
         item.save()
         return Response({"message": "updated"})
 
@@ -386,6 +439,7 @@ class ModBusinessCatalogReorderView(APIView):
         for it in items:
             it.position = pos_map.get(it.id, it.position)
         BusinessCatalogItem.objects.bulk_update(items, ["position"])
+        touch_cards([card.pk])
         return Response({"message": "reordered", "count": items.count()})
 
 
@@ -419,7 +473,9 @@ class BusinessCardDetailByPkView(APIView):
             "short_description": b.short_description,
             "long_description": b.long_description,
             "profile_photo": abs_url(request, b.profile_photo),
+            "profile_photo_srcset": abs_srcset(request, b.profile_photo_variants),
             "header_photo": abs_url(request, b.header_photo),
+            "header_photo_srcset": abs_srcset(request, b.header_photo_variants),
             "theme_color": getattr(b, "theme_color", None),
             "cta_phone": b.cta_phone,
             "additional_phone": b.additional_phone,
@@ -438,6 +494,8 @@ class BusinessCardDetailByPkView(APIView):
             "photos": [
                 {
                     "url": abs_url(request, p.image),
+                    "srcset": abs_srcset(request, p.image_variants),
+                    "placeholder": placeholder_of(p.image_variants),
                     "pos_id": p.position,
                     "image_id": p.id,
                 }
@@ -449,6 +507,8 @@ class BusinessCardDetailByPkView(APIView):
                     "name": ci.name,
                     "description": ci.description,
                     "photo": abs_url(request, ci.photo),
+                    "photo_srcset": abs_srcset(request, ci.photo_variants),
+                    "photo_placeholder": placeholder_of(ci.photo_variants),
                     "price": ci.price,
                     "created_at": ci.created_at.isoformat() if ci.created_at else None,
                 }
@@ -459,18 +519,27 @@ class BusinessCardDetailByPkView(APIView):
         return Response(data)
 
 
+def filter_business_cards(qs, params):
+    city_id = params.get("city_id")
+    category_id = params.get("category_id")
+    if city_id:
+        qs = qs.filter(city_id=city_id)
+    if category_id:
+        qs = qs.filter(category_id=category_id)
+    return qs
+
+
+def business_cards_etag(request):
+    return "cards-" + queryset_etag(filter_business_cards(BusinessCard.objects.all(), request.GET))
+
+
+@method_decorator(condition(etag_func=business_cards_etag), name="get")
 class BusinessCardListView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
         qs = BusinessCard.objects.select_related("city", "category").all().order_by("-created_at")
-
-        city_id = request.query_params.get("city_id")
-        category_id = request.query_params.get("category_id")
-        if city_id:
-            qs = qs.filter(city_id=city_id)
-        if category_id:
-            qs = qs.filter(category_id=category_id)
+        qs = filter_business_cards(qs, request.query_params)
 
         data = []
         for b in qs:
@@ -480,6 +549,7 @@ class BusinessCardListView(APIView):
                     "name": b.name,
                     "short_description": b.short_description,
                     "profile_photo": abs_url(request, b.profile_photo),
+                    "profile_photo_srcset": abs_srcset(request, b.profile_photo_variants),
                 }
             )
 
@@ -505,7 +575,9 @@ class BusinessCardDetailView(APIView):
             "short_description": b.short_description,
             "long_description": b.long_description,
             "profile_photo": abs_url(request, b.profile_photo),
+            "profile_photo_srcset": abs_srcset(request, b.profile_photo_variants),
             "header_photo": abs_url(request, b.header_photo),
+            "header_photo_srcset": abs_srcset(request, b.header_photo_variants),
             "theme_color": getattr(b, "theme_color", None),
             "cta_phone": b.cta_phone,
             "additional_phone": b.additional_phone,
@@ -522,12 +594,16 @@ class BusinessCardDetailView(APIView):
             "created_at": b.created_at.isoformat() if b.created_at else None,
             "updated_at": b.updated_at.isoformat() if b.updated_at else None,
             "photos": [abs_url(request, p.image) for p in b.carousel_photos.all()],
+            "photos_srcset": [abs_srcset(request, p.image_variants) for p in b.carousel_photos.all()],
+            "photos_placeholders": [placeholder_of(p.image_variants) for p in b.carousel_photos.all()],
             "catalog_items": [
                 {
                     "id": ci.id,
                     "name": ci.name,
                     "description": ci.description,
                     "photo": abs_url(request, ci.photo),
+                    "photo_srcset": abs_srcset(request, ci.photo_variants),
+                    "photo_placeholder": placeholder_of(ci.photo_variants),
                     "price": ci.price,
                     "created_at": ci.created_at.isoformat() if ci.created_at else None,
                 }
@@ -545,6 +621,8 @@ class BusinessPhotosByCardView(APIView):
         data = [
             {
                 "url": abs_url(request, p.image),
+                "srcset": abs_srcset(request, p.image_variants),
+                "placeholder": placeholder_of(p.image_variants),
                 "pos_id": p.position,
                 "image_id": p.id,
             }
@@ -564,6 +642,8 @@ class BusinessCatalogItemsByCardView(APIView):
                 "name": i.name,
                 "description": i.description,
                 "photo": abs_url(request, i.photo),
+                "photo_srcset": abs_srcset(request, i.photo_variants),
+                "photo_placeholder": placeholder_of(i.photo_variants),
                 "price": i.price,
                 "created_at": i.created_at.isoformat() if i.created_at else None,
             }
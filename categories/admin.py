@@ -1,7 +1,16 @@
 from django.contrib import admin
+from ads.images import process_upload
 from .models import Category, CityBoard, PinnedMessage, Contacts
 # Register your models here.
 admin.site.register(Category)
-admin.site.register(CityBoard)
 admin.site.register(PinnedMessage)
-admin.site.register(Contacts)
\ No newline at end of file
+admin.site.register(Contacts)
+
+
+@admin.register(CityBoard)
+class CityBoardAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        # Логотип пережимается по той же политике, что иконки категорий бизнеса
+        if "logo" in form.changed_data and form.cleaned_data.get("logo"):
+            obj.logo = process_upload(form.cleaned_data["logo"], "icons")
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:36
+
+from django.db import migrations, models
+
+
+def set_ride_lifetime(apps, schema_editor):
+    # Раньше срок был зашит в Ad.is_expired(): «попутка» — 5 дней, остальные — 30
+    Category = apps.get_model('categories', 'Category')
+    # Сравнение в Python: LIKE в SQLite не знает регистра кириллицы
+    ride_ids = [
+        category.id for category in Category.objects.all()
+        if category.ru_name.lower() == 'попутка'
+    ]
+    Category.objects.filter(id__in=ride_ids).update(lifetime_days=5)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0006_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='lifetime_days',
+            field=models.PositiveIntegerField(default=30),
+        ),
+        migrations.RunPython(set_ride_lifetime, migrations.RunPython.noop),
+    ]
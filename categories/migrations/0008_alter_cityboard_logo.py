@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:10
+
+import ads.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0007_category_lifetime_days'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cityboard',
+            name='logo',
+            field=models.ImageField(blank=True, null=True, upload_to=ads.storage.ShardedUploadTo('city_logos')),
+        ),
+    ]
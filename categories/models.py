@@ -1,9 +1,13 @@
 from django.db import models
+from ads.storage import ShardedUploadTo
 
 class Category(models.Model):
     name_kg = models.CharField(max_length=255)  # кыргызское название
     ru_name = models.CharField(max_length=255)  # русское название
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+    # Сколько дней объявление категории живёт в ленте (Ad.expires_at)
+    lifetime_days = models.PositiveIntegerField(default=30)
 
     def __str__(self):
         return self.name_kg
@@ -26,7 +30,7 @@ class Contacts(models.Model):
 
 class CityBoard(models.Model):
     city = models.CharField(max_length=255, unique=True)
-    logo = models.ImageField(upload_to='city_logos/', null=True, blank=True)
+    logo = models.ImageField(upload_to=ShardedUploadTo('city_logos'), null=True, blank=True)
     is_active = models.BooleanField(default=True)
     playmarket_link = models.URLField(blank=True, null=True)
     appstore_link = models.URLField(blank=True, null=True)
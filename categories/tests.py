@@ -1,3 +1,40 @@
-from django.test import TestCase
+import io
+import tempfile
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from users.models import User
+from .models import CityBoard
+
+
+class CityBoardAdminTests(TestCase):
+    """Логотип доски из админки пережимается по политике icons и остаётся PNG."""
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.request = RequestFactory().post('/admin/categories/cityboard/add/')
+        self.request.user = User.objects.create_superuser(phone='+996555000999', name='Админ')
+        self.model_admin = site._registry[CityBoard]
+
+    def save(self, logo):
+        form = self.model_admin.get_form(self.request)({'city': 'Ноокат', 'is_active': True}, {'logo': logo})
+        if not form.is_valid():
+            return form
+        board = form.save(commit=False)
+        self.model_admin.save_model(self.request, board, form, change=False)
+        return board
+
+    def test_logo_downscaled_png_with_alpha(self):
+        logo = io.BytesIO()
+        Image.new('RGBA', (2048, 1024), (0, 128, 255, 0)).save(logo, format='PNG')
+        board = self.save(SimpleUploadedFile('logo.png', logo.getvalue()))
+        with Image.open(CityBoard.objects.get(pk=board.pk).logo.path) as img:
+            self.assertEqual((img.format, img.mode, img.size), ('PNG', 'RGBA', (512, 256)))
+
+    def test_not_an_image_rejected(self):
+        form = self.save(SimpleUploadedFile('logo.png', b'not an image'))
+        self.assertIn('logo', form.errors)
+        self.assertFalse(CityBoard.objects.exists())
@@ -9,10 +9,19 @@ from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from django.db import models
 from django.db.models import Q
 
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
 from ads.models import City
+from ads.utils import queryset_etag
 from rest_framework import status
 
 
+def category_list_etag(request):
+    return 'categories-' + queryset_etag(Category.objects.all())
+
+
+@method_decorator(condition(etag_func=category_list_etag), name='get')
 class CategoryListView(APIView):
     def get(self, request):
         categories = Category.objects.all()
@@ -163,7 +163,108 @@ AUTH_USER_MODEL = 'users.User'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Префикс ссылок на фото в ответах API (CDN), например https://cdn.example.kg/media/.
+# Пусто — абсолютный MEDIA_URL на хосте запроса.
+MEDIA_BASE_URL = os.environ.get('MEDIA_BASE_URL', '')
+# Кто отдаёт байты файлов MEDIA_URL (ads/media_serving.py): python — сам
+# воркер, accel — nginx по X-Accel-Redirect, sendfile — Apache/lighttpd по X-Sendfile
+MEDIA_SERVING = os.environ.get('MEDIA_SERVING', 'python')
+# internal location nginx, в котором alias указывает на MEDIA_ROOT
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Кэширование файлов вне blobs/ (иконки, логотипы); blobs/ — immutable на год
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', str(60 * 60)))
+
+# Кэш первых страниц публичной ленты (ads.feed_cache): file | redis | locmem.
+# locmem живёт в памяти одного процесса — каждый воркер держит свою копию
+# страниц; годится только для одного процесса.
+FEED_CACHE_BACKEND = os.environ.get('FEED_CACHE_BACKEND', 'file')
+FEED_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feeds',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'feeds'),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'feeds': FEED_CACHE_BACKENDS[FEED_CACHE_BACKEND],
+}
+FEED_CACHE_PAGES = 2
+FEED_CACHE_TIMEOUT = 60 * 60
+
+# Наибольший limit страницы ленты: больший запрос обрезается до него
+MAX_FEED_LIMIT = int(os.environ.get('MAX_FEED_LIMIT', '100'))
+
+# Сколько дней хранится журнал удалений для ads/sync — самое длинное окно,
+# за которое клиент может синхронизироваться без полной перезагрузки ленты
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Не показывать в публичных лентах объявления с истекшим expires_at, не дожидаясь
+# ночной очистки. Счётчики AdCounter учитывают их до удаления.
+HIDE_EXPIRED_ADS = os.environ.get('HIDE_EXPIRED_ADS', '0') == '1'
+
+# Прогресс пакетной очистки истекших объявлений (ads/cleanup.py)
+EXPIRY_CLEANUP_CHECKPOINT = os.path.join(BASE_DIR, 'cache', 'expiry_cleanup.json')
+
+# Прогресс переноса файлов в подкаталоги prefix/ab/cd/ (shard_media)
+MEDIA_SHARD_CHECKPOINT = os.path.join(BASE_DIR, 'cache', 'media_shard.json')
+
+# Длинная сторона загружаемых фото объявлений после сжатия (ads/images.py)
+AD_IMAGE_MAX_EDGE = int(os.environ.get('AD_IMAGE_MAX_EDGE', '1600'))
+# 'sync' — сжимать фото в запросе, 'async' — сохранить исходник и сжать
+# в process_image_jobs (ads/image_jobs.py)
+AD_IMAGE_PROCESSING = os.environ.get('AD_IMAGE_PROCESSING', 'sync')
+# Процессов в общем пуле сжатия фото одной загрузки (ads/images.process_pool).
+# Пул свой у каждого процесса веб-сервера: при нескольких воркерах gunicorn
+# имеет смысл уменьшить. 1 — сжимать в самом запросе.
+AD_IMAGE_POOL_WORKERS = int(os.environ.get('AD_IMAGE_POOL_WORKERS', str(os.cpu_count() or 1)))
+
+# Приём загрузок (ads/uploads.py): файлы пишутся во временные файлы, формат
+# и размеры в пикселях проверяются по заголовку до декодирования
+FILE_UPLOAD_HANDLERS = ['ads.uploads.ImageUploadHandler']
+UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE_MB', '25')) * 1024 * 1024
+UPLOAD_MAX_REQUEST_SIZE = int(os.environ.get('UPLOAD_MAX_REQUEST_SIZE_MB', '200')) * 1024 * 1024
+UPLOAD_IMAGE_FORMATS = ('JPEG', 'MPO', 'PNG', 'WEBP', 'GIF')
+# Baseline JPEG уменьшается при декодировании, его порог выше; PNG, WebP
+# и прогрессивный JPEG распаковываются целиком (3 байта на пиксель)
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', str(100_000_000)))
+IMAGE_MAX_DECODE_PIXELS = int(os.environ.get('IMAGE_MAX_DECODE_PIXELS', str(30_000_000)))
+
+# Обработка загрузок по приложениям (ads/images.process_upload): длинная
+# сторона в px и целевой размер JPEG. Иконки и логотипы остаются PNG,
+# чтобы не потерять прозрачность.
+IMAGE_UPLOAD_POLICIES = {
+    'ads': {'max_edge': AD_IMAGE_MAX_EDGE, 'target_size': 300 * 1024},
+    'business': {
+        'max_edge': int(os.environ.get('BUSINESS_IMAGE_MAX_EDGE', '1600')),
+        'target_size': int(os.environ.get('BUSINESS_IMAGE_TARGET_KB', '400')) * 1024,
+    },
+    'icons': {'max_edge': 512, 'format': 'PNG'},
+}
+
+# Холодный архив истекших объявлений (ads/archive.py): очистка переносит
+# объявления в отдельный SQLite-файл вместо удаления без следа
+ARCHIVE_EXPIRED_ADS = os.environ.get('ARCHIVE_EXPIRED_ADS', '0') == '1'
+AD_ARCHIVE_PATH = os.environ.get('AD_ARCHIVE_PATH', os.path.join(BASE_DIR, 'archive', 'ads_archive.sqlite3'))
+# Сколько дней архив держит файлы фото для восстановления (purge_archived_media)
+AD_ARCHIVE_MEDIA_DAYS = int(os.environ.get('AD_ARCHIVE_MEDIA_DAYS', '90'))
 
 CRONJOBS = [
-    ('0 0 * * *', 'django.core.management.call_command', ['count_expired_ads', '--cleanup']),
+    # Небольшие проходы каждые 10 минут вместо одной большой ночной очистки
+    ('*/10 * * * *', 'django.core.management.call_command', ['cleanup_expired_ads', '--max-seconds', '120']),
+    ('30 0 * * *', 'django.core.management.call_command', ['prune_ad_tombstones']),
+    ('45 0 * * *', 'django.core.management.call_command', ['purge_archived_media']),
+    # Подстраховка для режима async, если постоянный воркер не запущен
+    ('* * * * *', 'django.core.management.call_command', ['process_image_jobs', '--once', '--max-seconds', '50']),
+    # Файлы, оставшиеся после удаления фото queryset-ом и замены фото бизнеса
+    ('0 4 * * 0', 'django.core.management.call_command', ['collect_orphan_media']),
 ]
\ No newline at end of file